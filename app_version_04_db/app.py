@@ -1,20 +1,51 @@
+import asyncio
 import base64
 import json
-import mimetypes
+import time
 import uuid
 from datetime import datetime
 from pathlib import Path
-from tempfile import NamedTemporaryFile
 import secrets
-import requests
 from dotenv import load_dotenv
 
 load_dotenv()  # Add this line
 
-from nicegui import ui, app, background_tasks, run
+from nicegui import ui, app, background_tasks, run, Client
+from fastapi import Request
+from fastapi.responses import PlainTextResponse
 from generate_notes import generate_notes_from_content
 from extract_content import send_msg_to_ai
-from generate_word_file import generate_word_file
+from notes_renderers import RENDERERS, get_renderer, render_notes
+from retry import Deadline
+from backend_health import backend_health
+from error_reporter import report_error
+from upload_stream import store_upload, UploadRejected, UploadLimitMiddleware
+from pdf_preflight import analyze_pdf, preflight_summary
+from pdf_slimming import needs_slimming, slim_pdf
+from document_index import find_matching_document, remember_document, load_cached_notes
+from tracing import tracer, carry_context
+from loop_watchdog import watch_event_loop
+from metering import token_meter, estimate_job_tokens, reserve_tokens, release_tokens
+from fair_scheduler import fair_scheduler
+from credential_pool import get_key_usage
+from migrations import migrate_on_startup, index_usage
+from job_store import (
+    ACTIVE_STATUSES,
+    create_job,
+    update_job,
+    get_job,
+    load_shared_session,
+    save_shared_session,
+    keep_jobs_alive,
+)
+from metrics import (
+    registry,
+    render_metrics,
+    jobs_total,
+    stage_duration,
+    jobs_queued,
+    notes_cache_lookups,
+)
 
 from db_auth import MongoUserAuth
 
@@ -22,6 +53,8 @@ from db_logger import (
     start_file_processing,
     log_processing_success,
     log_processing_failure,
+    log_pdf_slimming,
+    log_notes_reused,
     file_logger,
 )
 
@@ -29,8 +62,6 @@ from db_logger import (
 user_auth = MongoUserAuth()
 
 
-# Import libraries for page counting
-import fitz  # PyMuPDF for PDFs
 import hashlib
 import os
 
@@ -43,42 +74,89 @@ app.add_static_files('/assets', os.path.join(os.path.dirname(__file__), 'assets'
 # Defined range for n.o of allowed pages per generation
 MAX_PAGES = 25
 MAX_FILE_SIZE_MB = 50  # Additional safety check
+MAX_FILE_SIZE_BYTES = MAX_FILE_SIZE_MB * 1024 * 1024
 
-# Count number of pages in the uploaded file
-def count_pages(file_path):
-    """Count pages in PDF files only"""
-    try:
-        if Path(file_path).suffix.lower() != '.pdf':
-            return 0, "Only PDF files are supported"
+# Cut off oversized uploads while they are still being received
+app.add_middleware(UploadLimitMiddleware, max_bytes=MAX_FILE_SIZE_BYTES)
+
+# --- Metrics ---
+# Prometheus scrape endpoint; set METRICS_TOKEN to require "Authorization: Bearer <token>"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+registry.gauge("notescraft_active_sessions", "Browser tabs connected to this server",
+               callback=lambda: sum(1 for client in list(Client.instances.values()) if client.has_socket_connection))
+registry.gauge("notescraft_jobs_active", "Jobs holding an admission slot",
+               callback=lambda: backend_health.get_summary()["active_jobs"])
+registry.gauge("notescraft_jobs_capacity", "Admission slots while the AI backend recovers",
+               callback=lambda: backend_health.get_summary()["capacity"])
+
+
+@app.get('/metrics')
+def metrics_endpoint(request: Request):
+    if METRICS_TOKEN and request.headers.get('authorization') != f"Bearer {METRICS_TOKEN}":
+        return PlainTextResponse('Unauthorized', status_code=401)
+    return PlainTextResponse(render_metrics(), media_type='text/plain; version=0.0.4')
+
+
+# Event-loop lag, and stack samples of callbacks that block the loop (see loop_watchdog)
+app.on_startup(watch_event_loop)
+
+# Mongo is connected on first use; collections, indexes and validators are brought up to
+# date once per schema version, in the background so the server takes requests right away
+# (see migrations)
+app.on_startup(migrate_on_startup)
+
+# --- Shared state ---
+# Job state lives in job_store, so every app instance can serve every client. Of a user's
+# session only these keys matter to other instances; each instance keeps its own copy in
+# app.storage.user (a file on its disk) and syncs it with the store.
+SHARED_SESSION_KEYS = ('user_logged_in', 'user_email', 'admin_logged_in', 'output_format', 'job_id')
+
+# Keep the jobs running here from being taken for lost by the other instances
+app.on_startup(keep_jobs_alive)
+
+# Trace of each confirmed upload until its background job takes it over, by job id. Live
+# spans stay in this process: app.storage.user is written to disk and partly shared.
+job_traces = {}
+
+
+async def load_session():
+    """app.storage.user, updated with what other instances stored for this browser"""
+    session = app.storage.user
+    session.update(await run.io_bound(load_shared_session, app.storage.browser['id']))
+    return session
+
+
+async def share_session(*keys):
+    """Publish these session keys to the other instances"""
+    session = app.storage.user
+    fields = {key: session.get(key) for key in keys or SHARED_SESSION_KEYS}
+    await run.io_bound(save_shared_session, app.storage.browser['id'], fields)
 
-        doc = fitz.open(file_path)
-        page_count = doc.page_count
-        doc.close()
-        return page_count, None
-    except Exception as e:
-        return 0, f"Error reading PDF: {str(e)}"
 
 # Validate if file size is in defined range
-def validate_file(file_path, file_size_bytes):
+async def validate_file(file_path, file_size_bytes):
     """
     Validate uploaded file against size and page limits
-    Returns: (is_valid, error_message, page_count)
+    Returns: (is_valid, error_message, preflight)
     """
     # Check file size first (quick check)
     file_size_mb = file_size_bytes / (1024 * 1024)
     if file_size_mb > MAX_FILE_SIZE_MB:
-        return False, f"File too large ({file_size_mb:.1f}MB). Maximum size is {MAX_FILE_SIZE_MB}MB.", 0
+        return False, f"File too large ({file_size_mb:.1f}MB). Maximum size is {MAX_FILE_SIZE_MB}MB.", None
 
-    # Count pages
-    page_count, error = count_pages(file_path)
+    # Pre-flight analysis (pages, text density, scans, outline) in a worker process
+    # so big PDFs don't block the event loop
+    preflight, error = await run.cpu_bound(analyze_pdf, file_path, MAX_PAGES)
 
     if error:
-        return False, error, 0
+        return False, error, None
 
+    page_count = preflight["page_count"]
     if page_count > MAX_PAGES:
-        return False, f"Document has {page_count} pages. Maximum allowed is {MAX_PAGES} pages.", page_count
+        return False, f"Document has {page_count} pages. Maximum allowed is {MAX_PAGES} pages.", preflight
 
-    return True, None, page_count
+    return True, None, preflight
 
 
 # Add Users
@@ -124,7 +202,7 @@ def show_beautiful_user_login():
 
                     error_label = ui.label('').classes('text-red-500 text-center text-sm')
 
-                    def handle_login():
+                    async def handle_login():
                         session = app.storage.user
                         email = email_input.value.strip().lower()
                         password = password_input.value
@@ -136,6 +214,7 @@ def show_beautiful_user_login():
                         if user_auth.verify_user(email, password) and user_auth.is_user_active(email):
                             session['user_logged_in'] = True
                             session['user_email'] = email
+                            await share_session('user_logged_in', 'user_email')
                             ui.navigate.to('/')
                         else:
                             error_label.text = 'Invalid credentials'
@@ -209,10 +288,10 @@ admin_auth = SecureAdminAuth()
 # Admin Panel UI
 
 @ui.page('/admin')
-def admin_page():
+async def admin_page():
     """Beautiful modern admin dashboard"""
 
-    session = app.storage.user
+    session = await load_session()
 
     if not session.get('admin_logged_in', False):
         show_beautiful_login()
@@ -251,10 +330,11 @@ def show_beautiful_login():
             password_input = ui.input('Enter Admin Password', password=True).props('outlined').classes('w-full')
             error_label = ui.label('').classes('text-red-500 text-center text-sm mt-2')
 
-            def check_password():
+            async def check_password():
                 session = app.storage.user
                 if admin_auth.verify_password(password_input.value):  # Use secure verification
                     session['admin_logged_in'] = True
+                    await share_session('admin_logged_in')
                     ui.navigate.to('/admin')
                 else:
                     error_label.text = 'Incorrect password'
@@ -312,9 +392,10 @@ def show_beautiful_dashboard():
                     'px-4 py-2 bg-white rounded-lg text-indigo-600 font-medium hover:bg-indigo-50 shadow-sm'
                 )
 
-                def logout():
+                async def logout():
                     session = app.storage.user
                     session['admin_logged_in'] = False
+                    await share_session('admin_logged_in')
                     ui.navigate.to('/admin')
 
                 ui.button('Logout', on_click=logout).props('outline').classes(
@@ -518,8 +599,84 @@ def show_beautiful_dashboard():
                             ui.label('Total').classes('font-bold')
                             ui.label(f'{total_tokens:,}').classes('font-bold text-gray-800 text-lg')
 
+                        # Saved by reusing generated topics
+                        tokens_saved = stats.get("total_tokens_saved", 0)
+                        if tokens_saved:
+                            saved_share = tokens_saved / (tokens_saved + stats["total_generation_tokens"])
+                            with ui.row().classes('items-center justify-between'):
+                                with ui.row().classes('items-center gap-2'):
+                                    ui.icon('savings').classes('text-emerald-500')
+                                    ui.label('Saved by topic cache').classes('font-medium')
+                                ui.label(f'{tokens_saved:,} ({saved_share:.0%})').classes('font-bold text-emerald-600')
+
+            # Top Failure Causes
+            top_errors = file_logger.get_top_errors(5)
+            if top_errors:
+                with ui.card().classes('glass-card p-6 w-full mb-8'):
+                    ui.label('Top Failure Causes').classes('text-xl font-bold text-gray-800 mb-4')
+
+                    with ui.column().classes('w-full gap-3'):
+                        for error in top_errors:
+                            with ui.row().classes('w-full items-center justify-between'):
+                                with ui.column().classes('gap-0'):
+                                    ui.label(f"{error.get('error_type', 'UNKNOWN_ERROR')} · {error.get('context', '')}").classes(
+                                        'font-medium text-gray-800')
+                                    ui.label(error.get('template', '')).classes('text-xs text-gray-500 font-mono')
+                                    ui.label(f"Last seen: {error.get('last_seen', '')[:16].replace('T', ' ')}").classes(
+                                        'text-xs text-gray-400')
+                                ui.label(str(error.get('count', 0))).classes('font-bold text-red-600 text-lg')
+
+            # Token Usage Today
+            top_users = token_meter.get_top_users(limit=5)
+            if top_users:
+                with ui.card().classes('glass-card p-6 w-full mb-8'):
+                    ui.label('Token Usage Today').classes('text-xl font-bold text-gray-800 mb-4')
+
+                    with ui.column().classes('w-full gap-3'):
+                        for usage in top_users:
+                            with ui.row().classes('w-full items-center justify-between'):
+                                with ui.column().classes('gap-0'):
+                                    ui.label(usage['user_email']).classes('font-medium text-gray-800')
+                                    ui.label(f"{usage['jobs']} jobs · ${usage['cost_usd']:.2f}").classes(
+                                        'text-xs text-gray-500')
+                                ui.label(f"{usage['total_tokens']:,}").classes('font-bold text-purple-600 text-lg')
+
+            # API Key Pool
+            key_usage = get_key_usage()
+            if len(key_usage) > 1:
+                with ui.card().classes('glass-card p-6 w-full mb-8'):
+                    ui.label('API Keys').classes('text-xl font-bold text-gray-800 mb-4')
+
+                    with ui.column().classes('w-full gap-3'):
+                        for key in key_usage:
+                            state_color = 'text-green-600' if key['state'] == 'active' else 'text-red-600'
+                            with ui.row().classes('w-full items-center justify-between'):
+                                with ui.column().classes('gap-0'):
+                                    ui.label(f"{key['name']} ({key['key']})").classes('font-medium text-gray-800')
+                                    ui.label(f"{key['requests']} requests · {key['failures']} failed · "
+                                             f"{key['input_tokens'] + key['output_tokens']:,} tokens").classes(
+                                        'text-xs text-gray-500')
+                                ui.label(key['state']).classes(f'font-bold {state_color}')
+
+            # Index Usage
+            indexes = index_usage()
+            if indexes:
+                state_colors = {'used': 'text-green-600', 'ttl': 'text-gray-500', 'built': 'text-gray-500', 'unused': 'text-yellow-600',
+                                'missing': 'text-red-600', 'undeclared': 'text-yellow-600'}
+                with ui.card().classes('glass-card p-6 w-full mb-8'):
+                    ui.label('Index Usage').classes('text-xl font-bold text-gray-800 mb-4')
+
+                    with ui.column().classes('w-full gap-2'):
+                        for entry in indexes:
+                            with ui.row().classes('w-full items-center justify-between'):
+                                ui.label(f"{entry['collection']}.{entry['index']}").classes(
+                                    'text-sm font-mono text-gray-800')
+                                ops = '-' if entry['ops'] is None else f"{entry['ops']:,}"
+                                ui.label(f"{ops} · {entry['state']}").classes(
+                                    f"text-sm font-medium {state_colors[entry['state']]}")
+
             # File Processing History
-            logs = file_logger.read_logs()
+            logs = file_logger.read_logs(limit=10)
 
             if not logs:
                 with ui.card().classes('glass-card p-12 text-center'):
@@ -531,13 +688,11 @@ def show_beautiful_dashboard():
             # Files Section Header
             with ui.row().classes('w-full items-center justify-between mb-6'):
                 ui.label('Recent File Processing').classes('text-2xl font-bold text-gray-800')
-                ui.label(f'{len(logs)} files processed').classes('text-gray-600')
+                ui.label(f"{stats['total_processed']} files processed").classes('text-gray-600')
 
             # Files Grid
-            recent_logs = sorted(logs, key=lambda x: x.get('start_time', ''), reverse=True)[:10]
-
             with ui.column().classes('w-full gap-4'):
-                for log in recent_logs:
+                for log in logs:
                     show_beautiful_file_card(log)
 
 
@@ -761,9 +916,9 @@ def add_user_management_to_admin():
 
 # Main App UI
 @ui.page('/')
-def main_page():
+async def main_page():
     """Protected main page - checks login first"""
-    session = app.storage.user
+    session = await load_session()
 
     # Check if user is logged in
     if not session.get('user_logged_in', False):
@@ -793,20 +948,15 @@ def main_page_content():
 
     session = app.storage.user
     session.uploaded_file_path = None
+    session.uploaded_file_hash = None
+    session.preflight = None
+    session.reuse_notes_from = None
     session.uploaded_file_name = "Notes"
+    session.estimated_tokens = None
+    session.token_reservation = None
 
     # --- Helper Functions ---
-    def report_error(Error):
-        if Error:
-            try:
-                requests.post(
-                    'https://script.google.com/macros/s/AKfycbz6Gbht0iZ4tW7lp48x3hDYCvYIDGZbOYdwnpbmyHSQjxsdZ0D0zsx7ZU84eN9n0g2T9w/exec',
-                    json={"Error": Error},
-                )
-            except Exception as e:
-                print(f"Error reporting failed: {e}")
-
-    def calculate_estimated_time(page_count, file_size_mb=None):
+    def calculate_estimated_time(page_count, file_size_mb=None, preflight=None):
         """
         Calculate estimated processing time based on actual performance data
         Returns estimated time in seconds
@@ -828,8 +978,14 @@ def main_page_content():
             # Should not happen with 25-page limit, but safety fallback
             base_time = 870
 
-        # Adjust for file complexity based on size
-        if file_size_mb:
+        # Adjust for file complexity: scanned pages have to be OCR'd by the model,
+        # pages with next to no text are quick
+        if preflight and preflight["pages"]:
+            pages = preflight["pages"]
+            scanned_share = preflight["scanned_pages"] / len(pages)
+            empty_share = sum(1 for p in pages if not p["chars"] and not p["images"]) / len(pages)
+            base_time *= 1 + 0.25 * scanned_share - 0.5 * empty_share
+        elif file_size_mb:
             if file_size_mb > 15:  # Very large files likely have complex content
                 base_time *= 1.15  # Add 15% for complexity
             elif file_size_mb > 30:  # Extremely large files
@@ -876,16 +1032,19 @@ def main_page_content():
     def reset_app():
         """Reset app to initial state with confirmation"""
 
-        def confirm_reset():
+        async def confirm_reset():
             try:
                 # Clear session data
                 session.uploaded_file_path = None
+                session.uploaded_file_hash = None
+                session.preflight = None
+                session.reuse_notes_from = None
                 session.uploaded_file_name = "Notes"
                 session.processing_session_id = None
-                session.processing_status = "idle"
-                session.processing_result = None
-                session.processing_error = None
                 session.estimated_total_time = None
+                session.download_data = None
+                session['job_id'] = None
+                await share_session('job_id')
 
                 # Reset UI elements
                 download_button.visible = False
@@ -938,25 +1097,40 @@ def main_page_content():
 
         reset_dialog.open()
 
-    def check_processing_status():
+    async def check_processing_status():
         """
-        Enhanced polling function with time estimation
+        Enhanced polling function with time estimation.
+        Reads the job from job_store, so it follows jobs running on any instance.
         """
         try:
-            if not hasattr(session, 'processing_status'):
+            job = await run.io_bound(get_job, session.get('job_id'))
+            if not job:
                 return
 
-            status = session.processing_status
+            status = job["status"]
 
             # Get estimated time if we have page count
-            if hasattr(session, 'estimated_total_time') and session.estimated_total_time:
-                total_time = session.estimated_total_time
+            if job.get("estimated_total_time"):
+                total_time = job["estimated_total_time"]
                 progress, time_remaining = get_step_progress_info(status, total_time)
                 time_text = format_time_remaining(time_remaining)
             else:
                 time_text = ""
 
-            if status == "extracting":
+            if status == "queued":
+                text_extraction_animation.visible = True
+                notes_generation_animation.visible = False
+                word_file_generation_animation.visible = False
+                status_label.text = "⏳ Our AI service is busy - your file is queued and will start shortly..."
+                queue_position = job.get("queue_position")
+                if queue_position:
+                    position, wait_seconds = queue_position
+                    time_label.text = f"#{position} in line · starts in ~{format_time_remaining(wait_seconds)}"
+                    time_label.visible = True
+                else:
+                    time_label.visible = False
+
+            elif status == "extracting":
                 text_extraction_animation.visible = True
                 notes_generation_animation.visible = False
                 word_file_generation_animation.visible = False
@@ -982,7 +1156,8 @@ def main_page_content():
                 text_extraction_animation.visible = False
                 notes_generation_animation.visible = False
                 word_file_generation_animation.visible = True
-                status_label.text = "📕 Preparing Word file..."
+                output_label = get_renderer(job.get("output_format", 'docx'))['label']
+                status_label.text = f"📕 Preparing {output_label}..."
                 if time_text:
                     time_label.text = f"Time remaining: ~{time_text}"
                     time_label.visible = True
@@ -999,9 +1174,10 @@ def main_page_content():
                 # Switch to file ready warning
                 ui.timer(0.1, lambda: ui.run_javascript('window.fileReadyForDownload()'), once=True)
 
-                result = session.processing_result
+                result = job["result"]
 
                 # Store download data in session for the persistent handler
+                session.processing_session_id = job["_id"]
                 session.download_data = {
                     "base64_data": result['base64_data'],
                     "mime_type": result['mime_type'],
@@ -1012,8 +1188,6 @@ def main_page_content():
                 feedback_button.visible = True
                 reset_button.visible = True
                 status_label.text = "✅ Your Notes are Ready!"
-
-                session.processing_status = "idle"
                 return
 
             elif status == "error":
@@ -1027,7 +1201,7 @@ def main_page_content():
                 # Disable browser close warning (fire and forget)
                 # ui.timer(0.1, lambda: ui.run_javascript('window.stopProcessing()'), once=True)
 
-                error = session.processing_error
+                error = job["error"]
                 if error:
                     error_type = error.get("error_type", "")
                     user_message = error.get("user_message", "An error occurred")
@@ -1044,12 +1218,10 @@ def main_page_content():
                 status_label.text = ""
                 error_report_button.visible = True
                 try_again_button.visible = True
-
-                session.processing_status = "idle"
                 return
 
             # Continue polling if still processing
-            if status in ["starting", "extracting", "generating", "creating_file"]:
+            if status in ACTIVE_STATUSES:
                 ui.timer(1.0, check_processing_status, once=True)
 
         except Exception as e:
@@ -1062,55 +1234,255 @@ def main_page_content():
             ui.notify(message='Please Upload a File', type='warning')
             return
 
+        # Don't start a job that would only fail minutes later
+        if backend_health.is_down():
+            ui.notify(f"⚠️ {backend_health.status_message()}", type='warning', timeout=8000)
+            return
+
+        # Reserve the job's estimated tokens against the user's daily quota (saved notes are free)
+        session.token_reservation = None
+        if not session.reuse_notes_from:
+            reservation, quota_message = await run.io_bound(
+                reserve_tokens, session.get('user_email', 'unknown'), session.estimated_tokens or 0
+            )
+            if not reservation:
+                ui.notify(f"⚠️ {quota_message}", type='warning', timeout=10000)
+                return
+            session.token_reservation = reservation
+
         # ui.notify('Processing may take 5-10 minutes. Mobile devices may experience connection issues.', type='info',
         #           timeout=5000)
 
-        # Set up processing state
-        session.processing_status = "starting"
-        session.processing_result = None
-        session.processing_error = None
+        async def release_reservation():
+            """Give the job's token reservation back to the user's quota"""
+            if session.token_reservation:
+                try:
+                    await run.io_bound(release_tokens, session.token_reservation)
+                except Exception as e:
+                    print(f"Could not release token reservation: {e}")
+                session.token_reservation = None
+
+        # Set up processing state, kept in job_store so any instance can show it
+        job_id = session.processing_session_id
+        job_state = {"status": "starting"}
+
+        async def set_job_status(status, **fields):
+            """Record the job's progress for the polling function (job_store is written off the event loop)"""
+            job_state["status"] = status
+            await run.io_bound(update_job, job_id, status=status, **fields)
+
+        # The background job's finally releases the reservation; until it starts, failures release it here
+        try:
+            await run.io_bound(create_job, job_id, session.get('user_email', 'unknown'),
+                               filename=session.uploaded_file_name,
+                               output_format=session.get('output_format', 'docx'),
+                               estimated_total_time=session.estimated_total_time)
+            session['job_id'] = job_id
+            await share_session('job_id')
+
+            # Start UI updates immediately (before background task)
+            generate_button.visible = False
+            text_extraction_animation.visible = True
+            status_label.text = "Extracting content from the document..."
+
+            # Enable browser close warning
+            # await ui.run_javascript('window.startProcessing()')
+
+            # Add mobile guidance notification for all users (simple approach)
+            ui.notify('📱 Mobile users: Keep this tab active and screen on during processing to avoid interruptions.',
+                      type='info', timeout=10000)
+        except Exception:
+            await release_reservation()
+            raise
+
+        async def create_notes_file(notes_generated):
+            """Render the notes in the chosen format and hand them to the polling function"""
+            await set_job_status("creating_file")
+
+            try:
+                output_format = session.get('output_format', 'docx')
+                renderer = get_renderer(output_format)
+
+                unique_name = f"{session.uploaded_file_name}_{uuid.uuid4().hex[:6]}"
+                with tracer.span("render", format=output_format), stage_duration.time(stage="render"):
+                    file_generated = await run.io_bound(carry_context(render_notes), notes_generated,
+                                                        unique_name.replace(' ', '_'), output_format)
+
+                # Prepare download
+                with tracer.span("base64_encode") as encode_span:
+                    with open(file_generated, 'rb') as f:
+                        file_content = f.read()
+                    os.remove(file_generated)
+
+                    base64_data = base64.b64encode(file_content).decode('utf-8')
+                    encode_span.set_attribute("bytes", len(file_content))
+                mime_type = renderer["mime_type"]
 
-        # Start UI updates immediately (before background task)
-        generate_button.visible = False
-        text_extraction_animation.visible = True
-        status_label.text = "Extracting content from the document..."
+                await run.io_bound(log_processing_success, session.processing_session_id)
 
-        # Enable browser close warning
-        # await ui.run_javascript('window.startProcessing()')
+                # Store result for polling function (a few hundred KB; documents cap at 16MB)
+                await set_job_status("completed", result={
+                    "base64_data": base64_data,
+                    "mime_type": mime_type,
+                    "filename": f"{session.uploaded_file_name}_Notes.{renderer['extension']}"
+                })
 
-        # Add mobile guidance notification for all users (simple approach)
-        ui.notify('📱 Mobile users: Keep this tab active and screen on during processing to avoid interruptions.',
-                  type='info', timeout=10000)
+            except Exception as e:
+                await run.io_bound(
+                    log_processing_failure,
+                    session.processing_session_id,
+                    "WORD_FILE_ERROR",
+                    f"Word file creation error: {str(e)}",
+                    "word_generation"
+                )
+
+                report_error(f"Word File Creation Error: {str(e)}")
+                await set_job_status("error", error={
+                    "error_type": "WORD_FILE_ERROR",
+                    "user_message": "Almost there! Had trouble creating the Word file. Let's retry.",
+                    "technical_error": str(e)
+                })
 
         async def background_job():
             """
             Pure background processing - NO UI UPDATES AT ALL
-            Only sets session variables that the polling function can read
+            Only records job state (set_job_status) that the polling function can read
             """
+            admitted = False
+            user_email = session.get('user_email', 'unknown')
+            # File sent for extraction: the upload, or the slimmed copy of it (slim_path, ours to delete)
+            extraction_file_path = session.uploaded_file_path
+            slim_path = None
+            # Everything below (and the worker threads it starts) reports into the upload's trace
+            job_trace = job_traces.pop(job_id, None)
+            tracer.attach(job_trace)
+            # Gemini calls of this job (and its worker threads) are charged to the user
+            token_meter.attach(user_email)
+            job_started = time.perf_counter()
+            admitted_at = None
+            reused = False
             try:
-                session.processing_status = "extracting"
+                # --- SAVED NOTES ---
+                # The user chose the notes of an already processed copy of this document
+                if session.reuse_notes_from:
+                    with tracer.span("saved_notes_load"):
+                        notes_generated = await run.io_bound(carry_context(load_cached_notes),
+                                                             session.reuse_notes_from)
+                    if notes_generated:
+                        await run.io_bound(log_notes_reused, session.processing_session_id, session.reuse_notes_from)
+                        await create_notes_file(notes_generated)
+                        reused = True
+                        return
+
+                    # The saved notes are gone (e.g. expired since they were offered), so this is
+                    # a normal job now and needs the token reservation process_with_ai skipped
+                    reservation, quota_message = await run.io_bound(
+                        reserve_tokens, user_email, session.estimated_tokens or 0
+                    )
+                    if not reservation:
+                        await run.io_bound(
+                            log_processing_failure,
+                            session.processing_session_id,
+                            "TOKEN_QUOTA_EXCEEDED",
+                            f"Saved notes unavailable and quota refused: {quota_message}",
+                            "admission"
+                        )
+                        await set_job_status("error", error={
+                            "error_type": "PROCESSING_ERROR",
+                            "user_message": quota_message,
+                            "technical_error": "Token quota refused"
+                        })
+                        return
+                    session.token_reservation = reservation
+
+                # --- ADMISSION ---
+                # Wait for a free slot while the AI backend is ramping back up, in fair-share
+                # order between users; give up straight away if it goes down while we wait
+                queued = False
+                await fair_scheduler.enqueue_job(job_id, user_email)
+                with tracer.span("admission"), stage_duration.time(stage="admission"):
+                    try:
+                        while True:
+                            if fair_scheduler.is_next_job(job_id):
+                                admitted, reason = backend_health.try_admit()
+                            else:
+                                reason = "down" if backend_health.is_down() else "busy"
+                            if admitted:
+                                fair_scheduler.job_admitted(job_id)
+                                admitted_at = time.perf_counter()
+                                break
+                            if reason == "down":
+                                await run.io_bound(
+                                    log_processing_failure,
+                                    session.processing_session_id,
+                                    backend_health.last_error_type or "API_CONNECTION_ERROR",
+                                    "Job rejected: AI backend circuit open",
+                                    "admission"
+                                )
+                                await set_job_status("error", error={
+                                    "error_type": "PROCESSING_ERROR",
+                                    "user_message": backend_health.status_message(),
+                                    "technical_error": "AI backend circuit open"
+                                })
+                                return
+                            if not queued:
+                                jobs_queued.inc()
+                                queued = True
+                            position = fair_scheduler.queue_position(job_id, backend_health.get_summary()["capacity"])
+                            # Only write when something changed (the heartbeat keeps the job alive)
+                            if job_state["status"] != "queued" or job_state.get("queue_position") != position:
+                                job_state["queue_position"] = position
+                                await set_job_status("queued", queue_position=position)
+                            await asyncio.sleep(2)
+                    finally:
+                        if queued:
+                            jobs_queued.dec()
+
+                await set_job_status("extracting")
+
+                # One retry budget for the whole job (extraction + generation)
+                job_deadline = Deadline()
+
+                # --- PDF SLIMMING (image-heavy PDFs only) ---
+                if needs_slimming(session.preflight):
+                    try:
+                        with tracer.span("pdf_slimming"), stage_duration.time(stage="pdf_slimming"):
+                            slim_path, size_before, size_after = await run.cpu_bound(
+                                slim_pdf, session.uploaded_file_path, session.preflight
+                            )
+                        if slim_path:
+                            extraction_file_path = slim_path
+                        await run.io_bound(log_pdf_slimming, session.processing_session_id, size_before, size_after)
+                    except Exception as e:
+                        # Not fatal, the original upload is sent instead
+                        print(f"PDF slimming failed, sending original file: {e}")
 
                 # --- TEXT EXTRACTION ---
                 try:
-                    extracted_json = await run.io_bound(
-                        lambda: send_msg_to_ai(session.uploaded_file_path, session.processing_session_id)
-                    )
+                    with tracer.span("extraction") as extraction_span, stage_duration.time(stage="extraction"):
+                        extracted_json = await run.io_bound(carry_context(
+                            lambda: send_msg_to_ai(extraction_file_path, session.processing_session_id, job_deadline,
+                                                   session.preflight)
+                        ))
+                        extraction_span.record_result(extracted_json)
 
                     # Check if extraction returned an error
                     if isinstance(extracted_json, dict) and "error_type" in extracted_json:
-                        log_processing_failure(
+                        await run.io_bound(
+                            log_processing_failure,
                             session.processing_session_id,
                             extracted_json["error_type"],
                             extracted_json["technical_error"],
-                            "extraction"
+                            "extraction",
+                            extracted_json.get("fingerprint")
                         )
 
-                        session.processing_status = "error"
-                        session.processing_error = extracted_json
+                        await set_job_status("error", error=extracted_json)
                         return
 
                 except Exception as e:
-                    log_processing_failure(
+                    await run.io_bound(
+                        log_processing_failure,
                         session.processing_session_id,
                         "UNEXPECTED_ERROR",
                         f"Unexpected extraction error: {str(e)}",
@@ -1118,38 +1490,44 @@ def main_page_content():
                     )
                     report_error(f"Unexpected Background Error: {str(e)}")
 
-                    session.processing_status = "error"
-                    session.processing_error = {
+                    await set_job_status("error", error={
                         "error_type": "UNEXPECTED_ERROR",
                         "user_message": "Something unexpected happened. Please try again!",
                         "technical_error": str(e)
-                    }
+                    })
                     return
 
                 # --- NOTES GENERATION ---
-                session.processing_status = "generating"
+                await set_job_status("generating")
 
                 try:
-                    notes_generated = await run.io_bound(
-                        lambda: generate_notes_from_content(extracted_json, session.processing_session_id)
-                    )
+                    with tracer.span("generation", topics=len(extracted_json)) as generation_span, \
+                            stage_duration.time(stage="generation"):
+                        # On the scheduler's own threads: topics wait there for their generation slots
+                        notes_generated = await fair_scheduler.run_generation(carry_context(
+                            lambda: generate_notes_from_content(extracted_json, session.processing_session_id,
+                                                                job_deadline, user_email)
+                        ))
+                        generation_span.record_result(notes_generated)
 
                     # Check if notes generation returned an error
                     if isinstance(notes_generated, dict) and "error_type" in notes_generated:
-                        log_processing_failure(
+                        await run.io_bound(
+                            log_processing_failure,
                             session.processing_session_id,
                             notes_generated["error_type"],
                             notes_generated["technical_error"],
-                            "generation"
+                            "generation",
+                            notes_generated.get("fingerprint")
                         )
 
-                        session.processing_status = "error"
-                        session.processing_error = notes_generated
+                        await set_job_status("error", error=notes_generated)
                         return
 
                     # Additional validation for empty notes
                     if not notes_generated:
-                        log_processing_failure(
+                        await run.io_bound(
+                            log_processing_failure,
                             session.processing_session_id,
                             "NOTES_GENERATION_ERROR",
                             "Notes generation returned empty content",
@@ -1157,16 +1535,16 @@ def main_page_content():
                         )
 
                         report_error("Notes Generation Error: Empty content returned")
-                        session.processing_status = "error"
-                        session.processing_error = {
+                        await set_job_status("error", error={
                             "error_type": "NOTES_GENERATION_ERROR",
                             "user_message": "We couldn't generate any notes from your document. Let's try again!",
                             "technical_error": "Empty content returned"
-                        }
+                        })
                         return
 
                 except Exception as e:
-                    log_processing_failure(
+                    await run.io_bound(
+                        log_processing_failure,
                         session.processing_session_id,
                         "UNEXPECTED_ERROR",
                         f"Unexpected generation error: {str(e)}",
@@ -1174,62 +1552,36 @@ def main_page_content():
                     )
 
                     report_error(f"Notes Generation Error: {str(e)}")
-                    session.processing_status = "error"
-                    session.processing_error = {
+                    await set_job_status("error", error={
                         "error_type": "UNEXPECTED_ERROR",
                         "user_message": "We encountered an issue while generating your notes. Please try again.",
                         "technical_error": str(e)
-                    }
+                    })
                     return
 
-                # --- WORD FILE CREATION ---
-                session.processing_status = "creating_file"
-
+                # --- NOTES CACHE ---
+                # Keep the notes so re-uploads of this document (or near copies) are instant
                 try:
-                    unique_name = f"{session.uploaded_file_name}_{uuid.uuid4().hex[:6]}.docx"
-                    file_generated = await run.io_bound(generate_word_file, notes_generated,
-                                                        file_name=unique_name.replace(' ', '_'))
-
-                    # Prepare download
-                    with open(file_generated, 'rb') as f:
-                        file_content = f.read()
-                    os.remove(file_generated)
-
-                    base64_data = base64.b64encode(file_content).decode('utf-8')
-                    mime_type = mimetypes.guess_type("Notes.docx")[0] or "application/octet-stream"
-
-                    log_processing_success(session.processing_session_id)
-
-                    # Store result for polling function
-                    session.processing_result = {
-                        "base64_data": base64_data,
-                        "mime_type": mime_type,
-                        "filename": f"{session.uploaded_file_name}_Notes.docx"
-                    }
-                    session.processing_status = "completed"
-
+                    with tracer.span("notes_cache_store"):
+                        await run.io_bound(
+                            carry_context(remember_document),
+                            session.uploaded_file_hash,
+                            (session.preflight or {}).get("signature"),
+                            notes_generated,
+                            session.processing_session_id
+                        )
                 except Exception as e:
-                    log_processing_failure(
-                        session.processing_session_id,
-                        "WORD_FILE_ERROR",
-                        f"Word file creation error: {str(e)}",
-                        "word_generation"
-                    )
+                    print(f"Could not cache notes: {e}")
 
-                    report_error(f"Word File Creation Error: {str(e)}")
-                    session.processing_status = "error"
-                    session.processing_error = {
-                        "error_type": "WORD_FILE_ERROR",
-                        "user_message": "Almost there! Had trouble creating the Word file. Let's retry.",
-                        "technical_error": str(e)
-                    }
-                    return
+                # --- WORD FILE CREATION ---
+                await create_notes_file(notes_generated)
 
             except Exception as e:
                 # Final catch-all error handler
                 print(f"CRITICAL ERROR IN BACKGROUND JOB: {str(e)}")
 
-                log_processing_failure(
+                await run.io_bound(
+                    log_processing_failure,
                     session.processing_session_id,
                     "SYSTEM_ERROR",
                     f"Critical system error: {str(e)}",
@@ -1237,18 +1589,37 @@ def main_page_content():
                 )
 
                 report_error(f"CRITICAL System Error: {str(e)}")
-                session.processing_status = "error"
-                session.processing_error = {
+                await set_job_status("error", error={
                     "error_type": "SYSTEM_ERROR",
                     "user_message": "Something unexpected happened on our end. We're on it!",
                     "technical_error": str(e)
-                }
+                })
+
+            finally:
+                if admitted:
+                    backend_health.release()
+                fair_scheduler.job_finished(job_id, user_email, admitted=admitted,
+                                            seconds=admitted_at and time.perf_counter() - admitted_at)
+                if slim_path:
+                    slim_path.unlink(missing_ok=True)
+                failed = job_state["status"] == "error"
+                tracer.end_trace(job_trace, status="error" if failed else None)
+                jobs_total.inc(status="failed" if failed else "reused" if reused else "completed")
+                stage_duration.observe(time.perf_counter() - job_started, stage="job")
+
+                if session.token_reservation and not failed and not reused:
+                    token_meter.calibrate(session.preflight, token_meter.current_job_usage()["tokens"])
+                await release_reservation()
 
         # Start the background job
-        background_tasks.create(background_job())
+        try:
+            background_tasks.create(background_job())
+        except Exception:
+            await release_reservation()
+            raise
 
         # Start polling for updates (this runs in main UI thread)
-        check_processing_status()
+        await check_processing_status()
 
     # --- UI Layout ---
     with ui.column().classes(
@@ -1267,70 +1638,111 @@ def main_page_content():
                 'w-full max-w-2xl sm:max-w-3xl mx-auto p-6 sm:p-8 bg-white/90 backdrop-blur-lg shadow-2xl rounded-3xl border border-gray-200 flex flex-col items-center space-y-4'):
             upload_container = ui.column().classes('w-full items-center')
 
-            def handle_upload(e):
+            async def handle_upload(e):
+                # Shed load early while the AI backend is down
+                if backend_health.is_down():
+                    ui.notify(f"⚠️ {backend_health.status_message()}", type="warning", timeout=8000)
+                    return
+
                 # Store file details temporarily for confirmation
                 temp_file_name = e.name
-                temp_content = e.content.read()
+                suffix = Path(temp_file_name).suffix or ".pdf"
 
-                if not temp_content:
-                    ui.notify("⚠️ Upload failed: empty file received.", type="warning")
+                # One trace per upload, ended when its job finishes (or the upload is dropped)
+                job_trace = tracer.start_trace("job", file=temp_file_name)
+                tracer.attach(job_trace)
+
+                # Stream the upload to disk in chunks (hashing as we go) instead of reading it into memory
+                try:
+                    with tracer.span("upload") as upload_span, stage_duration.time(stage="upload"):
+                        stored = await run.io_bound(store_upload, e.content, suffix, MAX_FILE_SIZE_BYTES)
+                        upload_span.set_attribute("bytes", stored.size)
+                except UploadRejected as rejected:
+                    tracer.end_trace(job_trace, status="rejected")
+                    jobs_total.inc(status="rejected")
+                    ui.notify(f"⚠️ {rejected}", type="negative", timeout=5000)
                     return
 
-                file_size = len(temp_content)
-                suffix = Path(temp_file_name).suffix or ".pdf"
+                if not stored.size:
+                    stored.discard()
+                    tracer.end_trace(job_trace, status="rejected")
+                    jobs_total.inc(status="rejected")
+                    ui.notify("⚠️ Upload failed: empty file received.", type="warning")
+                    return
 
-                # Create temporary file for validation
-                with NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
-                    temp_file.write(temp_content)
-                    temp_file.flush()
-                    os.fsync(temp_file.fileno())
-                    temp_file_path = Path(temp_file.name)
+                file_size = stored.size
+                temp_file_path = stored.path
 
                 # Validate file before showing confirmation
-                is_valid, error_msg, page_count = validate_file(temp_file_path, file_size)
+                with tracer.span("validation"), stage_duration.time(stage="validation"):
+                    is_valid, error_msg, preflight = await validate_file(temp_file_path, file_size)
 
                 if not is_valid:
                     # Clean up temp file and show error
-                    os.unlink(temp_file_path)
+                    stored.discard()
+                    tracer.end_trace(job_trace, status="rejected")
+                    jobs_total.inc(status="rejected")
                     ui.notify(f"⚠️ {error_msg}", type="negative", timeout=5000)
                     return
 
+                page_count = preflight["page_count"]
+
                 # Calculate estimated time for display
-                estimated_time_seconds = calculate_estimated_time(page_count, file_size / (1024 * 1024))
+                estimated_time_seconds = calculate_estimated_time(page_count, file_size / (1024 * 1024), preflight)
                 estimated_time_text = format_time_remaining(estimated_time_seconds)
+                estimated_tokens = estimate_job_tokens(preflight)
+
+                # Same document (or a re-scan / re-crop of it) processed before? Offer its notes.
+                try:
+                    with tracer.span("notes_cache_lookup"):
+                        match = await run.io_bound(find_matching_document, stored.sha256, preflight["signature"])
+                except Exception as lookup_error:
+                    print(f"Notes cache lookup failed: {lookup_error}")
+                    match = None
+                notes_cache_lookups.inc(result="hit" if match else "miss")
 
                 def confirm_upload():
                     # Store in session for use during processing
                     session.estimated_total_time = estimated_time_seconds
                     session.uploaded_file_name = temp_file_name
                     session.uploaded_file_path = temp_file_path
+                    session.uploaded_file_hash = stored.sha256
+                    session.preflight = preflight
+                    session.reuse_notes_from = None
+                    session.estimated_tokens = estimated_tokens
+                    # An earlier upload of this page that was confirmed but never processed
+                    tracer.end_trace(job_traces.pop(getattr(session, 'processing_session_id', None), None),
+                                     status="cancelled")
 
                     # Get logged in user's email
                     user_email = session.get('user_email', 'unknown')
 
-                    session.processing_session_id = start_file_processing(
-                        temp_file_name,
-                        file_size / (1024 * 1024),
-                        page_count,
-                        user_email
-                    )
+                    with tracer.activate(job_trace):
+                        session.processing_session_id = start_file_processing(
+                            temp_file_name,
+                            file_size / (1024 * 1024),
+                            page_count,
+                            user_email,
+                            stored.sha256,
+                            preflight_summary(preflight)
+                        )
+                    job_trace.set_attribute("session_id", session.processing_session_id)
+                    job_trace.set_attribute("pages", page_count)
+                    job_traces[session.processing_session_id] = job_trace
 
                     # Show cleaner uploaded file UI
-                    upload_container.clear()
-                    with upload_container:
-                        with ui.card().classes(
-                                'w-full max-w-md p-6 rounded-2xl border border-emerald-200 '
-                                'bg-emerald-50 text-center shadow-md flex flex-col items-center justify-center'
-                        ):
-                            # PDF file icon
-                            ui.html('<div class="text-red-500 text-4xl mb-2">📄</div>')
-
-                            ui.label('File Uploaded').classes('text-base font-semibold text-emerald-700 mb-1')
-                            ui.label(temp_file_name).classes('text-lg font-bold text-gray-800')
+                    render_uploaded_file(temp_file_name)
+
+                async def use_saved_notes():
+                    confirm_upload()
+                    session.reuse_notes_from = match["doc_id"]
+                    await process_with_ai()
 
                 def cancel_upload():
                     # User cancelled - clean up temp file and go back to upload area
-                    os.unlink(temp_file_path)
+                    stored.discard()
+                    tracer.end_trace(job_trace, status="cancelled")
+                    jobs_total.inc(status="cancelled")
                     render_upload()
 
                 # Show inline confirmation instead of popup
@@ -1357,13 +1769,24 @@ def main_page_content():
                                 ui.label(f'{page_count} pages')
                                 ui.label('•')
                                 ui.label(f'{file_size / 1024 / 1024:.1f} MB')
+                                ui.label('•')
+                                ui.label(f'~{estimated_tokens / 1000:,.0f}k tokens')
 
                             # Processing time on separate line with clear context
                             ui.label(f'Processing time: ~{estimated_time_text}').classes(
                                 'text-sm text-blue-600 font-medium bg-blue-50 px-3 py-1 rounded-full text-center')
 
+                            if match:
+                                copy_text = 'this document' if match["similarity"] == 1.0 else 'a near-identical copy'
+                                ui.label(f'⚡ Notes for {copy_text} are ready - no need to wait').classes(
+                                    'text-sm text-emerald-700 font-medium bg-emerald-50 px-3 py-1 rounded-full text-center')
+
                         # Action buttons
-                        with ui.row().classes('gap-3'):
+                        with ui.row().classes('gap-3 justify-center'):
+                            if match:
+                                ui.button('Use Saved Notes', on_click=use_saved_notes).props('unelevated').classes(
+                                    'bg-indigo-500 text-white px-6 py-2 font-semibold rounded-lg hover:bg-indigo-600'
+                                )
                             ui.button('Confirm', on_click=confirm_upload).props('unelevated').classes(
                                 'bg-emerald-500 text-white px-6 py-2 font-semibold rounded-lg hover:bg-emerald-600'
                             )
@@ -1371,10 +1794,27 @@ def main_page_content():
                                 'text-gray-600 border-gray-400 px-6 py-2 font-semibold rounded-lg hover:bg-gray-100'
                             )
 
+            def render_uploaded_file(file_name):
+                upload_container.clear()
+                with upload_container:
+                    with ui.card().classes(
+                            'w-full max-w-md p-6 rounded-2xl border border-emerald-200 '
+                            'bg-emerald-50 text-center shadow-md flex flex-col items-center justify-center'
+                    ):
+                        # PDF file icon
+                        ui.html('<div class="text-red-500 text-4xl mb-2">📄</div>')
+
+                        ui.label('File Uploaded').classes('text-base font-semibold text-emerald-700 mb-1')
+                        ui.label(file_name).classes('text-lg font-bold text-gray-800')
+
             def render_upload():
                 upload_container.clear()
                 with upload_container:
-                    uploader = ui.upload(label='', on_upload=handle_upload, auto_upload=True, multiple=False).props(
+                    uploader = ui.upload(label='', on_upload=handle_upload, auto_upload=True, multiple=False,
+                                         max_file_size=MAX_FILE_SIZE_BYTES,
+                                         on_rejected=lambda: ui.notify(
+                                             f"⚠️ File too large. Maximum size is {MAX_FILE_SIZE_MB}MB.",
+                                             type="negative", timeout=5000)).props(
                         'accept=.pdf').classes('hidden')
 
                     with ui.card().classes(
@@ -1426,12 +1866,14 @@ def main_page_content():
             def handle_download():
                 if hasattr(session, 'download_data') and session.download_data:
                     data = session.download_data
-                    ui.run_javascript(f"""
-                        const link = document.createElement('a');
-                        link.href = "data:{data['mime_type']};base64,{data['base64_data']}";
-                        link.download = "{data['filename']}";
-                        link.click();
-                    """)
+                    with tracer.trace("download", session_id=getattr(session, 'processing_session_id', None),
+                                      bytes=len(data['base64_data'])):
+                        ui.run_javascript(f"""
+                            const link = document.createElement('a');
+                            link.href = "data:{data['mime_type']};base64,{data['base64_data']}";
+                            link.download = "{data['filename']}";
+                            link.click();
+                        """)
                     if hasattr(session, 'processing_session_id'):
                         file_logger.update_download_status(session.processing_session_id)
 
@@ -1465,6 +1907,14 @@ def main_page_content():
                 'w-full max-w-md mx-auto mt-3 px-4 py-2 text-sm font-medium shadow-sm transition-all duration-200 text-center')
             error_report_button.visible = False
 
+            # Output format - Word by default, lighter formats for phones without Word
+            if session.get('output_format') not in RENDERERS:
+                session['output_format'] = 'docx'
+            ui.toggle({name: renderer['label'] for name, renderer in RENDERERS.items()},
+                      on_change=lambda: share_session('output_format')).props(
+                'unelevated rounded no-caps toggle-color=indigo size=sm').classes(
+                'mx-auto mt-4 flex-wrap justify-center').bind_value(session, 'output_format')
+
             generate_button = ui.button('🚀 Generate Notes', on_click=process_with_ai).props(
                 'unelevated rounded color=indigo text-color=white').classes(
                 'w-full max-w-md mx-auto mt-4 sm:mt-6 px-5 py-3 text-lg font-semibold shadow-sm transition-all duration-200 text-center')
@@ -1479,9 +1929,29 @@ def main_page_content():
                 'w-full max-w-md mx-auto mt-3 px-4 py-2 text-sm font-medium shadow-sm transition-all duration-200 text-center')
             try_again_button.visible = False
 
+            async def resume_job():
+                """Show the job this browser started before a reload - possibly on another instance"""
+                job = await run.io_bound(get_job, session.get('job_id'))
+                if not job:
+                    return
+                generate_button.visible = False
+                render_uploaded_file(job.get("filename") or session.uploaded_file_name)
+                await check_processing_status()
+
+            if session.get('job_id'):
+                ui.timer(0.1, resume_job, once=True)
+
+
 
+# Every instance must sign the session cookie with the same secret, or a browser that is
+# sent to another instance gets a new session there (logged out, job gone)
+if not os.environ.get('STORAGE_SECRET'):
+    print("⚠️ STORAGE_SECRET not set - sessions won't survive a restart or carry over to other instances")
 
+# Auto-reload runs the whole app twice (a file watcher, then the server in a child process),
+# so it is for local development only: RELOAD=true
 ui.run(host='0.0.0.0', port=int(os.environ.get('PORT', 8080)),
        storage_secret=os.environ.get('STORAGE_SECRET', secrets.token_hex(32)),
+       reload=os.environ.get('RELOAD', 'false').lower() == 'true',
        title='NotesCraft AI – Smart Notes Maker')
 
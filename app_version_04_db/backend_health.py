@@ -0,0 +1,181 @@
+import os
+import threading
+import time
+
+from error_handler import error_handler
+
+
+# How many jobs may run against the AI backend at once when it is healthy
+MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", "10"))
+
+# Consecutive backend failures before we stop accepting new jobs
+FAILURE_THRESHOLD = 5
+
+# Seconds to wait before probing again, per error type (quota resets slowly)
+COOLDOWN_SECONDS = {
+    "API_RATE_LIMIT": 60,
+    "API_TIMEOUT": 60,
+    "API_CONNECTION_ERROR": 60,
+    "API_QUOTA_EXCEEDED": 30 * 60,
+}
+MAX_COOLDOWN_SECONDS = 60 * 60
+
+# Error types that mean the AI backend itself is struggling
+BACKEND_ERROR_TYPES = set(COOLDOWN_SECONDS)
+
+
+class BackendHealth:
+    """
+    Tracks AI backend health from ErrorHandler.classify_error outcomes and decides
+    whether new jobs are admitted. It is also the circuit breaker of every Gemini call
+    (retry.call_with_retry): no call goes out while it is open, and a single probe call
+    at a time while it is half open.
+
+    closed    -> healthy, up to `capacity` concurrent jobs (AIMD: rate limits halve it,
+                 successes grow it back by one)
+    open      -> backend down, new jobs are rejected until the cooldown passes
+    half_open -> one probe job at a time; a success starts ramping capacity back up
+    """
+
+    def __init__(self, max_concurrent_jobs=MAX_CONCURRENT_JOBS, failure_threshold=FAILURE_THRESHOLD):
+        self.max_concurrent_jobs = max_concurrent_jobs
+        self.failure_threshold = failure_threshold
+
+        self.state = "closed"
+        self.capacity = max_concurrent_jobs
+        self.active_jobs = 0
+        self.consecutive_failures = 0
+        self.last_error_type = None
+        self.opened_at = 0.0
+        self.cooldown = 0
+        self.probe_in_flight = False  # half_open: a call is out that decides the state
+        self.lock = threading.Lock()
+
+    def _open(self, error_type):
+        """Stop admitting jobs. Repeated opens back off the cooldown."""
+        base = COOLDOWN_SECONDS.get(error_type, 60)
+        if self.state == "half_open" and self.cooldown:
+            self.cooldown = min(self.cooldown * 2, MAX_COOLDOWN_SECONDS)
+        else:
+            self.cooldown = base
+
+        self.state = "open"
+        self.capacity = 0
+        self.opened_at = time.monotonic()
+        self.probe_in_flight = False
+        print(f"AI backend marked down ({error_type}), pausing new jobs for {self.cooldown}s")
+
+    def _refresh(self):
+        """Move from open to half_open once the cooldown is over"""
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+            self.state = "half_open"
+            self.capacity = 1
+            self.probe_in_flight = False
+            print("AI backend cooldown over, probing with a single job")
+
+    def record_outcome(self, error_type=None):
+        """
+        Feed one AI call outcome. `error_type` is the ErrorHandler type, or None on success.
+        Errors that are not about the backend (bad JSON, bad file) are ignored.
+        """
+        with self.lock:
+            # Whatever the outcome, the next call may probe
+            self.probe_in_flight = False
+
+            if error_type is None:
+                self.consecutive_failures = 0
+                if self.state == "half_open":
+                    self.state = "closed"
+                    print("AI backend probe succeeded, ramping capacity back up")
+                if self.state == "closed" and self.capacity < self.max_concurrent_jobs:
+                    self.capacity += 1
+                return
+
+            if error_type not in BACKEND_ERROR_TYPES:
+                return
+
+            self.consecutive_failures += 1
+            self.last_error_type = error_type
+
+            if self.state == "half_open" or error_type == "API_QUOTA_EXCEEDED":
+                self._open(error_type)
+            elif self.state == "closed":
+                if self.consecutive_failures >= self.failure_threshold:
+                    self._open(error_type)
+                elif error_type == "API_RATE_LIMIT":
+                    self.capacity = max(1, self.capacity // 2)
+
+    def try_admit(self):
+        """
+        Reserve a job slot if possible.
+        Returns (admitted, reason) where reason is None, "down" or "busy".
+        """
+        with self.lock:
+            self._refresh()
+
+            if self.state == "open":
+                return False, "down"
+            if self.active_jobs >= self.capacity:
+                return False, "busy"
+
+            self.active_jobs += 1
+            return True, None
+
+    def release(self):
+        """Give back a slot reserved by try_admit"""
+        with self.lock:
+            self.active_jobs = max(0, self.active_jobs - 1)
+
+    def allow_request(self):
+        """
+        True if an AI call may go out right now: never while open, only one probe call
+        at a time while half open (its record_outcome lets the next one through).
+        """
+        with self.lock:
+            self._refresh()
+            if self.state == "open":
+                return False
+            if self.state == "half_open":
+                if self.probe_in_flight:
+                    return False
+                self.probe_in_flight = True
+            return True
+
+    def is_down(self):
+        with self.lock:
+            self._refresh()
+            return self.state == "open"
+
+    def seconds_until_probe(self):
+        with self.lock:
+            if self.state != "open":
+                return 0
+            return max(0, int(self.cooldown - (time.monotonic() - self.opened_at)))
+
+    def status_message(self):
+        """User-facing explanation of why new jobs are not being accepted"""
+        error_type = self.last_error_type or "API_CONNECTION_ERROR"
+        message = error_handler.error_types.get(error_type, error_handler.error_types["UNKNOWN_ERROR"])
+
+        if error_type == "API_QUOTA_EXCEEDED":
+            return message
+
+        wait = self.seconds_until_probe()
+        if wait >= 60:
+            return f"{message} New files will be accepted again in about {round(wait / 60)} minutes."
+        return f"{message} New files will be accepted again in less than a minute."
+
+    def get_summary(self):
+        with self.lock:
+            self._refresh()
+            return {
+                "state": self.state,
+                "capacity": self.capacity,
+                "active_jobs": self.active_jobs,
+                "consecutive_failures": self.consecutive_failures,
+                "last_error_type": self.last_error_type,
+            }
+
+
+# Create a global instance shared by every session in this process
+backend_health = BackendHealth()
@@ -0,0 +1,85 @@
+"""
+inline_markup.tokenize vs. the old per-block re.split(r'(\\*\\*.*?\\*\\*)') used by add_formatted_text,
+on markup-heavy blocks (every construct in every block) and on notes-like blocks (mostly plain
+text, some **bold** terms, a few *italic* words and formulas).
+First checks that tokenize still gives the old runs where the old code got them right.
+
+Usage: python benchmarks/bench_inline_markup.py [blocks] [repeats]
+"""
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from inline_markup import tokenize
+
+WORDS = ("the market demand **supply curve** shifts when *price* changes and H~2~O x^2^ "
+         "`GDP` elasticity of **demand** is 2 * 3 unbalanced ** marker snake_case").split()
+PLAIN_WORDS = ("the demand curve shifts to the right when consumer income rises and prices "
+               "stay constant across markets").split()
+
+# Blocks tokenize must split exactly like the old code: bold inside a word, formulas left alone
+SAME_AS_OLD = [
+    "**Note:**text",
+    "**a**b",
+    "the **key**s",
+    "price*quantity*2",
+    "m*a*g",
+    "the **supply curve** shifts",
+]
+
+
+def old_runs(text):
+    """What add_formatted_text did before: bold only, regex compiled from the cache each call"""
+    runs = []
+    for part in re.split(r'(\*\*.*?\*\*)', text):
+        if not part:
+            continue
+        if part.startswith('**') and part.endswith('**'):
+            runs.append((part[2:-2], 1))
+        else:
+            runs.append((part, 0))
+    return runs
+
+
+def notes_block(rng):
+    words = [rng.choice(PLAIN_WORDS) for _ in range(rng.randint(8, 40))]
+    roll = rng.random()
+    if roll < 0.3:
+        i = rng.randrange(len(words))
+        words[i] = f"**{words[i]}**"
+    elif roll < 0.4:
+        i = rng.randrange(len(words))
+        words[i] = f"*{words[i]}*"
+    elif roll < 0.45:
+        words.append("H~2~O")
+    return " ".join(words)
+
+
+def main():
+    blocks = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    for text in SAME_AS_OLD:
+        if tokenize(text) != old_runs(text):
+            sys.exit(f"tokenize({text!r}) = {tokenize(text)}, old code gave {old_runs(text)}")
+    print(f"{len(SAME_AS_OLD)} blocks tokenized as before")
+
+    rng = random.Random(7)
+    corpora = {
+        "markup-heavy": [" ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 60))) for _ in range(blocks)],
+        "notes-like": [notes_block(rng) for _ in range(blocks)],
+    }
+
+    for corpus, texts in corpora.items():
+        print(f"{corpus} ({blocks} blocks)")
+        for name, func in (("re.split (bold only)", old_runs), ("tokenize (all markup)", tokenize)):
+            best = min(timeit.repeat(lambda: [func(t) for t in texts], number=1, repeat=repeats))
+            print(f"  {name:<24}{best * 1000:>9.1f} ms{blocks / best:>12.0f} blocks/s")
+
+
+if __name__ == "__main__":
+    main()
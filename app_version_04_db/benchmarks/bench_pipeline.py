@@ -0,0 +1,168 @@
+"""
+End-to-end pipeline throughput against a local fake Gemini (benchmarks/fake_gemini.py):
+pre-flight -> send_msg_to_ai -> generate_notes_from_content -> generate_word_file
+over a corpus of synthetic PDFs, with N jobs in flight at once.
+
+The app modules log to Mongo when imported, so MONGODB_URI must point at a scratch database.
+Topic headings are unique per document, so the topic cache does not skew the numbers.
+
+Usage: python benchmarks/bench_pipeline.py [--jobs 20] [--concurrency 4] [--pages 10]
+                                           [--latency 0.5] [--rpm 0] [--error-rate 0] [--pacing 0]
+"""
+import argparse
+import contextlib
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fitz  # PyMuPDF
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from fake_gemini import FakeGemini, WORDS
+
+STAGES = ("preflight", "extraction", "generation", "word_file", "total")
+
+
+def synthetic_pdf(path, pages, seed, outline=False):
+    """Born-digital PDF with a paragraph of text per page and optional bookmarks"""
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for number in range(pages):
+        page = doc.new_page()
+        text = "\n".join(" ".join(rng.choice(WORDS) for _ in range(12)) for _ in range(40))
+        page.insert_textbox(page.rect + (54, 54, -54, -54), f"Chapter {number + 1}\n{text}", fontsize=10)
+    if outline:
+        doc.set_toc([[1, f"Chapter {number + 1}", number + 1] for number in range(0, pages, 3)])
+    doc.save(path)
+    doc.close()
+    return Path(path)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def run_job(path, out_dir):
+    """One upload through the whole pipeline; returns (timings, error)"""
+    from pdf_preflight import analyze_pdf
+    from extract_content import send_msg_to_ai
+    from generate_notes import generate_notes_from_content
+    from generate_word_file import generate_word_file
+    from retry import Deadline
+
+    timings = {}
+    start = time.perf_counter()
+    deadline = Deadline()
+
+    preflight, error = analyze_pdf(path)
+    timings["preflight"] = time.perf_counter() - start
+    if error:
+        return timings, error
+
+    mark = time.perf_counter()
+    extracted = send_msg_to_ai(path, None, deadline, preflight)
+    timings["extraction"] = time.perf_counter() - mark
+    if isinstance(extracted, dict) and "error_type" in extracted:
+        return timings, extracted["error_type"]
+
+    mark = time.perf_counter()
+    notes = generate_notes_from_content(extracted, None, deadline)
+    timings["generation"] = time.perf_counter() - mark
+    if isinstance(notes, dict) and "error_type" in notes:
+        return timings, notes["error_type"]
+
+    mark = time.perf_counter()
+    generate_word_file(notes, os.path.join(out_dir, path.stem))
+    timings["word_file"] = time.perf_counter() - mark
+
+    timings["total"] = time.perf_counter() - start
+    return timings, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end pipeline benchmark against a fake Gemini")
+    parser.add_argument("--jobs", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--outline", action="store_true", help="give the PDFs bookmarks (outline extraction)")
+    parser.add_argument("--latency", type=float, default=0.5, help="fake generation latency, seconds")
+    parser.add_argument("--extract-latency", type=float, default=None)
+    parser.add_argument("--rpm", type=int, default=0, help="fake per-minute rate limit (0 = none)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of fake 503 responses")
+    parser.add_argument("--topics", type=int, default=6)
+    parser.add_argument("--pacing", type=float, default=0.0,
+                        help="NOTES_REQUEST_INTERVAL for the run (production uses 7)")
+    parser.add_argument("--tracemalloc", action="store_true", help="also trace Python heap peak (slower)")
+    parser.add_argument("--verbose", action="store_true", help="keep the pipeline's own prints")
+    args = parser.parse_args()
+
+    if not os.getenv("MONGODB_URI"):
+        sys.exit("Set MONGODB_URI to a scratch database first")
+
+    fake = FakeGemini(latency=args.latency, extract_latency=args.extract_latency, rpm=args.rpm or None,
+                      error_rate=args.error_rate, topics=args.topics)
+    # Read by extract_content / generate_notes at import time, so set before importing them
+    os.environ["GEMINI_BASE_URL"] = fake.start()
+    os.environ["GOOGLE_API_KEY"] = "fake-key"
+    os.environ["NOTES_REQUEST_INTERVAL"] = str(args.pacing)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus = [synthetic_pdf(os.path.join(tmp, f"doc_{i}.pdf"), args.pages, seed=i, outline=args.outline)
+                  for i in range(args.jobs)]
+
+        import extract_content  # noqa: F401  (import cost not part of the measurement)
+        import generate_notes  # noqa: F401
+
+        if args.tracemalloc:
+            tracemalloc.start()
+        quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+
+        started = time.perf_counter()
+        with quiet, ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            results = list(pool.map(lambda path: run_job(path, tmp), corpus))
+        elapsed = time.perf_counter() - started
+
+        heap_peak = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+        tracemalloc.stop()
+
+    fake.stop()
+
+    completed = [timings for timings, error in results if not error]
+    errors = [error for _, error in results if error]
+
+    print(f"{args.jobs} jobs x {args.pages} pages, concurrency {args.concurrency}, "
+          f"fake latency {args.latency}s, rpm {args.rpm or '-'}, error rate {args.error_rate}")
+    print(f"{'stage':<12}{'p50 s':>9}{'p95 s':>9}{'max s':>9}")
+    for stage in STAGES:
+        values = [timings[stage] for timings in completed if stage in timings]
+        print(f"{stage:<12}{percentile(values, 50):>9.2f}{percentile(values, 95):>9.2f}"
+              f"{max(values, default=0):>9.2f}")
+
+    print(f"\ncompleted {len(completed)}/{args.jobs} in {elapsed:.1f}s -> {len(completed) / elapsed * 60:.1f} jobs/min")
+    if errors:
+        print("failures: " + ", ".join(f"{error} x{errors.count(error)}" for error in sorted(set(errors))))
+    print(f"fake gemini: {fake.stats}")
+    if resource:
+        print(f"peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+    if heap_peak:
+        print(f"python heap peak {heap_peak / 1024 / 1024:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
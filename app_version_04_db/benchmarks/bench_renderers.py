@@ -0,0 +1,58 @@
+"""
+Throughput of each notes renderer on synthetic notes.
+
+Usage: python benchmarks/bench_renderers.py [blocks] [repeats]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from notes_renderers import RENDERERS, render_notes
+
+WORDS = ("market demand supply **price** elasticity consumer surplus equilibrium "
+         "the of and a to in **key term** curve shift cost").split()
+
+
+def synthetic_notes(blocks, seed=42):
+    """Notes shaped like generate_notes_from_content output"""
+    rng = random.Random(seed)
+    types = ["heading"] + ["subheading"] * 3 + ["paragraph"] * 8 + ["bullet"] * 12
+    return [
+        {"type": rng.choice(types), "text": " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 60)))}
+        for _ in range(blocks)
+    ]
+
+
+def main():
+    blocks = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    notes = synthetic_notes(blocks)
+
+    print(f"{blocks} blocks, best of {repeats}")
+    print(f"{'format':<10}{'seconds':>10}{'blocks/s':>12}{'size KB':>10}{'peak MB':>10}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in RENDERERS:
+            base = os.path.join(tmp, f"notes_{name}")
+            timings = []
+            peak = 0
+            for _ in range(repeats):
+                tracemalloc.start()
+                start = time.perf_counter()
+                path = render_notes(notes, base, name)
+                timings.append(time.perf_counter() - start)
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+
+            best = min(timings)
+            size_kb = os.path.getsize(path) / 1024
+            print(f"{name:<10}{best:>10.3f}{blocks / best:>12.0f}{size_kb:>10.0f}{peak / 1024 / 1024:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
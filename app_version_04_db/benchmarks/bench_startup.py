@@ -0,0 +1,110 @@
+"""
+Cold start of the app entry point: `python app.py` from process start until /login answers,
+with the import time of every process it started (python -X importtime) and which heavy
+SDKs were already loaded by then. Those should load on first use (see database and the
+imports inside extract_content / generate_notes / notes_renderers), so the last column
+should stay empty (pymongo can show up when the background schema check of app.on_startup
+got there first); --sdk-imports shows what that first use costs instead.
+
+MONGODB_URI must point at a scratch database (the app applies its schema on startup, see migrations).
+
+Usage: python benchmarks/bench_startup.py [--runs 5] [--reload] [--sdk-imports]
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import httpx
+
+from load_test import APP_DIR, free_port
+
+# Packages the app only needs once a job runs
+HEAVY_MODULES = ("google.genai", "fitz", "docx", "pymongo")
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)")
+
+
+def parse_importtime(text):
+    """(seconds spent importing top-level modules, names of all imported modules)"""
+    total, modules = 0, set()
+    for _, cumulative_us, indent, name in IMPORT_LINE.findall(text):
+        modules.add(name)
+        if not indent:
+            total += int(cumulative_us)
+    return total / 1_000_000, modules
+
+
+def cold_start(reload, timeout=120):
+    """One `python app.py`; returns (seconds until /login answers, import seconds, heavy modules loaded)"""
+    port = free_port()
+    env = {**os.environ, "PORT": str(port), "RELOAD": "true" if reload else "false",
+           "PYTHONDONTWRITEBYTECODE": "1"}
+    with tempfile.TemporaryFile("w+") as log:
+        started = time.perf_counter()
+        process = subprocess.Popen([sys.executable, "-X", "importtime", "app.py"], cwd=APP_DIR, env=env,
+                                   stdout=log, stderr=subprocess.STDOUT)
+        try:
+            ready = None
+            while time.perf_counter() - started < timeout and process.poll() is None:
+                try:
+                    if httpx.get(f"http://127.0.0.1:{port}/login", timeout=2).status_code == 200:
+                        ready = time.perf_counter() - started
+                        break
+                except httpx.HTTPError:
+                    time.sleep(0.05)
+        finally:
+            process.terminate()
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+        log.seek(0)
+        output = log.read()
+
+    if ready is None:
+        sys.exit("app.py did not come up:\n" + output[-2000:])
+    import_seconds, modules = parse_importtime(output)
+    heavy = [name for name in HEAVY_MODULES if name in modules]
+    return ready, import_seconds, heavy
+
+
+def sdk_import_time(module):
+    """Seconds a fresh interpreter needs to import module (what its first use costs)"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True)
+    return parse_importtime(result.stderr)[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start time of app.py")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--reload", action="store_true", help="start with RELOAD=true (development mode)")
+    parser.add_argument("--sdk-imports", action="store_true", help="also time each heavy SDK import on its own")
+    args = parser.parse_args()
+
+    print(f"{'run':>4} {'ready s':>8} {'import s':>9}  heavy SDKs loaded at startup")
+    ready_times, import_times = [], []
+    for run in range(1, args.runs + 1):
+        ready, import_seconds, heavy = cold_start(args.reload)
+        ready_times.append(ready)
+        import_times.append(import_seconds)
+        print(f"{run:>4} {ready:>8.2f} {import_seconds:>9.2f}  {', '.join(heavy) or '-'}")
+
+    print(f"\nmedian: ready {statistics.median(ready_times):.2f}s, imports {statistics.median(import_times):.2f}s "
+          f"(reload {'on' if args.reload else 'off'})")
+
+    if args.sdk_imports:
+        print("\nfirst use costs (fresh interpreter):")
+        for module in HEAVY_MODULES:
+            print(f"  {module:<22} {sdk_import_time(module):.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""
+Local stand-in for Gemini's generateContent endpoint, for benchmarks and load tests.
+
+Answers the google.genai requests the app sends (extraction and notes generation)
+with canned but well-formed responses, and can add latency, per-minute rate limits (429 with
+a RetryInfo delay, counted per API key) and random 503s. Point the app at it with GEMINI_BASE_URL=http://host:port.
+
+Usage: python benchmarks/fake_gemini.py [--port 8765] [--latency 1.0] [--rpm 60] [--error-rate 0.05]
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PATH_PATTERN = re.compile(r"/v1(?:beta)?/models/(?P<model>[^/:]+):generateContent")
+
+WORDS = ("market demand supply price elasticity consumer surplus equilibrium "
+         "the of and a to in curve shift cost revenue margin firm output").split()
+
+
+class FakeGemini:
+    """
+    Threaded HTTP server with Gemini's request / response shapes.
+
+    latency         seconds per generation request (gaussian, +-jitter)
+    extract_latency seconds per extraction request (PDF in the request), defaults to 2x latency
+    rpm             requests per rolling minute and API key before answering 429 (None = unlimited)
+    error_rate      share of requests answered with 503 "model overloaded"
+    topics          headings in every extraction response
+    blocks          notes blocks in every generation response
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=1.0, jitter=0.2, extract_latency=None,
+                 rpm=None, error_rate=0.0, topics=6, blocks=12, seed=7):
+        self.latency = latency
+        self.jitter = jitter
+        self.extract_latency = extract_latency if extract_latency is not None else latency * 2
+        self.rpm = rpm
+        self.error_rate = error_rate
+        self.topics = topics
+        self.blocks = blocks
+
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.recent = {}  # API key -> request times in the last minute
+        self.stats = {"requests": 0, "extraction": 0, "generation": 0, "rate_limited": 0, "errors": 0}
+
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self.base_url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    # --- behaviour ---
+
+    def _admit(self, api_key=None):
+        """None to answer normally, or (status, error body) for an injected failure"""
+        with self.lock:
+            now = time.monotonic()
+            self.stats["requests"] += 1
+
+            recent = self.recent.setdefault(api_key, deque())
+            while recent and now - recent[0] > 60:
+                recent.popleft()
+            if self.rpm and len(recent) >= self.rpm:
+                self.stats["rate_limited"] += 1
+                retry_after = max(1, int(60 - (now - recent[0])) + 1)
+                return 429, error_body(429, "RESOURCE_EXHAUSTED",
+                                       "Resource has been exhausted (e.g. check quota).", retry_after)
+            recent.append(now)
+
+            if self.random.random() < self.error_rate:
+                self.stats["errors"] += 1
+                return 503, error_body(503, "UNAVAILABLE", "The model is overloaded. Please try again later.")
+
+        return None
+
+    def _delay(self, base):
+        with self.lock:
+            delay = self.random.gauss(base, self.jitter)
+        time.sleep(max(0.0, delay))
+
+    def _sentence(self, words):
+        with self.lock:
+            return " ".join(self.random.choice(WORDS) for _ in range(words))
+
+    def extraction_text(self, document_tag):
+        """Flat {heading: text} JSON like Ins_for_extraction asks for; headings are unique per document"""
+        return json.dumps({
+            f"Topic {number} ({document_tag})": " ".join(self._sentence(18) + "." for _ in range(6))
+            for number in range(1, self.topics + 1)
+        })
+
+    def notes_text(self, topic):
+        """Notes blocks like Ins_for_notes_generation asks for, wrapped in a code fence as the model does"""
+        blocks = [{"type": "heading", "text": topic[:60]}]
+        for number in range(self.blocks - 1):
+            kind = ("subheading", "paragraph", "bullet", "bullet")[number % 4]
+            blocks.append({"type": kind, "text": f"**{self._sentence(2)}** {self._sentence(14)}"})
+        return "```json\n" + json.dumps(blocks) + "\n```"
+
+    def respond(self, request):
+        """Pick the canned answer from the request: a PDF part means extraction"""
+        parts = [part for content in request.get("contents", []) for part in content.get("parts", [])]
+        pdf = next((part.get("inlineData") or part.get("inline_data") for part in parts
+                    if part.get("inlineData") or part.get("inline_data")), None)
+
+        if pdf:
+            with self.lock:
+                self.stats["extraction"] += 1
+            self._delay(self.extract_latency)
+            text = self.extraction_text(hashlib.sha1(pdf.get("data", "").encode()).hexdigest()[:8])
+        else:
+            with self.lock:
+                self.stats["generation"] += 1
+            self._delay(self.latency)
+            prompt = " ".join(part.get("text", "") for part in parts)
+            text = self.notes_text(prompt)
+
+        prompt_tokens = len(json.dumps(request)) // 4
+        output_tokens = len(text) // 4
+        return {
+            "candidates": [{"content": {"parts": [{"text": text}], "role": "model"},
+                            "finishReason": "STOP", "index": 0}],
+            "usageMetadata": {"promptTokenCount": prompt_tokens,
+                              "candidatesTokenCount": output_tokens,
+                              "totalTokenCount": prompt_tokens + output_tokens},
+        }
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                if not PATH_PATTERN.search(self.path):
+                    return self._send(404, error_body(404, "NOT_FOUND", f"Unknown path {self.path}"))
+
+                query_key = re.search(r"[?&]key=([^&]+)", self.path)
+                failure = fake._admit(self.headers.get("x-goog-api-key") or (query_key and query_key.group(1)))
+                if failure:
+                    return self._send(*failure)
+
+                try:
+                    request = json.loads(body or b"{}")
+                except ValueError:
+                    return self._send(400, error_body(400, "INVALID_ARGUMENT", "Invalid JSON payload"))
+                self._send(200, fake.respond(request))
+
+            def _send(self, status, payload):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def error_body(code, status, message, retry_after=None):
+    """Google API error payload, with RetryInfo when a retry delay applies"""
+    error = {"code": code, "message": message, "status": status}
+    if retry_after:
+        error["details"] = [{"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": f"{retry_after}s"}]
+    return {"error": error}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=1.0)
+    parser.add_argument("--extract-latency", type=float, default=None)
+    parser.add_argument("--rpm", type=int, default=None)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    fake = FakeGemini(args.host, args.port, latency=args.latency, extract_latency=args.extract_latency,
+                      rpm=args.rpm, error_rate=args.error_rate)
+    print(f"Fake Gemini on {fake.base_url} (GEMINI_BASE_URL={fake.base_url})")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        print(fake.stats)
+
+
+if __name__ == "__main__":
+    main()
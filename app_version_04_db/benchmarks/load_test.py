@@ -0,0 +1,506 @@
+"""
+Load test for the NiceGUI front end: browser-less clients that speak the page's socket.io protocol
+(nicegui 1.4), each logging in, uploading a PDF, confirming it, generating notes, following the
+progress updates and downloading the result - with the AI backend replaced by benchmarks/fake_gemini.py.
+
+Clients are added in levels (1, 2, 4, ... by default) and every level reports job latency,
+event-loop lag (round trip of a no-op socket.io call against its idle baseline), server memory
+per session and websocket message rates. The ramp stops at the first level that breaks:
+too many failed jobs or loop lag above --max-lag.
+
+Every client needs its own account (per-user session state is shared between tabs), so accounts
+are --email loadtest+{n}@example.com with one --password; --create-users adds missing ones.
+
+Either point it at a running app started with GEMINI_BASE_URL=<fake gemini> and
+ERROR_REPORT_SINK=local (and --server-pid for memory numbers), or let it start both with --start-app. MONGODB_URI must be a scratch database.
+
+Usage: python benchmarks/load_test.py --start-app --create-users [--levels 1,2,4,8,16] [--pages 5]
+       python benchmarks/load_test.py --url http://127.0.0.1:8080 --server-pid 1234
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import httpx
+import socketio
+
+from bench_pipeline import percentile, synthetic_pdf
+from fake_gemini import FakeGemini
+
+APP_DIR = Path(__file__).resolve().parent.parent
+SOCKET_PATH = "/_nicegui_ws/socket.io"
+ELEMENTS_PATTERN = re.compile(r"parseElements\(String\.raw`(.*?)`\)", re.DOTALL)
+
+READY_TEXT = "Your Notes are Ready!"
+STAGE_TEXTS = {"Extracting": "extracting", "Generating": "generating", "Preparing": "creating_file"}
+
+
+class LoadTestError(Exception):
+    """A simulated client could not finish its job"""
+
+
+def page_elements(html):
+    """Element tree the server rendered into the page, keyed by element id"""
+    match = ELEMENTS_PATTERN.search(html)
+    if not match:
+        raise LoadTestError("no NiceGUI elements in page (not a NiceGUI 1.x page?)")
+    raw = match.group(1)
+    for escaped, char in (("&#36;", "$"), ("&#96;", "`"), ("&gt;", ">"), ("&lt;", "<"), ("&amp;", "&")):
+        raw = raw.replace(escaped, char)
+    return json.loads(raw)
+
+
+class MessageStats:
+    """Websocket messages received, by type, across all clients of a level"""
+
+    def __init__(self):
+        self.counts = Counter()
+        self.bytes = Counter()
+
+    def add(self, kind, data):
+        self.counts[kind] += 1
+        self.bytes[kind] += len(json.dumps(data, default=str))
+
+
+class NiceGuiPage:
+    """
+    One open page: the element tree from the HTML plus the socket.io connection
+    that keeps it in sync, with helpers to find elements and fire their events.
+    """
+
+    def __init__(self, http, base_url, path, stats):
+        self.http = http
+        self.base_url = base_url
+        self.path = path
+        self.stats = stats
+        self.client_id = None
+        self.elements = {}
+        self.sio = socketio.AsyncClient(reconnection=False)
+        self.changed = asyncio.Event()
+        self.opened = None  # path of a server-side ui.navigate.to
+        self.scripts = []  # run_javascript code
+        self.notifications = []
+
+        self.sio.on("*", self._on_message)
+
+    async def open(self):
+        response = await self.http.get(self.base_url + self.path)
+        response.raise_for_status()
+        match = re.search(r"""['"]client_id['"]:\s*['"]([0-9a-f-]+)['"]""", response.text)
+        if not match:
+            raise LoadTestError(f"no client id in {self.path}")
+        self.client_id = match.group(1)
+        self.elements = page_elements(response.text)
+
+        cookies = "; ".join(f"{name}={value}" for name, value in self.http.cookies.items())
+        await self.sio.connect(f"{self.base_url}?client_id={self.client_id}", socketio_path=SOCKET_PATH,
+                               transports=["websocket"], headers={"Cookie": cookies})
+        accepted = await self.sio.call("handshake", {"client_id": self.client_id, "tab_id": str(uuid.uuid4())},
+                                       timeout=30)
+        if not accepted:
+            raise LoadTestError(f"handshake rejected for {self.path}")
+        return self
+
+    async def close(self):
+        if self.sio.connected:
+            await self.sio.disconnect()
+
+    async def _on_message(self, kind, data=None):
+        self.stats.add(kind, data)
+        if kind == "update":
+            for element_id, element in data.items():
+                if element is None:
+                    self.elements.pop(element_id, None)
+                else:
+                    self.elements[element_id] = element
+        elif kind == "open":
+            self.opened = data["path"]
+        elif kind == "run_javascript":
+            self.scripts.append(data["code"])
+        elif kind == "notify":
+            self.notifications.append(data.get("message", ""))
+        self.changed.set()
+
+    # --- finding elements ---
+
+    def find(self, predicate, visible=False):
+        """Id of the first element matching predicate, or None"""
+        for element_id, element in self.elements.items():
+            if predicate(element) and not (visible and "hidden" in element.get("class", [])):
+                return element_id
+        return None
+
+    def button(self, text):
+        """Id of the visible button whose label contains text, or None"""
+        return self.find(lambda e: e.get("tag") == "q-btn" and text in str(e.get("props", {}).get("label", "")),
+                         visible=True)
+
+    def text_containing(self, text):
+        return next((e["text"] for e in self.elements.values() if text in (e.get("text") or "")), None)
+
+    async def wait_for(self, condition, timeout):
+        """Wait until condition() is truthy, re-checking after every message; returns its value"""
+        deadline = time.monotonic() + timeout
+        while True:
+            result = condition()
+            if result:
+                return result
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise LoadTestError("timed out waiting for the page")
+            self.changed.clear()
+            try:
+                await asyncio.wait_for(self.changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    # --- firing events ---
+
+    async def emit(self, element_id, event_type, *args):
+        element = self.elements[element_id]
+        listener = next((event for event in element.get("events", []) if event["type"].startswith(event_type)), None)
+        if listener is None:
+            raise LoadTestError(f"element {element_id} has no {event_type} listener")
+        await self.sio.emit("event", {"id": int(element_id), "client_id": self.client_id,
+                                      "listener_id": listener["listener_id"],
+                                      "args": [json.dumps(arg) for arg in args]})
+
+    async def set_value(self, element_id, value):
+        # update:modelValue for most value elements, update:value for ui.input
+        await self.emit(element_id, "update:", value)
+
+    async def click(self, element_id):
+        await self.emit(element_id, "click", {})
+
+
+async def run_client(base_url, email, password, pdf, stats, timeout):
+    """Login -> upload -> confirm -> generate -> progress -> download; returns timings per step"""
+    timings = {}
+    start = time.perf_counter()
+
+    async with httpx.AsyncClient(timeout=timeout) as http:
+        page = await NiceGuiPage(http, base_url, "/login", stats).open()
+        try:
+            await page.set_value(page.find(lambda e: e.get("props", {}).get("label") == "Email"), email)
+            await page.set_value(page.find(lambda e: e.get("props", {}).get("label") == "Password"), password)
+            await page.click(page.button("Sign In"))
+            await page.wait_for(lambda: page.opened or page.text_containing("Invalid credentials"), 30)
+            if not page.opened:
+                raise LoadTestError(f"login failed for {email}")
+        finally:
+            await page.close()
+        timings["login"] = time.perf_counter() - start
+
+        page = await NiceGuiPage(http, base_url, "/", stats).open()
+        try:
+            uploader = page.find(lambda e: "url" in e.get("props", {}) and "/upload/" in e["props"]["url"])
+            if uploader is None:
+                raise LoadTestError("main page has no uploader (not logged in?)")
+
+            mark = time.perf_counter()
+            with open(pdf, "rb") as handle:
+                response = await http.post(base_url + page.elements[uploader]["props"]["url"],
+                                           files={"file": (pdf.name, handle, "application/pdf")})
+            response.raise_for_status()
+            await page.wait_for(lambda: page.button("Confirm") or page.notifications, 60)
+            if not page.button("Confirm"):
+                raise LoadTestError(f"upload rejected: {page.notifications[-1]}")
+            timings["upload"] = time.perf_counter() - mark
+
+            await page.click(page.button("Confirm"))
+            await page.click(page.button("Generate Notes"))
+
+            mark = time.perf_counter()
+            stage_started = {}
+
+            def progress():
+                for text, stage in STAGE_TEXTS.items():
+                    if page.text_containing(text) and stage not in stage_started:
+                        stage_started[stage] = time.perf_counter() - mark
+                return page.text_containing(READY_TEXT) or page.text_containing("⚠️")
+
+            outcome = await page.wait_for(progress, timeout)
+            if READY_TEXT not in outcome:
+                raise LoadTestError(f"job failed: {outcome}")
+            timings["processing"] = time.perf_counter() - mark
+            timings.update({f"start_{stage}": seconds for stage, seconds in stage_started.items()})
+
+            mark = time.perf_counter()
+            await page.click(page.button("Download Notes"))
+            script = await page.wait_for(lambda: next((code for code in page.scripts if ";base64," in code), None), 60)
+            timings["download"] = time.perf_counter() - mark
+            timings["download_kb"] = len(script) / 1024
+        finally:
+            await page.close()
+
+    timings["total"] = time.perf_counter() - start
+    return timings
+
+
+class LagProbe:
+    """
+    Event-loop lag as seen from outside: a no-op socket.io call (handshake for an unknown client)
+    is answered straight from the server's loop, so its round trip above the idle baseline is
+    time the loop spent busy. Also samples server RSS while running.
+    """
+
+    def __init__(self, base_url, pids, interval=0.25):
+        self.base_url = base_url
+        self.pids = pids
+        self.interval = interval
+        self.sio = socketio.AsyncClient(reconnection=False)
+        self.baseline = 0.0
+        self.samples = []
+        self.rss_peak = 0
+        self.task = None
+
+    async def connect(self):
+        await self.sio.connect(f"{self.base_url}?client_id=lag-probe", socketio_path=SOCKET_PATH,
+                               transports=["websocket"])
+        idle = [await self.round_trip() for _ in range(20)]
+        self.baseline = percentile(idle, 50)
+
+    async def round_trip(self):
+        mark = time.perf_counter()
+        await self.sio.call("handshake", {"client_id": "lag-probe", "tab_id": "lag-probe"}, timeout=60)
+        return time.perf_counter() - mark
+
+    async def _run(self):
+        while True:
+            self.samples.append(max(0.0, await self.round_trip() - self.baseline))
+            self.rss_peak = max(self.rss_peak, server_rss(self.pids))
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self.samples = []
+        self.rss_peak = server_rss(self.pids)
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self.task.cancel()
+        try:
+            await self.task
+        except (asyncio.CancelledError, Exception):
+            pass
+
+    async def close(self):
+        await self.sio.disconnect()
+
+
+def server_rss(pids):
+    """Resident memory in bytes of the server processes and their children (Linux /proc only)"""
+    total = 0
+    pending = list(pids)
+    while pending:
+        pid = pending.pop()
+        try:
+            with open(f"/proc/{pid}/status") as status:
+                total += next(int(line.split()[1]) * 1024 for line in status if line.startswith("VmRSS:"))
+            for task in os.listdir(f"/proc/{pid}/task"):
+                with open(f"/proc/{pid}/task/{task}/children") as children:
+                    pending.extend(int(child) for child in children.read().split())
+        except (OSError, StopIteration):
+            continue
+    return total
+
+
+async def run_level(base_url, clients, args, corpus, probe):
+    stats = MessageStats()
+    rss_before = server_rss(args.server_pids)
+    probe.start()
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(
+        run_client(base_url, args.email.format(n=n), args.password, corpus[n % len(corpus)], stats, args.timeout)
+        for n in range(clients)
+    ), return_exceptions=True)
+    elapsed = time.perf_counter() - started
+
+    await probe.stop()
+    completed = [result for result in results if isinstance(result, dict)]
+    errors = [f"{type(result).__name__}: {result}" for result in results if not isinstance(result, dict)]
+    return {
+        "clients": clients,
+        "completed": completed,
+        "errors": errors,
+        "elapsed": elapsed,
+        "lag": probe.samples,
+        "rss_per_session": (probe.rss_peak - rss_before) / clients if args.server_pids else None,
+        "rss_peak": probe.rss_peak,
+        "messages": stats,
+    }
+
+
+def report_level(level):
+    totals = [timings["total"] for timings in level["completed"]]
+    processing = [timings["processing"] for timings in level["completed"]]
+    stats = level["messages"]
+    elapsed = level["elapsed"]
+    rss = f"{level['rss_per_session'] / 1024 / 1024:>8.1f}" if level["rss_per_session"] is not None else f"{'-':>8}"
+    print(f"{level['clients']:>7}{len(level['completed']):>5}/{level['clients']:<4}"
+          f"{percentile(totals, 50):>8.1f}{percentile(totals, 95):>8.1f}{percentile(processing, 95):>8.1f}"
+          f"{percentile(level['lag'], 50) * 1000:>8.0f}{percentile(level['lag'], 95) * 1000:>8.0f}"
+          f"{max(level['lag'], default=0) * 1000:>8.0f}{rss}"
+          f"{sum(stats.counts.values()) / elapsed:>9.1f}{sum(stats.bytes.values()) / elapsed / 1024:>9.1f}")
+
+
+def broken(level, args):
+    """Reason this level counts as broken, or None"""
+    failures = len(level["errors"]) / level["clients"]
+    if failures > args.max_failure_rate:
+        return f"{len(level['errors'])}/{level['clients']} jobs failed"
+    lag = percentile(level["lag"], 95)
+    if lag > args.max_lag:
+        return f"p95 event-loop lag {lag * 1000:.0f} ms > {args.max_lag * 1000:.0f} ms"
+    return None
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def start_app(args, fake_url, log_path):
+    """app.py on a free port, talking to the fake Gemini; returns (process, base_url)"""
+    port = free_port()
+    env = {**os.environ, "PORT": str(port), "GEMINI_BASE_URL": fake_url, "GOOGLE_API_KEY": "fake-key",
+           "NOTES_REQUEST_INTERVAL": str(args.pacing), "ERROR_REPORT_SINK": "local"}
+    log = open(log_path, "w")
+    print(f"app.py on port {port}, log in {log_path}")
+    process = subprocess.Popen([sys.executable, "app.py"], cwd=APP_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    base_url = f"http://127.0.0.1:{port}"
+
+    deadline = time.monotonic() + 90
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            sys.exit(f"app.py exited with {process.returncode}, see {log_path}")
+        try:
+            if httpx.get(base_url + "/login", timeout=2).status_code == 200:
+                return process, base_url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    sys.exit(f"app.py did not come up within 90s, see {log_path}")
+
+
+def create_users(args, count):
+    from db_auth import MongoUserAuth
+
+    auth = MongoUserAuth()
+    for n in range(count):
+        email = args.email.format(n=n)
+        if not auth.verify_user(email, args.password):
+            auth.remove_user(email)
+            auth.add_user(email, args.password, f"Load test {n}")
+
+
+async def ramp(args, base_url, corpus):
+    probe = LagProbe(base_url, args.server_pids)
+    await probe.connect()
+    print(f"idle socket round trip {probe.baseline * 1000:.1f} ms (subtracted from lag)")
+
+    # One unreported job first, so lazy imports and first-use allocations don't land on level 1
+    await run_client(base_url, args.email.format(n=0), args.password, corpus[0], MessageStats(), args.timeout)
+    await asyncio.sleep(args.settle)
+
+    print(f"{'clients':>7}{'ok':>9}{'p50 s':>8}{'p95 s':>8}{'proc95':>8}{'lag50':>8}{'lag95':>8}{'lagmax':>8}"
+          f"{'MB/sess':>8}{'msg/s':>9}{'KB/s':>9}")
+
+    last_good, breaking = None, None
+    for clients in args.levels:
+        level = await run_level(base_url, clients, args, corpus, probe)
+        report_level(level)
+        reason = broken(level, args)
+        if reason:
+            breaking = (clients, reason, level)
+            break
+        last_good = level
+        # Let disconnected NiceGUI clients expire (reconnect_timeout) before the next level
+        await asyncio.sleep(args.settle)
+    await probe.close()
+
+    reference = breaking[2] if breaking else last_good
+    if reference:
+        stats = reference["messages"]
+        print(f"\nmessages at {reference['clients']} clients: " + ", ".join(
+            f"{kind} {count / reference['elapsed']:.1f}/s ({stats.bytes[kind] / count / 1024:.1f} KB avg)"
+            for kind, count in stats.counts.most_common()))
+    if breaking:
+        clients, reason, level = breaking
+        print(f"breaks at {clients} concurrent clients: {reason}"
+              + (f" (last good: {last_good['clients']})" if last_good else ""))
+        for error, count in Counter(level["errors"]).most_common(5):
+            print(f"  {count} x {error}")
+    else:
+        print(f"no break up to {args.levels[-1]} concurrent clients")
+    if reference and reference["rss_peak"]:
+        print(f"server peak RSS {reference['rss_peak'] / 1024 / 1024:.0f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent-client load test for the NiceGUI app")
+    parser.add_argument("--url", default="http://127.0.0.1:8080", help="running app (ignored with --start-app)")
+    parser.add_argument("--start-app", action="store_true", help="start fake Gemini + app.py on a free port")
+    parser.add_argument("--server-pid", type=int, action="append", default=[],
+                        help="app process for memory numbers (repeatable)")
+    parser.add_argument("--email", default="loadtest+{n}@example.com", help="account per client, {n} = index")
+    parser.add_argument("--password", default="loadtest-password")
+    parser.add_argument("--create-users", action="store_true", help="add missing load test accounts")
+    parser.add_argument("--levels", default="1,2,4,8,16,32", help="concurrent clients per level")
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--documents", type=int, default=8, help="distinct PDFs handed out round robin")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds per job before it counts as failed")
+    parser.add_argument("--max-lag", type=float, default=0.5, help="p95 loop lag (s) that counts as broken")
+    parser.add_argument("--max-failure-rate", type=float, default=0.0)
+    parser.add_argument("--settle", type=float, default=5.0, help="pause between levels, seconds")
+    parser.add_argument("--latency", type=float, default=0.5, help="fake generation latency (--start-app)")
+    parser.add_argument("--extract-latency", type=float, default=None)
+    parser.add_argument("--pacing", type=float, default=0.0, help="NOTES_REQUEST_INTERVAL (--start-app)")
+    args = parser.parse_args()
+    args.levels = [int(level) for level in args.levels.split(",")]
+    args.server_pids = args.server_pid
+
+    if (args.start_app or args.create_users) and not os.getenv("MONGODB_URI"):
+        sys.exit("Set MONGODB_URI to a scratch database first")
+    if args.create_users:
+        create_users(args, max(args.levels))
+
+    fake, process = None, None
+    with tempfile.TemporaryDirectory() as tmp:
+        # Unique text per document so neither the notes cache nor the topic cache short-circuits jobs
+        corpus = [synthetic_pdf(os.path.join(tmp, f"load_{n}_{uuid.uuid4().hex[:6]}.pdf"), args.pages,
+                                seed=uuid.uuid4().int) for n in range(args.documents)]
+        try:
+            base_url = args.url.rstrip("/")
+            if args.start_app:
+                fake = FakeGemini(latency=args.latency, extract_latency=args.extract_latency)
+                process, base_url = start_app(args, fake.start(),
+                                              os.path.join(tempfile.gettempdir(), "notescraft_load_test_app.log"))
+                args.server_pids = [process.pid]
+            asyncio.run(ramp(args, base_url, corpus))
+        finally:
+            if process:
+                process.terminate()
+                process.wait(timeout=30)
+            if fake:
+                print(f"fake gemini: {fake.stats}")
+                fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+import os
+import threading
+import time
+from collections import deque
+
+from dotenv import load_dotenv
+
+from error_handler import error_handler
+from retry import get_retry_after
+from metrics import registry, api_key_requests_total, api_key_tokens_total
+
+# Load the .env file to get the API keys
+load_dotenv()
+
+# Gemini API keys, comma separated. A lone GOOGLE_API_KEY still works as a pool of one.
+GOOGLE_API_KEYS = [
+    key.strip() for key in (os.getenv("GOOGLE_API_KEYS") or os.getenv("GOOGLE_API_KEY") or "").split(",")
+    if key.strip()
+]
+# Client-side cap per key (0 = none); keeps each key under its own per-minute limit
+KEY_REQUESTS_PER_MINUTE = int(os.getenv("KEY_REQUESTS_PER_MINUTE", "0"))
+
+# How long a key sits out after each kind of failure (a server retry hint wins for rate limits)
+RATE_LIMIT_COOLDOWN_SECONDS = 30
+QUOTA_COOLDOWN_SECONDS = 60 * 60
+
+# Failures that are about the key rather than the request, and the state they put the key in
+KEY_ERROR_STATES = {
+    "API_RATE_LIMIT": "cooling",
+    "API_QUOTA_EXCEEDED": "exhausted",
+    "API_KEY_ERROR": "disabled",
+}
+
+
+class NoKeyAvailable(Exception):
+    """Every key is out of rotation. The message classifies like the reason (rate limit, quota, key)."""
+
+
+class ApiKey:
+    """One credential with its own rate-limit / quota state and usage counters"""
+
+    def __init__(self, key, name):
+        self.key = key
+        self.name = name
+        self.state = "active"  # active, cooling (rate limited), exhausted (quota), disabled (rejected)
+        self.until = 0.0
+        self.in_flight = 0
+        self.recent = deque()  # monotonic times of the requests of the last minute
+        self.requests = 0
+        self.failures = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.last_error = None
+
+    def refresh(self, now):
+        """Put a cooled down or refilled key back into rotation; drop request times older than a minute"""
+        if self.state in ("cooling", "exhausted") and now >= self.until:
+            print(f"API key {self.name} back in rotation")
+            self.state = "active"
+        while self.recent and now - self.recent[0] > 60:
+            self.recent.popleft()
+
+    def has_capacity(self):
+        return self.state == "active" and (not KEY_REQUESTS_PER_MINUTE or len(self.recent) < KEY_REQUESTS_PER_MINUTE)
+
+    def describe(self):
+        return {
+            "name": self.name,
+            "key": f"...{self.key[-4:]}",
+            "state": self.state,
+            "available_in": max(0, round(self.until - time.monotonic())) if self.state != "active" else 0,
+            "in_flight": self.in_flight,
+            "requests_last_minute": len(self.recent),
+            "requests": self.requests,
+            "failures": self.failures,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "last_error": self.last_error,
+        }
+
+
+class PooledClient:
+    """
+    Stands in for an SDK client or model: `pooled.models.generate_content(...)` runs
+    `factory(key).models.generate_content(...)` on a key picked by the pool, so call
+    sites stay unchanged. One real client per key is built on first use and kept.
+    """
+
+    def __init__(self, pool, name, factory, path=()):
+        self._pool = pool
+        self._name = name
+        self._factory = factory
+        self._path = path
+
+    def __getattr__(self, attribute):
+        return PooledClient(self._pool, self._name, self._factory, self._path + (attribute,))
+
+    def __call__(self, *args, **kwargs):
+        def call_with_key(api_key):
+            target = self._pool.sdk_client(self._name, self._factory, api_key)
+            for attribute in self._path:
+                target = getattr(target, attribute)
+            return target(*args, **kwargs)
+
+        return self._pool.call(call_with_key)
+
+
+class CredentialPool:
+    """
+    Spreads Gemini requests over several API keys.
+
+    Each request goes to the active key with the fewest requests in flight and in the
+    last minute. A rate limit cools the key down (for the server's retry hint if it
+    sent one), a quota error parks it for QUOTA_COOLDOWN_SECONDS and an auth error
+    takes it out until restart - and the request moves on to the next key straight
+    away. Only when no key is left does the error reach call_with_retry / backend_health,
+    so one exhausted key no longer pauses the whole service.
+    """
+
+    def __init__(self, keys=GOOGLE_API_KEYS):
+        self.keys = [ApiKey(key, f"key{i}") for i, key in enumerate(keys, start=1)]
+        self.clients = {}  # (client name, key name) -> SDK client
+        self.lock = threading.Lock()
+
+    def client(self, name, factory):
+        """Pooled stand-in for factory(api_key), e.g. lambda key: genai.Client(api_key=key)"""
+        return PooledClient(self, name, factory)
+
+    def sdk_client(self, name, factory, api_key):
+        with self.lock:
+            client = self.clients.get((name, api_key.name))
+        if client is None:
+            client = factory(api_key.key)
+            with self.lock:
+                client = self.clients.setdefault((name, api_key.name), client)
+        return client
+
+    def acquire(self):
+        """Reserve the least busy key with capacity left"""
+        with self.lock:
+            now = time.monotonic()
+            for api_key in self.keys:
+                api_key.refresh(now)
+
+            candidates = [api_key for api_key in self.keys if api_key.has_capacity()]
+            if not candidates:
+                raise NoKeyAvailable(self._unavailable_reason(now))
+
+            api_key = min(candidates, key=lambda k: (k.in_flight, len(k.recent)))
+            api_key.in_flight += 1
+            api_key.requests += 1
+            api_key.recent.append(now)
+            return api_key
+
+    def _unavailable_reason(self, now):
+        """Why no key can take a request, worded so ErrorHandler.classify_error files it correctly"""
+        if not self.keys:
+            return "GOOGLE_API_KEY not found in environment variables"
+        if all(api_key.state == "disabled" for api_key in self.keys):
+            return "API key rejected: every key in the pool failed authentication"
+
+        waiting = [api_key for api_key in self.keys if api_key.state != "disabled"]
+        wait = min(max(api_key.until - now, 0) if api_key.state != "active" else 60 - (now - api_key.recent[0])
+                   for api_key in waiting)
+        if all(api_key.state == "exhausted" for api_key in waiting):
+            return f"Quota exceeded on every pooled credential (next one back in {wait:.0f}s)"
+        return f"429 rate limit on every pooled credential. Please retry in {max(wait, 1):.0f}s"
+
+    def release(self, api_key, error=None, response=None):
+        """Record how a request on api_key went; key failures take it out of rotation"""
+        error_type = error_handler.classify_error(str(error)) if error is not None else None
+        state = KEY_ERROR_STATES.get(error_type)
+
+        usage = getattr(response, "usage_metadata", None)
+        input_tokens = (getattr(usage, "prompt_token_count", 0) or 0) if usage else 0
+        output_tokens = (getattr(usage, "candidates_token_count", 0) or 0) if usage else 0
+
+        with self.lock:
+            api_key.in_flight -= 1
+            api_key.input_tokens += input_tokens
+            api_key.output_tokens += output_tokens
+            if error is not None:
+                api_key.failures += 1
+                api_key.last_error = error_type
+            if state and api_key.state != "disabled":
+                if state == "cooling":
+                    cooldown = get_retry_after(error) or RATE_LIMIT_COOLDOWN_SECONDS
+                else:
+                    cooldown = QUOTA_COOLDOWN_SECONDS
+                api_key.state = state
+                api_key.until = time.monotonic() + cooldown
+                print(f"API key {api_key.name} out of rotation ({error_type}, {state})")
+
+        api_key_requests_total.inc(key=api_key.name, outcome=error_type or "ok")
+        if input_tokens or output_tokens:
+            api_key_tokens_total.inc(input_tokens + output_tokens, key=api_key.name)
+        return state is not None
+
+    def call(self, call_with_key):
+        """
+        Run call_with_key(api_key) on a pooled key, moving on to the next key when a key
+        is rate limited, out of quota or rejected. Other errors are raised as they are.
+        """
+        while True:
+            api_key = self.acquire()
+            try:
+                response = call_with_key(api_key)
+            except Exception as e:
+                if self.release(api_key, error=e) and self.has_capacity():
+                    continue
+                raise
+            self.release(api_key, response=response)
+            return response
+
+    def has_capacity(self):
+        with self.lock:
+            now = time.monotonic()
+            for api_key in self.keys:
+                api_key.refresh(now)
+            return any(api_key.has_capacity() for api_key in self.keys)
+
+    def get_summary(self):
+        with self.lock:
+            return [api_key.describe() for api_key in self.keys]
+
+
+# Create a global instance shared by every Gemini call site
+gemini_pool = CredentialPool()
+
+registry.gauge(
+    "notescraft_api_key_available", "1 while an API key is in rotation", ["key"],
+    callback=lambda: {(k["name"],): int(k["state"] == "active") for k in gemini_pool.get_summary()})
+
+
+def get_key_usage():
+    return gemini_pool.get_summary()
@@ -0,0 +1,58 @@
+import os
+import threading
+
+MONGO_DB_NAME = 'notescraft'
+
+
+class LazyCollection:
+    """Stands in for db[name]; the connection is only opened when the collection is first used"""
+
+    def __init__(self, database, name):
+        self._database = database
+        self.name = name
+
+    def __getattr__(self, attribute):
+        return getattr(self._database.get_db()[self.name], attribute)
+
+
+class Database:
+    """
+    The process-wide Mongo connection, opened on first use instead of at import.
+
+    Modules take their collections from here (get_collection), so importing them costs
+    nothing: pymongo, the connection pool and its monitor threads only start once a
+    collection is really used, and every module shares that one client instead of
+    opening its own. Collections, their indexes and validators are declared in
+    migrations.
+    """
+
+    def __init__(self):
+        self.client = None
+        self.lock = threading.Lock()
+
+    def get_db(self):
+        if self.client is None:
+            with self.lock:
+                if self.client is None:
+                    mongo_uri = os.getenv("MONGODB_URI")
+                    if not mongo_uri:
+                        raise Exception("MONGODB_URI not set in environment variables")
+
+                    from pymongo import MongoClient
+                    self.client = MongoClient(mongo_uri)
+        return self.client[MONGO_DB_NAME]
+
+    def collection(self, name):
+        return LazyCollection(self, name)
+
+
+# Create global instance
+database = Database()
+
+
+def get_db():
+    return database.get_db()
+
+
+def get_collection(name):
+    return database.collection(name)
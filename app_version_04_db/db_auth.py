@@ -1,23 +1,14 @@
-import os
-from pymongo import MongoClient
 import hashlib
 import secrets
 from datetime import datetime
 
+from database import get_collection
+
 
 class MongoUserAuth:
     def __init__(self):
-        # Get MongoDB connection string from environment variable
-        mongo_uri = os.getenv("MONGODB_URI")
-        if not mongo_uri:
-            raise Exception("MONGODB_URI not set in environment variables")
-
-        self.client = MongoClient(mongo_uri)
-        self.db = self.client['notescraft']
-        self.users = self.db['users']
-
-        # Create index on email for faster lookups
-        self.users.create_index("email", unique=True)
+        # Connects on first use (see database); indexes and validator in migrations
+        self.users = get_collection('users')
 
     def _hash_password(self, password: str) -> str:
         """Create a secure hash of the password"""
@@ -1,23 +1,23 @@
 import os
-from pymongo import MongoClient
-from datetime import datetime
+from datetime import datetime, timezone
 
+from error_handler import error_handler
+from tracing import traced
+from metrics import job_errors_total
+from database import get_collection
 
-class MongoFileLogger:
-    def __init__(self):
-        mongo_uri = os.getenv("MONGODB_URI")
-        if not mongo_uri:
-            raise Exception("MONGODB_URI not set in environment variables")
+# Processing logs are dropped this long after they started (TTL index on created_at, see migrations)
+LOG_RETENTION_DAYS = int(os.getenv("LOG_RETENTION_DAYS", "365"))
 
-        self.client = MongoClient(mongo_uri)
-        self.db = self.client['notescraft']
-        self.logs = self.db['processing_logs']
 
-        # Create index on session_id for faster lookups
-        self.logs.create_index("session_id", unique=True)
+class MongoFileLogger:
+    def __init__(self):
+        self.logs = get_collection('processing_logs')
+        self.error_stats = get_collection('error_stats')
 
-    def start_file_processing(self, filename, file_size_mb, page_count, user_email):
-        """Start logging a new file processing session"""
+    def start_file_processing(self, filename, file_size_mb, page_count, user_email, file_hash=None, preflight=None):
+        """Start logging a new file processing session (file_hash: sha256 of the upload,
+        preflight: document summary from pdf_preflight)"""
         session_id = f"{filename}_{datetime.now().isoformat()}"
 
         log_entry = {
@@ -26,7 +26,11 @@ class MongoFileLogger:
             "filename": filename,
             "file_size_mb": file_size_mb,
             "page_count": page_count,
+            "file_hash": file_hash,
+            "preflight": preflight or {},
             "start_time": datetime.now().isoformat(),
+            # start_time as a date, for the retention TTL index
+            "created_at": datetime.now(timezone.utc),
             "status": "processing",
             "downloaded": False,
             "extraction": {},
@@ -47,6 +51,26 @@ class MongoFileLogger:
         )
         print(f"Started extraction for session: {session_id}")
 
+    def log_pdf_slimming(self, session_id, size_before, size_after):
+        """Log the PDF size before and after slimming for the AI request"""
+        self.logs.update_one(
+            {"session_id": session_id},
+            {"$set": {
+                "extraction.pdf_size_before_mb": round(size_before / (1024 * 1024), 2),
+                "extraction.pdf_size_after_mb": round(size_after / (1024 * 1024), 2)
+            }}
+        )
+        print(f"Slimmed PDF for session: {session_id} "
+              f"({size_before / (1024 * 1024):.1f}MB -> {size_after / (1024 * 1024):.1f}MB)")
+
+    def log_notes_reused(self, session_id, source_doc_id):
+        """Log that the notes were served from the notes cache instead of a new AI job"""
+        self.logs.update_one(
+            {"session_id": session_id},
+            {"$set": {"reused_notes_from": source_doc_id}}
+        )
+        print(f"Reused cached notes for session: {session_id}")
+
     def log_extraction_complete(self, session_id, input_tokens, output_tokens, total_tokens):
         """Log extraction completion"""
         self.logs.update_one(
@@ -73,8 +97,9 @@ class MongoFileLogger:
         )
         print(f"Started generation for session: {session_id}")
 
-    def log_generation_complete(self, session_id, input_tokens, output_tokens, total_tokens):
-        """Log generation completion"""
+    def log_generation_complete(self, session_id, input_tokens, output_tokens, total_tokens,
+                                cache_hits=0, tokens_saved=0):
+        """Log generation completion (cache_hits / tokens_saved: topics served from the topic cache)"""
         self.logs.update_one(
             {"session_id": session_id},
             {"$set": {
@@ -83,6 +108,10 @@ class MongoFileLogger:
                     "input": input_tokens,
                     "output": output_tokens,
                     "total": total_tokens
+                },
+                "generation.cache": {
+                    "hits": cache_hits,
+                    "tokens_saved": tokens_saved
                 }
             }}
         )
@@ -99,8 +128,10 @@ class MongoFileLogger:
         )
         print(f"Completed processing session: {session_id} (Status: success)")
 
-    def log_processing_failure(self, session_id, error_type, technical_error, processing_step):
-        """Log processing failure"""
+    def log_processing_failure(self, session_id, error_type, technical_error, processing_step, fingerprint=None):
+        """Log processing failure (under the fingerprint handle_error gave it, if it went through there)"""
+        fingerprint = fingerprint or error_handler.fingerprint(error_type, technical_error, processing_step)
+
         self.logs.update_one(
             {"session_id": session_id},
             {"$set": {
@@ -108,13 +139,41 @@ class MongoFileLogger:
                 "error": {
                     "error_type": error_type,
                     "technical_error": technical_error,
-                    "processing_step": processing_step
+                    "processing_step": processing_step,
+                    "fingerprint": fingerprint["fingerprint"]
                 },
                 "end_time": datetime.now().isoformat()
             }}
         )
+        self.record_error_fingerprint(fingerprint, session_id, technical_error)
         print(f"Failed processing session: {session_id} (Error: {error_type})")
 
+    def record_error_fingerprint(self, fingerprint, session_id, technical_error):
+        """Count one failure under its fingerprint, keeping the last few samples"""
+        now = datetime.now().isoformat()
+        self.error_stats.update_one(
+            {"fingerprint": fingerprint["fingerprint"]},
+            {
+                "$inc": {"count": 1},
+                "$setOnInsert": {
+                    "error_type": fingerprint["error_type"],
+                    "context": fingerprint["context"],
+                    "template": fingerprint["template"],
+                    "first_seen": now
+                },
+                "$set": {"last_seen": now},
+                "$push": {"samples": {
+                    "$each": [{"session_id": session_id, "technical_error": technical_error[:500]}],
+                    "$slice": -5
+                }}
+            },
+            upsert=True
+        )
+
+    def get_top_errors(self, limit=10):
+        """Most frequent failure causes, grouped by fingerprint"""
+        return list(self.error_stats.find({}, {'_id': 0}).sort("count", -1).limit(limit))
+
     def update_download_status(self, session_id):
         """Mark file as downloaded"""
         self.logs.update_one(
@@ -122,35 +181,37 @@ class MongoFileLogger:
             {"$set": {"downloaded": True}}
         )
 
-    def read_logs(self):
-        """Read all logs"""
-        return list(self.logs.find({}, {'_id': 0}).sort("start_time", -1))
+    def read_logs(self, limit=None):
+        """Read the logs, newest first (limit: only the newest few, read off the start_time index)"""
+        cursor = self.logs.find({}, {'_id': 0}).sort("start_time", -1)
+        if limit:
+            cursor = cursor.limit(limit)
+        return list(cursor)
 
     def get_stats_summary(self):
-        """Get summary statistics"""
-        all_logs = list(self.logs.find({}))
-
-        total = len(all_logs)
-        successful = len([l for l in all_logs if l.get('status') == 'success'])
-        failed = len([l for l in all_logs if l.get('status') == 'failed'])
-        downloaded = len([l for l in all_logs if l.get('downloaded')])
-
-        total_extraction_tokens = sum(
-            l.get('extraction', {}).get('tokens', {}).get('total', 0)
-            for l in all_logs
-        )
-        total_generation_tokens = sum(
-            l.get('generation', {}).get('tokens', {}).get('total', 0)
-            for l in all_logs
-        )
+        """Get summary statistics (summed up by the database, the logs never leave it)"""
+        def count_if(condition):
+            return {"$sum": {"$cond": [condition, 1, 0]}}
+
+        totals = next(self.logs.aggregate([{"$group": {
+            "_id": None,
+            "total": {"$sum": 1},
+            "successful": count_if({"$eq": ["$status", "success"]}),
+            "failed": count_if({"$eq": ["$status", "failed"]}),
+            "downloaded": count_if({"$eq": ["$downloaded", True]}),
+            "extraction_tokens": {"$sum": "$extraction.tokens.total"},
+            "generation_tokens": {"$sum": "$generation.tokens.total"},
+            "tokens_saved": {"$sum": "$generation.cache.tokens_saved"},
+        }}]), {})
 
         return {
-            'total_processed': total,
-            'successful': successful,
-            'failed': failed,
-            'downloaded': downloaded,
-            'total_extraction_tokens': total_extraction_tokens,
-            'total_generation_tokens': total_generation_tokens,
+            'total_processed': totals.get('total', 0),
+            'successful': totals.get('successful', 0),
+            'failed': totals.get('failed', 0),
+            'downloaded': totals.get('downloaded', 0),
+            'total_extraction_tokens': totals.get('extraction_tokens', 0),
+            'total_generation_tokens': totals.get('generation_tokens', 0),
+            'total_tokens_saved': totals.get('tokens_saved', 0),
             'average_processing_time': 0
         }
 
@@ -159,29 +220,48 @@ class MongoFileLogger:
 file_logger = MongoFileLogger()
 
 
-def start_file_processing(filename, file_size_mb, page_count, user_email):
-    return file_logger.start_file_processing(filename, file_size_mb, page_count, user_email)
+@traced("db_log")
+def start_file_processing(filename, file_size_mb, page_count, user_email, file_hash=None, preflight=None):
+    return file_logger.start_file_processing(filename, file_size_mb, page_count, user_email, file_hash, preflight)
 
 
+@traced("db_log")
 def log_extraction_start(session_id):
     return file_logger.log_extraction_start(session_id)
 
 
+@traced("db_log")
+def log_pdf_slimming(session_id, size_before, size_after):
+    return file_logger.log_pdf_slimming(session_id, size_before, size_after)
+
+
+@traced("db_log")
+def log_notes_reused(session_id, source_doc_id):
+    return file_logger.log_notes_reused(session_id, source_doc_id)
+
+
+@traced("db_log")
 def log_extraction_complete(session_id, input_tokens, output_tokens, total_tokens):
     return file_logger.log_extraction_complete(session_id, input_tokens, output_tokens, total_tokens)
 
 
+@traced("db_log")
 def log_generation_start(session_id, content_sections):
     return file_logger.log_generation_start(session_id, content_sections)
 
 
-def log_generation_complete(session_id, input_tokens, output_tokens, total_tokens):
-    return file_logger.log_generation_complete(session_id, input_tokens, output_tokens, total_tokens)
+@traced("db_log")
+def log_generation_complete(session_id, input_tokens, output_tokens, total_tokens, cache_hits=0, tokens_saved=0):
+    return file_logger.log_generation_complete(session_id, input_tokens, output_tokens, total_tokens,
+                                               cache_hits, tokens_saved)
 
 
+@traced("db_log")
 def log_processing_success(session_id):
     return file_logger.log_processing_success(session_id)
 
 
-def log_processing_failure(session_id, error_type, technical_error, processing_step):
-    return file_logger.log_processing_failure(session_id, error_type, technical_error, processing_step)
\ No newline at end of file
+@traced("db_log")
+def log_processing_failure(session_id, error_type, technical_error, processing_step, fingerprint=None):
+    job_errors_total.inc(error_type=error_type, stage=processing_step)
+    return file_logger.log_processing_failure(session_id, error_type, technical_error, processing_step, fingerprint)
\ No newline at end of file
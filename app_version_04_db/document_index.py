@@ -0,0 +1,108 @@
+import os
+from collections import Counter
+from datetime import datetime, timezone
+
+from minhash import band_keys, estimated_similarity
+from database import get_collection
+
+# Estimated Jaccard similarity at which a document counts as the same one re-uploaded
+SIMILARITY_THRESHOLD = 0.75
+# Most candidate documents compared per lookup
+MAX_CANDIDATES = 50
+# File hashes an LSH bucket keeps (the newest); bounds the bucket document however busy it is
+MAX_BUCKET_DOCS = int(os.getenv("MAX_BUCKET_DOCS", "500"))
+# Indexed documents are dropped this long after they were processed (TTL indexes, see migrations)
+NOTES_CACHE_TTL_DAYS = int(os.getenv("NOTES_CACHE_TTL_DAYS", "180"))
+
+
+class DocumentIndex:
+    """
+    Notes of processed documents, findable by exact file hash or by near-duplicate text.
+
+    Every collection is keyed and queried by _id only, so each one can be sharded on a
+    hashed _id and lookups stay point reads however many documents are indexed:
+      notes_cache         file hash -> generated notes
+      document_signatures file hash -> MinHash signature
+      lsh_buckets         "band:hash" -> newest MAX_BUCKET_DOCS file hashes in that bucket
+
+    All three expire after NOTES_CACHE_TTL_DAYS: notes and signatures from created_at,
+    a bucket once no document has been added to it for that long (all of its documents
+    have expired by then). A busy bucket never expires, but it only keeps its newest
+    hashes, so expired documents drop out of it as new ones come in.
+    """
+
+    def __init__(self):
+        self.notes = get_collection('notes_cache')
+        self.signatures = get_collection('document_signatures')
+        self.buckets = get_collection('lsh_buckets')
+
+    def find_match(self, file_hash, signature=None):
+        """
+        Best already processed document for an upload.
+        Returns {"doc_id", "similarity"} or None.
+        """
+        if file_hash and self.notes.count_documents({"_id": file_hash}, limit=1):
+            return {"doc_id": file_hash, "similarity": 1.0}
+
+        if not signature:
+            return None
+
+        shared_buckets = Counter()
+        for bucket in self.buckets.find({"_id": {"$in": band_keys(signature)}}):
+            shared_buckets.update(bucket["docs"])
+        # Documents sharing the most buckets are the most similar ones
+        ranked = [doc_id for doc_id, _ in shared_buckets.most_common(MAX_CANDIDATES)]
+
+        best = None
+        for stored in self.signatures.find({"_id": {"$in": ranked}}):
+            similarity = estimated_similarity(signature, stored["signature"])
+            if similarity >= SIMILARITY_THRESHOLD and (not best or similarity > best["similarity"]):
+                best = {"doc_id": stored["_id"], "similarity": round(similarity, 3)}
+
+        return best
+
+    def add_document(self, file_hash, signature, notes, session_id=None):
+        """Store a document's notes and index its signature"""
+        now = datetime.now(timezone.utc)
+        self.notes.replace_one(
+            {"_id": file_hash},
+            {"notes": notes, "session_id": session_id, "created_at": now},
+            upsert=True
+        )
+
+        if not signature:
+            return
+
+        stored = self.signatures.replace_one({"_id": file_hash}, {"signature": signature, "created_at": now},
+                                             upsert=True)
+        if stored.matched_count:
+            return  # same file, same text: already in its buckets
+
+        for key in band_keys(signature):
+            self.buckets.update_one(
+                {"_id": key},
+                {"$push": {"docs": {"$each": [file_hash], "$slice": -MAX_BUCKET_DOCS}}, "$set": {"updated_at": now}},
+                upsert=True
+            )
+
+    def load_notes(self, doc_id):
+        """Cached notes for a document, or None"""
+        entry = self.notes.find_one({"_id": doc_id}, {"notes": 1})
+        return entry["notes"] if entry else None
+
+
+# Create global instance
+document_index = DocumentIndex()
+
+
+# Convenience functions
+def find_matching_document(file_hash, signature=None):
+    return document_index.find_match(file_hash, signature)
+
+
+def remember_document(file_hash, signature, notes, session_id=None):
+    return document_index.add_document(file_hash, signature, notes, session_id)
+
+
+def load_cached_notes(doc_id):
+    return document_index.load_notes(doc_id)
@@ -1,7 +1,55 @@
+import functools
+import hashlib
 import re
 from datetime import datetime
 
 
+# Keywords per error type, in priority order - the first type found in a message wins
+ERROR_KEYWORDS = [
+    # API Key issues - check for environment variables specifically
+    ("API_KEY_ERROR", ["api key", "authentication", "unauthorized", "401", "environment variables",
+                       "google_api_key not found"]),
+    # Rate limiting
+    ("API_RATE_LIMIT", ["rate limit", "429", "too many requests"]),
+    # Quota exceeded
+    ("API_QUOTA_EXCEEDED", ["quota", "limit exceeded", "403"]),
+    # Timeout issues
+    ("API_TIMEOUT", ["timeout", "timed out", "504", "502"]),
+    # Connection problems
+    ("API_CONNECTION_ERROR", ["connection", "network", "503", "500"]),
+    # JSON parsing issues
+    ("JSON_PARSE_ERROR", ["json", "parsing", "decode", "invalid json"]),
+    # File extraction problems
+    ("FILE_EXTRACTION_ERROR", ["extraction", "pdf", "docx", "file"]),
+    # Notes generation issues
+    ("NOTES_GENERATION_ERROR", ["notes generation", "generate content"]),
+    # Word file creation
+    ("WORD_FILE_ERROR", ["word file", "docx creation"]),
+]
+
+
+@functools.lru_cache(maxsize=1024)
+def classify_message(error_lower: str) -> str:
+    """Return the first error type in ERROR_KEYWORDS with a keyword in the (lowercased) message"""
+    for error_type, keywords in ERROR_KEYWORDS:
+        for keyword in keywords:
+            if keyword in error_lower:
+                return error_type
+    return "UNKNOWN_ERROR"
+
+
+# Rules that turn a technical error into a message template for fingerprinting (applied in order)
+TEMPLATE_RULES = [
+    (re.compile(r"raw response:.*", re.DOTALL), "raw response: <raw>"),
+    (re.compile(r"\d{4}-\d{2}-\d{2}t[\d:.+-]+"), "<time>"),
+    (re.compile(r"[\w.+-]+@[\w-]+\.[\w.]+"), "<email>"),
+    (re.compile(r"(?:[a-z]:)?[\\/][\w\\/. -]+\.\w+"), "<path>"),
+    (re.compile(r"'[^']*'|\"[^\"]*\""), "<str>"),
+    (re.compile(r"\b[0-9a-f]{8,}\b|\b[0-9a-f-]{32,36}\b"), "<id>"),
+    (re.compile(r"\d+(?:\.\d+)?"), "<n>"),
+]
+
+
 class ErrorHandler:
     """
     Centralized error handling for the AI Notes app.
@@ -47,48 +95,26 @@ class ErrorHandler:
         Automatically classify errors based on technical error messages.
         Returns the appropriate error type.
         """
-        error_lower = technical_error.lower()
-
-        # API Key issues - check for environment variables specifically
-        if any(keyword in error_lower for keyword in
-               ["api key", "authentication", "unauthorized", "401", "environment variables",
-                "google_api_key not found"]):
-            return "API_KEY_ERROR"
-
-        # Rate limiting
-        if any(keyword in error_lower for keyword in ["rate limit", "429", "too many requests"]):
-            return "API_RATE_LIMIT"
-
-        # Quota exceeded
-        if any(keyword in error_lower for keyword in ["quota", "limit exceeded", "403"]):
-            return "API_QUOTA_EXCEEDED"
-
-        # Timeout issues
-        if any(keyword in error_lower for keyword in ["timeout", "timed out", "504", "502"]):
-            return "API_TIMEOUT"
-
-        # Connection problems
-        if any(keyword in error_lower for keyword in ["connection", "network", "503", "500"]):
-            return "API_CONNECTION_ERROR"
-
-        # JSON parsing issues
-        if any(keyword in error_lower for keyword in ["json", "parsing", "decode", "invalid json"]):
-            return "JSON_PARSE_ERROR"
+        # Storms of the same error are common (e.g. rate limits), so results are memoized
+        return classify_message(technical_error.lower())
 
-        # File extraction problems
-        if any(keyword in error_lower for keyword in ["extraction", "pdf", "docx", "file"]):
-            return "FILE_EXTRACTION_ERROR"
-
-        # Notes generation issues
-        if any(keyword in error_lower for keyword in ["notes generation", "generate content"]):
-            return "NOTES_GENERATION_ERROR"
-
-        # Word file creation
-        if any(keyword in error_lower for keyword in ["word file", "docx creation"]):
-            return "WORD_FILE_ERROR"
-
-        # Default to unknown
-        return "UNKNOWN_ERROR"
+    def fingerprint(self, error_type: str, technical_error: str, context: str = "") -> dict:
+        """
+        Normalize an error into a stable fingerprint: error type + context + message template.
+        Variable parts (ids, numbers, paths, quoted values) are replaced with placeholders.
+        """
+        template = technical_error.lower()
+        for pattern, placeholder in TEMPLATE_RULES:
+            template = pattern.sub(placeholder, template)
+        template = " ".join(template.split())[:200]
+
+        key = f"{error_type}|{context}|{template}"
+        return {
+            "fingerprint": hashlib.sha1(key.encode("utf-8")).hexdigest()[:12],
+            "error_type": error_type,
+            "context": context,
+            "template": template
+        }
 
     def handle_error(self, error_type: str = None, technical_error: str = "", context: str = ""):
         """
@@ -100,7 +126,7 @@ class ErrorHandler:
             context: Additional context (like which function failed)
 
         Returns:
-            dict: Contains user_message, technical_error, error_type, and timestamp
+            dict: Contains user_message, technical_error, error_type, fingerprint and timestamp
         """
 
         # Auto-classify if no error type provided
@@ -115,11 +141,16 @@ class ErrorHandler:
         # Add context to technical error if provided
         full_technical_error = f"{context}: {technical_error}" if context else technical_error
 
+        # Group identical failures under one fingerprint
+        fingerprint = self.fingerprint(error_type, technical_error, context)
+
         # Create error response
         error_response = {
             "user_message": user_message,
             "technical_error": full_technical_error,
             "error_type": error_type,
+            # The whole fingerprint, so log_processing_failure counts the failure under this one
+            "fingerprint": fingerprint,
             "timestamp": datetime.now().isoformat()
         }
 
@@ -137,7 +168,7 @@ class ErrorHandler:
         return error_type in retryable_errors
 
 
-# Create a global instance for easy importing
+# Create global instance for easy importing
 error_handler = ErrorHandler()
 
 
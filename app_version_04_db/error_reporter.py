@@ -0,0 +1,169 @@
+import atexit
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+import requests
+
+
+ERROR_REPORT_URL = 'https://script.google.com/macros/s/AKfycbz6Gbht0iZ4tW7lp48x3hDYCvYIDGZbOYdwnpbmyHSQjxsdZ0D0zsx7ZU84eN9n0g2T9w/exec'
+# "http" posts reports to ERROR_REPORT_URL, "local" keeps them in memory (tests, load runs)
+ERROR_REPORT_SINK = os.getenv("ERROR_REPORT_SINK", "http")
+
+
+class HttpSink:
+    """Posts a batch of error reports to the Apps Script endpoint"""
+
+    def __init__(self, url=ERROR_REPORT_URL, timeout=5):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def send(self, batch):
+        # The sheet script reads a single "Error" field, so a batch goes in as one entry per line
+        self.session.post(self.url, json={"Error": "\n".join(batch)}, timeout=self.timeout)
+
+
+class LocalSink:
+    """Keeps batches in memory instead of sending them. Use it for local runs and tests."""
+
+    def __init__(self, max_batches=1000):
+        self.batches = deque(maxlen=max_batches)
+
+    def send(self, batch):
+        self.batches.append(list(batch))
+
+
+class ErrorReporter:
+    """
+    Fire-and-forget error reporting.
+    report() only does a dict lookup and a non-blocking queue put; a daemon thread
+    batches the reports and hands them to the sink. Identical errors inside
+    `dedup_window` seconds are counted instead of sent again; the count goes out as
+    "[repeated Nx] <error>" once the window closes. Reports are dropped (and counted)
+    when the queue is full.
+    """
+
+    def __init__(self, sink=None, max_queue=500, batch_size=20, flush_interval=5.0, dedup_window=300):
+        self.sink = sink or HttpSink()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dedup_window = dedup_window
+
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.last_reported = {}  # error -> time it was last queued
+        self.suppressed = {}  # error -> duplicates skipped since then
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+        self.worker = threading.Thread(target=self._run, name="error-reporter", daemon=True)
+        self.worker.start()
+
+    def report(self, error):
+        """Queue an error for reporting. Never blocks and never raises."""
+        if not error:
+            return
+
+        error = str(error)
+        now = time.monotonic()
+
+        with self.lock:
+            last = self.last_reported.get(error)
+            if last is not None and now - last < self.dedup_window:
+                self.suppressed[error] = self.suppressed.get(error, 0) + 1
+                return
+
+            # Window over but the worker hasn't summarized it yet
+            repeats = self.suppressed.pop(error, 0)
+            self.last_reported[error] = now
+
+        if repeats:
+            error = f"[repeated {repeats}x] {error}"
+
+        try:
+            self.queue.put_nowait(error)
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+
+    def _run(self):
+        while True:
+            # Wake up every flush_interval even when idle, to close dedup windows
+            try:
+                batch = [self.queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                batch = []
+            deadline = time.monotonic() + self.flush_interval
+
+            while batch and len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            summaries = self._close_windows()
+            if batch or summaries:
+                self._send(batch, summaries)
+
+    def _close_windows(self, force=False):
+        """
+        Forget errors whose dedup window is over (all of them if `force`), returning
+        "[repeated Nx]" summaries for the ones that were suppressed meanwhile.
+        """
+        now = time.monotonic()
+        summaries = []
+        with self.lock:
+            for error, last in list(self.last_reported.items()):
+                if force or now - last >= self.dedup_window:
+                    del self.last_reported[error]
+                    repeats = self.suppressed.pop(error, 0)
+                    if repeats:
+                        summaries.append(f"[repeated {repeats}x] {error}")
+        return summaries
+
+    def _send(self, batch, summaries=()):
+        queued = len(batch)
+        lines = batch + list(summaries)
+        with self.lock:
+            dropped, self.dropped = self.dropped, 0
+        if dropped:
+            lines.append(f"[error reporter] {dropped} reports dropped, queue was full")
+
+        try:
+            self.sink.send(lines)
+        except Exception as e:
+            print(f"Error reporting failed: {e}")
+        finally:
+            for _ in range(queued):
+                self.queue.task_done()
+
+    def flush(self, timeout=5.0):
+        """
+        Wait (up to `timeout` seconds) until everything queued so far has been sent,
+        including the repeat counts of dedup windows that are still open.
+        """
+        for summary in self._close_windows(force=True):
+            try:
+                self.queue.put_nowait(summary)
+            except queue.Full:
+                with self.lock:
+                    self.dropped += 1
+
+        end = time.monotonic() + timeout
+        while self.queue.unfinished_tasks and time.monotonic() < end:
+            time.sleep(0.05)
+
+
+# Create global reporter instance
+error_reporter = ErrorReporter(LocalSink() if ERROR_REPORT_SINK == "local" else HttpSink())
+atexit.register(error_reporter.flush, 2.0)
+
+
+def report_error(Error):
+    """Report an error in the background"""
+    error_reporter.report(Error)
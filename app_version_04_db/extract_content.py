@@ -1,11 +1,9 @@
 import os
 import json
+from concurrent.futures import ThreadPoolExecutor
 
-import requests
-# import google ai  library to access gemini
-from google import genai
-# import types library from Google genai to work with different files then text
-from google.genai import types
+# google-genai (the Gemini SDK) and fitz (PyMuPDF) are imported in the functions that use
+# them: loading them takes seconds, and the app imports this module at startup
 # import dotenv library to load api key
 from dotenv import load_dotenv
 # import the system instructions for AI
@@ -15,21 +13,49 @@ from error_handler import handle_api_error, handle_file_error
 
 from db_logger import log_extraction_start, log_extraction_complete
 
+from retry import call_with_retry
+from tracing import span, carry_context
+from metrics import time_gemini_request, record_tokens
+from metering import charge_tokens
+# errors are reported in the background so a slow endpoint never delays a job
+from error_reporter import report_error
+from credential_pool import gemini_pool
+
 # Load the .env file to get API key
 load_dotenv()
 
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+# Alternative Gemini endpoint, e.g. the local stand-in in benchmarks/fake_gemini.py
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL")
 
+# Extraction model per pre-flight document kind (see pdf_preflight.document_kind).
+# Scans are pure OCR work, so they can be pointed at a different model without touching the rest.
+EXTRACTION_MODELS = {
+    "digital": os.getenv("GEMINI_EXTRACTION_MODEL", "gemini-2.5-flash"),
+    "scanned": os.getenv("GEMINI_SCANNED_EXTRACTION_MODEL", os.getenv("GEMINI_EXTRACTION_MODEL", "gemini-2.5-flash")),
+}
 
-def report_error(Error):
-    if Error:
-        try:
-            requests.post(
-                'https://script.google.com/macros/s/AKfycbz6Gbht0iZ4tW7lp48x3hDYCvYIDGZbOYdwnpbmyHSQjxsdZ0D0zsx7ZU84eN9n0g2T9w/exec',
-                json={"Error": Error},
-            )
-        except Exception as e:
-            print(f"Error reporting failed: {e}")
+
+# "auto": split on the PDF's bookmark outline when it has one, "whole": always send the whole document
+EXTRACTION_MODE = os.getenv("EXTRACTION_MODE", "auto")
+# Outline sections sent to Gemini at once, and the most sections one document is cut into
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", "4"))
+MAX_OUTLINE_SECTIONS = 8
+
+
+def extraction_model(preflight=None):
+    """Pick the extraction model from the pre-flight result (mixed documents go to the scanned model)"""
+    kind = preflight.get("kind") if preflight else "digital"
+    return EXTRACTION_MODELS["scanned" if kind in ("scanned", "mixed") else "digital"]
+
+
+def extraction_client(api_key):
+    from google import genai
+    from google.genai import types
+
+    return genai.Client(
+        api_key=api_key,
+        http_options=types.HttpOptions(base_url=GEMINI_BASE_URL) if GEMINI_BASE_URL else None
+    )
 
 
 def clean_raw_response_from_ai(ai_response: str) -> str:
@@ -88,134 +114,257 @@ def safe_get_text(response):
         return None
 
 
-def send_msg_to_ai(uploaded_file,session_id= None):
-    """Send file to Gemini and return structured JSON or error dict."""
-
-    if session_id:
-        print(f"ID: {session_id}")
-
-        log_extraction_start(session_id)
+def call_gemini_extraction(client, contents, model, deadline=None, context="Extraction"):
+    """
+    One extraction request: Gemini call, response checks and JSON parsing.
+    Returns (parsed dict or error dict, (input, output, total) tokens or None if no response came back).
+    """
+    from google.genai import types
 
+    # Send to Gemini API
     try:
-        # Check API key first
-        if not GOOGLE_API_KEY:
-            error_result = handle_api_error(
-                "GOOGLE_API_KEY not found in environment variables",
-                "API Configuration"
+        with span("gemini.call", model=model), time_gemini_request("extraction"):
+            response = call_with_retry(
+                client.models.generate_content,
+                deadline=deadline,
+                context=context,
+                model=model,
+                config=types.GenerateContentConfig(system_instruction=instructions),
+                contents=contents
             )
-            report_error(error_result["technical_error"])
+    except Exception as e:
+        # Handle different API errors
+        error_msg = str(e).lower()
+
+        if "api key" in error_msg or "authentication" in error_msg:
+            error_result = handle_api_error(str(e), "API Authentication")
+        elif "rate limit" in error_msg or "429" in error_msg:
+            error_result = handle_api_error(str(e), "Rate Limiting")
+        elif "quota" in error_msg or "limit exceeded" in error_msg:
+            error_result = handle_api_error(str(e), "Quota Exceeded")
+        else:
+            error_result = handle_api_error(str(e), "API Request")
 
-            return error_result
+        report_error(error_result["technical_error"])
 
-        client = genai.Client(api_key=GOOGLE_API_KEY)
+        return error_result, None
 
+    if not response:
+        error_result = handle_api_error(
+            "No response received from Gemini API",
+            "API Response"
+        )
+        report_error(error_result["technical_error"])
 
+        return error_result, None
 
+    raw_text = safe_get_text(response)
 
-        # Try to read file
-        try:
-            file_data = uploaded_file.read_bytes()
-        except Exception as e:
-            error_result = handle_file_error(
-                f"Could not read uploaded file: {str(e)}",
-                "File Reading"
-            )
-            report_error(error_result["technical_error"])
+    # Token usage
+    usage = (
+        response.usage_metadata.prompt_token_count,
+        response.usage_metadata.candidates_token_count,
+        response.usage_metadata.total_token_count,
+    )
+    record_tokens("extraction", usage[0], usage[1])
+    charge_tokens("extraction", model, usage[0], usage[1])
 
+    if not raw_text:
+        error_result = handle_api_error(
+            "No text extracted from Gemini response - response was empty",
+            "Text Extraction"
+        )
+        # report_error(error_result["technical_error"])
 
-            return error_result
-
-        # Send to Gemini API
-        try:
-            response = client.models.generate_content(
-                model="gemini-2.5-flash",
-                config=types.GenerateContentConfig(system_instruction=instructions),
-                contents=[
-                    types.Part.from_bytes(
-                        data=file_data,
-                        mime_type="application/pdf"
-                    )
-                ]
-            )
-        except Exception as e:
-            # Handle different API errors
-            error_msg = str(e).lower()
-
-            if "api key" in error_msg or "authentication" in error_msg:
-                error_result = handle_api_error(str(e), "API Authentication")
-            elif "rate limit" in error_msg or "429" in error_msg:
-                error_result = handle_api_error(str(e), "Rate Limiting")
-            elif "quota" in error_msg or "limit exceeded" in error_msg:
-                error_result = handle_api_error(str(e), "Quota Exceeded")
-            else:
-                error_result = handle_api_error(str(e), "API Request")
+        return error_result, usage
 
-            report_error(error_result["technical_error"])
+    with span("json_parse", chars=len(raw_text)):
+        cleaned = clean_raw_response_from_ai(raw_text)
 
+        parsed = finalize_extracted_content(cleaned)
 
+    # Check if parsing returned an error dict
+    if isinstance(parsed, dict) and "error_type" in parsed:
+        return parsed, usage  # Return error dict
+    elif parsed is None:
+        error_result = handle_file_error(
+            "Content extraction returned None after processing",
+            "Content Processing"
+        )
+        report_error(error_result["technical_error"])
+        return error_result, usage
 
-            return error_result
+    return parsed, usage  # Success, return dictionary
 
-        if not response:
-            error_result = handle_api_error(
-                "No response received from Gemini API",
-                "API Response"
-            )
-            report_error(error_result["technical_error"])
 
+def outline_sections(preflight, max_sections=MAX_OUTLINE_SECTIONS):
+    """
+    Cut the document into topic page ranges using its bookmark outline.
+    Returns [(titles, first_page, last_page)] (1-based, inclusive) or None when the outline
+    is missing or too thin to be worth splitting on. Pages before the first bookmark
+    (cover, contents) become a section without titles. Small neighbouring sections are
+    merged until there are at most max_sections requests.
+    """
+    if not preflight or not preflight.get("outline"):
+        return None
 
-            return error_result
+    page_count = preflight["page_count"]
+    outline = [entry for entry in preflight["outline"] if entry["page"] <= page_count]
 
-        raw_text = safe_get_text(response)
+    # Shallowest outline level that gives at least two sections
+    entries = []
+    for level in sorted({entry["level"] for entry in outline}):
+        entries = [entry for entry in outline if entry["level"] <= level]
+        if len({entry["page"] for entry in entries}) >= 2:
+            break
+    else:
+        return None
 
-        # Log token usage
-        input_token = response.usage_metadata.prompt_token_count
-        output_token = response.usage_metadata.candidates_token_count
-        total_token = response.usage_metadata.total_token_count
-        #
-        # print(f'\nRaw Extracted Text: {raw_text}')
-        # print(f'\nInput Token of extraction: {input_token}')
-        # print(f'\nOutput Token extraction: {output_token}')
-        # print(f'\nTotal Token of extraction: {total_token}')
+    # Entries starting on the same page share one section
+    starts = {}
+    for entry in entries:
+        starts.setdefault(entry["page"], []).append(entry["title"])
+
+    pages = sorted(starts)
+    sections = []
+    if pages[0] > 1:
+        sections.append(([], 1, pages[0] - 1))
+    for i, first in enumerate(pages):
+        last = pages[i + 1] - 1 if i + 1 < len(pages) else page_count
+        sections.append((starts[first], first, last))
+
+    while len(sections) > max_sections:
+        # Merge the smallest adjacent pair
+        i = min(range(len(sections) - 1),
+                key=lambda j: sections[j + 1][2] - sections[j][1])
+        titles = sections[i][0] + sections[i + 1][0]
+        sections[i:i + 2] = [(titles, sections[i][1], sections[i + 1][2])]
+
+    return sections
+
+
+def section_hint(titles, first_page, last_page):
+    """Prompt text that tells the model which headings this page range starts with"""
+    pages = f"page {first_page}" if first_page == last_page else f"pages {first_page}-{last_page}"
+    if not titles:
+        return f"This is {pages} of the document, before its first chapter."
+    headings = "; ".join(f'"{title}"' for title in titles)
+    return (f"This is {pages} of the document. It covers the section(s) {headings} - "
+            f"use these exact titles as the headings for their content.")
+
+
+def extract_by_outline(client, uploaded_file, sections, model, deadline=None):
+    """
+    Extract each outline section as its own small PDF, all in parallel, and merge
+    the results in document order. Returns (merged dict or the first error dict, summed tokens).
+    """
+    import fitz  # PyMuPDF
+    from google.genai import types
+
+    # fitz documents are not thread safe, so cut all the page ranges up front
+    parts = []
+    with span("split_outline", sections=len(sections)), fitz.open(uploaded_file) as doc:
+        for titles, first_page, last_page in sections:
+            with fitz.open() as part:
+                part.insert_pdf(doc, from_page=first_page - 1, to_page=last_page - 1)
+                parts.append((section_hint(titles, first_page, last_page),
+                              part.tobytes(garbage=3, deflate=True)))
+
+    def extract_part(index):
+        hint, data = parts[index]
+        contents = [types.Part.from_bytes(data=data, mime_type="application/pdf"), hint]
+        with span("section", number=index + 1, pages=f"{sections[index][1]}-{sections[index][2]}"):
+            return call_gemini_extraction(client, contents, model, deadline,
+                                          context=f"Extraction section {index + 1}/{len(parts)}")
+
+    with ThreadPoolExecutor(max_workers=min(EXTRACTION_WORKERS, len(parts))) as pool:
+        # Each section keeps the job's trace (one context copy per call)
+        futures = [pool.submit(carry_context(extract_part), index) for index in range(len(parts))]
+        results = [future.result() for future in futures]
+
+    usage = [0, 0, 0]
+    for _, part_usage in results:
+        for i, count in enumerate(part_usage or ()):
+            usage[i] += count or 0
+
+    merged = {}
+    for parsed, _ in results:
+        if not isinstance(parsed, dict) or "error_type" in parsed:
+            return parsed, tuple(usage)
+        for heading, text in parsed.items():
+            # The same heading can show up at the end of one range and the start of the next
+            merged[heading] = f"{merged[heading]}\n\n{text}" if heading in merged else text
+
+    return merged, tuple(usage)
+
+
+def send_msg_to_ai(uploaded_file,session_id= None, deadline=None, preflight=None):
+    """Send file to Gemini and return structured JSON or error dict.
+    Transient API errors are retried within the job's deadline budget.
+    preflight (pdf_preflight.analyze_pdf) picks the model when given, and when the PDF has a
+    bookmark outline each outline section is extracted separately and in parallel."""
 
-        if session_id:
-            print(f"ID: {session_id}")
-            log_extraction_complete(session_id,input_token,output_token,total_token)
+    if session_id:
+        print(f"ID: {session_id}")
 
+        log_extraction_start(session_id)
 
-        if not raw_text:
+    try:
+        # Check API key first
+        if not gemini_pool.keys:
             error_result = handle_api_error(
-                "No text extracted from Gemini response - response was empty",
-                "Text Extraction"
+                "GOOGLE_API_KEY not found in environment variables",
+                "API Configuration"
             )
-            # report_error(error_result["technical_error"])
-
-
+            report_error(error_result["technical_error"])
 
             return error_result
 
-        cleaned = clean_raw_response_from_ai(raw_text)
-
-        # print("------------------------------------------------------------------------")
-
-        # print(f"Text Extracted : {cleaned}")
-
-        # print("------------------------------------------------------------------------")
-
-        parsed = finalize_extracted_content(cleaned)
-
-        # Check if parsing returned an error dict
-        if isinstance(parsed, dict) and "error_type" in parsed:
-            return parsed  # Return error dict
-        elif parsed is None:
-            error_result = handle_file_error(
-                "Content extraction returned None after processing",
-                "Content Processing"
+        # Each request goes out on one of the pooled API keys (see credential_pool)
+        client = gemini_pool.client("extraction", extraction_client)
+        model = extraction_model(preflight)
+
+        sections = outline_sections(preflight) if EXTRACTION_MODE == "auto" else None
+
+        if sections:
+            print(f"Extracting {len(sections)} outline sections in parallel")
+            try:
+                parsed, usage = extract_by_outline(client, uploaded_file, sections, model, deadline)
+            except Exception as e:
+                error_result = handle_file_error(
+                    f"Could not split uploaded file by outline: {str(e)}",
+                    "File Reading"
+                )
+                report_error(error_result["technical_error"])
+
+                return error_result
+        else:
+            # Try to read file
+            try:
+                file_data = uploaded_file.read_bytes()
+            except Exception as e:
+                error_result = handle_file_error(
+                    f"Could not read uploaded file: {str(e)}",
+                    "File Reading"
+                )
+                report_error(error_result["technical_error"])
+
+                return error_result
+
+            from google.genai import types
+
+            parsed, usage = call_gemini_extraction(
+                client,
+                [types.Part.from_bytes(data=file_data, mime_type="application/pdf")],
+                model,
+                deadline
             )
-            report_error(error_result["technical_error"])
-            return error_result
 
-        return parsed  # Success, return dictionary
+        if session_id and usage:
+            print(f"ID: {session_id}")
+            log_extraction_complete(session_id, *usage)
+
+        return parsed
 
     except Exception as e:
         # Catch any unexpected errors
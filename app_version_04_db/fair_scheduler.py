@@ -0,0 +1,213 @@
+import asyncio
+import functools
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from metrics import fair_queue_wait
+from database import get_collection
+
+# Generation requests (one per topic) in flight at once, across all jobs and users
+GENERATION_SLOTS = int(os.getenv("GENERATION_SLOTS", "4"))
+# Threads the generation step of running jobs runs on (run_generation). Their topics wait for
+# slots there, instead of parking threads of the shared pool (run.io_bound) that job polling
+# and Mongo calls need.
+GENERATION_THREADS = int(os.getenv("GENERATION_THREADS", "32"))
+
+# Share of capacity per priority tier (users.priority); users without one get "default"
+PRIORITY_WEIGHTS = {"default": 1.0, "early_access": 2.0, "paid": 4.0}
+for _entry in filter(None, os.getenv("PRIORITY_WEIGHTS", "").split(",")):
+    _tier, _weight = _entry.split("=", 1)
+    PRIORITY_WEIGHTS[_tier.strip()] = float(_weight)
+
+# How long a user's weight is trusted before users is read again
+WEIGHT_CACHE_SECONDS = 5 * 60
+
+# Starting guesses for the ETAs, replaced by moving averages of real runs
+INITIAL_TOPIC_SECONDS = 15.0
+INITIAL_JOB_SECONDS = 120.0
+AVERAGE_WEIGHT = 0.2
+
+
+class FairShareScheduler:
+    """
+    Weighted fair sharing of the AI backend between users, at two levels.
+
+    Admission: jobs waiting for a backend slot (see backend_health) are ordered by their
+    user's running jobs divided by the user's weight, then by arrival, so a user with
+    several queued documents doesn't get every slot that frees up.
+
+    Generation: every topic of every job asks for one of GENERATION_SLOTS before its
+    Gemini call. Waiting topics are served in start-time fair queuing order: a topic's
+    tag is max(virtual time, the user's last finish tag) and its finish tag adds
+    cost / weight, so users progress in proportion to their weight however many topics
+    they have queued, and an idle user doesn't bank credit. A job sends its topics one
+    at a time, so a user's weight only buys more than one slot when they run several jobs.
+    """
+
+    def __init__(self, slots=GENERATION_SLOTS):
+        self.slots = slots
+        self.busy = 0
+        self.virtual_time = 0.0
+        self.last_finish = {}  # user -> finish tag of their last topic
+        self.waiting = []  # heap of (start tag, sequence, request)
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+
+        self.queued_jobs = {}  # job_id -> (sequence, user)
+        self.running_jobs = {}  # user -> jobs holding an admission slot
+
+        self.weights = {}  # user -> (weight, time read)
+        self.topic_seconds = INITIAL_TOPIC_SECONDS
+        self.job_seconds = INITIAL_JOB_SECONDS
+
+        self.users = get_collection('users')
+        self.executor = ThreadPoolExecutor(max_workers=GENERATION_THREADS, thread_name_prefix="generation")
+
+    def user_weight(self, user_email):
+        """Weight of a user's priority tier, cached; reads users (blocking) when the cache is stale"""
+        cached = self.weights.get(user_email)
+        if cached and time.monotonic() - cached[1] < WEIGHT_CACHE_SECONDS:
+            return cached[0]
+
+        tier = "default"
+        try:
+            user = self.users.find_one({"email": user_email}, {"priority": 1}) or {}
+            tier = user.get("priority") or "default"
+        except Exception as e:
+            print(f"Could not read priority of {user_email}: {e}")
+        weight = PRIORITY_WEIGHTS.get(tier, PRIORITY_WEIGHTS["default"])
+        self.weights[user_email] = (weight, time.monotonic())
+        return weight
+
+    # --- Admission order ---
+
+    async def enqueue_job(self, job_id, user_email):
+        """Put a job in line for an admission slot (no-op if it already is)"""
+        # Read the weight the line is ordered by off the event loop
+        await asyncio.to_thread(self.user_weight, user_email)
+        with self.condition:
+            if job_id not in self.queued_jobs:
+                self.queued_jobs[job_id] = (next(self.sequence), user_email)
+
+    def _job_order(self):
+        def key(item):
+            job_id, (sequence, user) = item
+            share = self.running_jobs.get(user, 0) / self.weights.get(user, (1.0, 0))[0]
+            return share, sequence
+        return [job_id for job_id, _ in sorted(self.queued_jobs.items(), key=key)]
+
+    def is_next_job(self, job_id):
+        with self.condition:
+            order = self._job_order()
+            return bool(order) and order[0] == job_id
+
+    def job_admitted(self, job_id):
+        with self.condition:
+            _, user = self.queued_jobs.pop(job_id, (None, None))
+            if user is not None:
+                self.running_jobs[user] = self.running_jobs.get(user, 0) + 1
+
+    def job_finished(self, job_id, user_email, seconds=None, admitted=True):
+        """Drop a job from the line, or give back its running slot; seconds feeds the ETA"""
+        with self.condition:
+            self.queued_jobs.pop(job_id, None)
+            if admitted and self.running_jobs.get(user_email):
+                self.running_jobs[user_email] -= 1
+                if not self.running_jobs[user_email]:
+                    del self.running_jobs[user_email]
+            if admitted and seconds:
+                self.job_seconds += AVERAGE_WEIGHT * (seconds - self.job_seconds)
+
+    def queue_position(self, job_id, capacity):
+        """(1-based position in the admission line, seconds until it likely starts), or None"""
+        with self.condition:
+            order = self._job_order()
+            running = sum(self.running_jobs.values())
+        if job_id not in order:
+            return None
+        position = order.index(job_id) + 1
+        capacity = max(capacity, 1)
+        # Every `capacity` jobs ahead of us (plus the ones running) take about one job length
+        rounds = math.ceil((position + max(running - capacity, 0)) / capacity)
+        return position, int(rounds * self.job_seconds)
+
+    # --- Topic slots ---
+
+    async def run_generation(self, func, *args):
+        """Run a job's generation step, whose topics wait in acquire_topic_slot, on the scheduler's threads"""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(func, *args))
+
+    def acquire_topic_slot(self, user_email, cost=1.0):
+        """Wait for this user's fair turn at a generation slot; pass the result to release_topic_slot"""
+        weight = self.user_weight(user_email)
+        request = {"user": user_email, "granted": False}
+        queued_at = time.perf_counter()
+
+        with self.condition:
+            start = max(self.virtual_time, self.last_finish.get(user_email, 0.0))
+            self.last_finish[user_email] = start + cost / weight
+            heapq.heappush(self.waiting, (start, next(self.sequence), request))
+            self._dispatch()
+            while not request["granted"]:
+                self.condition.wait()
+
+        granted_at = time.perf_counter()
+        fair_queue_wait.observe(granted_at - queued_at)
+        return granted_at
+
+    def release_topic_slot(self, granted_at):
+        with self.condition:
+            self.topic_seconds += AVERAGE_WEIGHT * (time.perf_counter() - granted_at - self.topic_seconds)
+            self.busy -= 1
+            self._dispatch()
+
+    @contextmanager
+    def topic_slot(self, user_email, cost=1.0):
+        """Hold one generation slot for the block"""
+        granted_at = self.acquire_topic_slot(user_email, cost)
+        try:
+            yield
+        finally:
+            self.release_topic_slot(granted_at)
+
+    def _dispatch(self):
+        """Grant free slots to the waiting topics with the lowest start tags (lock held)"""
+        granted = False
+        while self.waiting and self.busy < self.slots:
+            start, _, request = heapq.heappop(self.waiting)
+            self.virtual_time = max(self.virtual_time, start)
+            request["granted"] = True
+            self.busy += 1
+            granted = True
+        if not self.waiting and not self.busy:
+            # Idle: start a fresh round so old tags don't grow without bound
+            self.virtual_time = 0.0
+            self.last_finish.clear()
+        if granted:
+            self.condition.notify_all()
+
+    def topics_waiting(self, user_email=None):
+        with self.condition:
+            return sum(1 for _, _, request in self.waiting if user_email in (None, request["user"]))
+
+    def get_summary(self):
+        with self.condition:
+            return {
+                "slots": self.slots,
+                "busy_slots": self.busy,
+                "topics_waiting": len(self.waiting),
+                "jobs_queued": len(self.queued_jobs),
+                "running_jobs": dict(self.running_jobs),
+                "avg_topic_seconds": round(self.topic_seconds, 1),
+                "avg_job_seconds": round(self.job_seconds, 1),
+            }
+
+
+# Create a global instance shared by every session in this process
+fair_scheduler = FairShareScheduler()
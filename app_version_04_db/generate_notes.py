@@ -1,6 +1,7 @@
 import time
 
-import google.generativeai as genai
+# google.genai is imported in notes_client, on the first generation request: it is slow
+# to load and the app imports this module at startup
 from dotenv import load_dotenv
 import os
 from Ins_for_notes_generation import for_detail_notes
@@ -11,6 +12,17 @@ from error_handler import handle_api_error, handle_generation_error
 
 from db_logger import log_generation_start, log_generation_complete
 
+from retry import call_with_retry, Deadline
+
+from topic_cache import topic_cache, topic_key
+
+from tracing import span
+
+from metrics import time_gemini_request, record_tokens, rate_limit_wait, topic_cache_lookups
+from metering import charge_tokens
+from fair_scheduler import fair_scheduler
+from credential_pool import gemini_pool
+
 from datetime import datetime
 
 
@@ -18,7 +30,24 @@ from datetime import datetime
 
 load_dotenv()
 
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+# Alternative Gemini endpoint, e.g. the local stand-in in benchmarks/fake_gemini.py
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL")
+
+# Minimum seconds between two generation requests of one job (keeps us under the per-minute limit)
+REQUEST_INTERVAL = float(os.getenv("NOTES_REQUEST_INTERVAL", "7"))
+
+NOTES_MODEL = "gemini-2.5-flash"
+
+
+def notes_client(api_key):
+    """google.genai client for one API key (the SDK extraction uses; it takes a key per client)"""
+    from google import genai
+    from google.genai import types
+
+    return genai.Client(
+        api_key=api_key,
+        http_options=types.HttpOptions(base_url=GEMINI_BASE_URL) if GEMINI_BASE_URL else None
+    )
 
 
 def safe_get_text(response):
@@ -77,14 +106,25 @@ def validate_and_fix_json(ai_output: str):
     return result
 
 
+def is_valid_topic_response(raw_data):
+    """True if one topic's response is clean JSON once cleaned like the combined array"""
+    try:
+        json.loads("[" + clean_raw_json(raw_data) + "]")
+        return True
+    except Exception:
+        return False
+
+
 def clean_raw_json(raw_data):
     """Clean the raw json response given by the LLM"""
     return raw_data.replace("```json", '').replace("```", '').replace("'", "").replace('[', '').replace(']', '')
 
 
-def generate_notes_from_content(book_text,session_id=None):
+def generate_notes_from_content(book_text,session_id=None, deadline=None, user_email=None):
     """
     Generate notes from extracted content.
+    Transient API errors are retried within the job's deadline budget.
+    Each topic waits for a fair-share generation slot of user_email (see fair_scheduler).
     Returns generated notes or error dict.
     """
 
@@ -94,19 +134,18 @@ def generate_notes_from_content(book_text,session_id=None):
 
     try:
         # Check API key
-        if not GOOGLE_API_KEY:
+        if not gemini_pool.keys:
             error_result = handle_api_error(
                 "GOOGLE_API_KEY not found in environment variables",
                 "API Configuration"
             )
             return error_result
 
-        genai.configure(api_key=GOOGLE_API_KEY)
+        from google.genai import types
 
-        model = genai.GenerativeModel(
-            model_name="gemini-2.5-flash",
-            system_instruction=for_detail_notes
-        )
+        # Each request goes out on one of the pooled API keys (see credential_pool)
+        client = gemini_pool.client("generation", notes_client)
+        notes_config = types.GenerateContentConfig(system_instruction=for_detail_notes)
 
         collect_response = []  # Store all LLM responses
         cleaned_response = []  # Store cleaned responses
@@ -115,66 +154,113 @@ def generate_notes_from_content(book_text,session_id=None):
         total_input_tokens_used = 0
         total_output_tokens_used = 0
 
+        # Topics served from the topic cache and the tokens they would have cost
+        cache_hits = 0
+        tokens_saved = 0
+
         if session_id:
             log_generation_start(session_id,len(book_text))
 
+        if deadline is None:
+            deadline = Deadline()
+
         last_request_time = 0
 
         # Process each topic and content
         for number, (topic, content) in enumerate(book_text.items(), start=1):
 
-            try:
-
-                # Smart rate limiting - only delay when needed
-                if number > 1:
-                    time_since_last = time.time() - last_request_time
-                    if time_since_last < 7:  # If less than 7 seconds since last request
-                        wait_time = 7 - time_since_last
-                        time.sleep(wait_time)
-
-                # Record when this request starts
-
-                last_request_time = time.time()
-
-                now = datetime.now()
-                print(f"Content no.{number} sent to AI at {now.strftime("%I:%M:%S")}")
-
-                response = model.generate_content(f"{topic} {content}")
-                response_validated = safe_get_text(response)
-
-                if not response_validated:
-                    error_result = handle_generation_error(
-                        f"Empty response from AI for topic {number}: {topic}",
-                        "Content Generation"
-                    )
+            with span("topic", number=number, chars=len(content)) as topic_span:
+                try:
+
+                    # Same topic already generated (other chapter upload, other user, glossary...)
+                    cache_key = topic_key(topic, content, NOTES_MODEL, for_detail_notes)
+                    cached = topic_cache.get(cache_key)
+                    topic_span.set_attribute("cached", bool(cached))
+                    topic_cache_lookups.inc(result="hit" if cached else "miss")
+                    if cached:
+                        collect_response.append(cached["text"])
+                        cache_hits += 1
+                        tokens_saved += cached["tokens"]
+                        continue
+
+                    # Smart rate limiting - only delay when needed
+                    if number > 1:
+                        time_since_last = time.time() - last_request_time
+                        if time_since_last < REQUEST_INTERVAL:  # If less than 7 seconds since last request
+                            wait_time = REQUEST_INTERVAL - time_since_last
+                            with span("pacing_wait"):
+                                time.sleep(wait_time)
+                            rate_limit_wait.observe(wait_time, reason="pacing")
+
+                    # Wait for this user's fair share of the generation slots
+                    with span("fair_queue_wait"):
+                        slot = fair_scheduler.acquire_topic_slot(user_email or "unknown")
+
+                    # Record when this request starts
+
+                    last_request_time = time.time()
+
+                    now = datetime.now()
+                    print(f"Content no.{number} sent to AI at {now.strftime("%I:%M:%S")}")
+
+                    try:
+                        with span("gemini.call", model=NOTES_MODEL), time_gemini_request("generation"):
+                            response = call_with_retry(
+                                client.models.generate_content,
+                                deadline=deadline,
+                                context=f"Notes generation topic {number}",
+                                model=NOTES_MODEL,
+                                config=notes_config,
+                                contents=f"{topic} {content}"
+                            )
+                    finally:
+                        fair_scheduler.release_topic_slot(slot)
+                    response_validated = safe_get_text(response)
+
+                    if not response_validated:
+                        error_result = handle_generation_error(
+                            f"Empty response from AI for topic {number}: {topic}",
+                            "Content Generation"
+                        )
+                        topic_span.record_result(error_result)
+                        return error_result
+
+                    collect_response.append(response_validated)
+
+                    # Track token usage
+                    total_input_tokens_used += response.usage_metadata.prompt_token_count
+                    total_output_tokens_used += response.usage_metadata.candidates_token_count
+                    total_tokens_used += response.usage_metadata.total_token_count
+                    topic_span.set_attribute("tokens", response.usage_metadata.total_token_count)
+                    record_tokens("generation", response.usage_metadata.prompt_token_count,
+                                  response.usage_metadata.candidates_token_count)
+                    charge_tokens("generation", NOTES_MODEL, response.usage_metadata.prompt_token_count,
+                                  response.usage_metadata.candidates_token_count)
+
+                    # Only cache responses that parse, so a malformed one is regenerated next time
+                    if is_valid_topic_response(response_validated):
+                        topic_cache.put(cache_key, response_validated, response.usage_metadata.total_token_count)
+
+
+                except Exception as e:
+                    # Handle API errors during generation
+                    error_msg = str(e).lower()
+
+                    if "api key" in error_msg or "authentication" in error_msg:
+                        error_result = handle_api_error(str(e), "API Authentication")
+                    elif "rate limit" in error_msg or "429" in error_msg:
+                        error_result = handle_api_error(str(e), "Rate Limiting")
+                    elif "quota" in error_msg or "limit exceeded" in error_msg:
+                        error_result = handle_api_error(str(e), "Quota Exceeded")
+                    else:
+                        error_result = handle_generation_error(
+                            f"Error generating content for topic {number}: {str(e)}",
+                            "Content Generation"
+                        )
+
+                    topic_span.record_result(error_result)
                     return error_result
 
-                collect_response.append(response_validated)
-
-                # Track token usage
-                total_input_tokens_used += response.usage_metadata.prompt_token_count
-                total_output_tokens_used += response.usage_metadata.candidates_token_count
-                total_tokens_used += response.usage_metadata.total_token_count
-
-
-            except Exception as e:
-                # Handle API errors during generation
-                error_msg = str(e).lower()
-
-                if "api key" in error_msg or "authentication" in error_msg:
-                    error_result = handle_api_error(str(e), "API Authentication")
-                elif "rate limit" in error_msg or "429" in error_msg:
-                    error_result = handle_api_error(str(e), "Rate Limiting")
-                elif "quota" in error_msg or "limit exceeded" in error_msg:
-                    error_result = handle_api_error(str(e), "Quota Exceeded")
-                else:
-                    error_result = handle_generation_error(
-                        f"Error generating content for topic {number}: {str(e)}",
-                        "Content Generation"
-                    )
-
-                return error_result
-
         # Clean all responses
         for each in collect_response:
             cleaned = clean_raw_json(each)
@@ -189,17 +275,25 @@ def generate_notes_from_content(book_text,session_id=None):
         #
         # print(f"\nTotal Tokens Used: {total_tokens_used}")
 
+        if cache_hits:
+            saved_share = tokens_saved / (tokens_saved + total_tokens_used)
+            print(f"Topic cache: {cache_hits}/{len(book_text)} topics reused, "
+                  f"{tokens_saved} tokens saved ({saved_share:.0%})")
+
         if session_id:
             log_generation_complete(
                 session_id,
                 total_input_tokens_used,
                 total_output_tokens_used,
-                total_tokens_used
+                total_tokens_used,
+                cache_hits,
+                tokens_saved
             )
 
 
         # Validate and fix the JSON
-        final_json_array = validate_and_fix_json(full_json_array)
+        with span("json_repair", chars=len(full_json_array)):
+            final_json_array = validate_and_fix_json(full_json_array)
 
         # Check if validation failed
         if isinstance(final_json_array, dict) and "error" in final_json_array:
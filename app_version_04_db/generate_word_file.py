@@ -1,55 +1,65 @@
 from docx import Document
 from docx.shared import Pt
-from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.enum.text import WD_ALIGN_PARAGRAPH, WD_LINE_SPACING
 from docx.enum.style import WD_STYLE_TYPE
-import re
 
-def add_formatted_text(paragraph, text, font_size=12):
+from inline_markup import tokenize, BOLD, ITALIC, CODE, SUBSCRIPT, SUPERSCRIPT
+from stream_word_file import stream_word_file
+
+# Paragraph styles defined once per document; every notes block just points at one.
+# item type -> (style name, based on, font size, bold, alignment, space before, space after, line spacing)
+NOTES_STYLES = {
+    'heading': ('Notes Heading', 'Normal', 16, True, WD_ALIGN_PARAGRAPH.CENTER, 48, 36, None),
+    'subheading': ('Notes Subheading', 'Normal', 14, True, WD_ALIGN_PARAGRAPH.LEFT, 36, 24, None),
+    'paragraph': ('Notes Body', 'Normal', 12, False, WD_ALIGN_PARAGRAPH.JUSTIFY, 24, 24, None),
+    # Bullets inherit their bullet definition from Word's built-in list style
+    'bullet': ('Notes Bullet', 'List Bullet', 12, False, WD_ALIGN_PARAGRAPH.LEFT, 24, 28, 16),
+}
+
+# Font for `inline code` runs
+CODE_FONT = 'Courier New'
+
+def add_formatted_text(paragraph, text):
     """
-    Applies bold for **...** segments while keeping the rest normal.
+    Adds the runs for one block of notes text: **bold**, *italic*, `code`,
+    H~2~O subscripts and x^2^ superscripts (see inline_markup.tokenize).
     Example: 'This is **bold** and normal' -> correct runs with bold.
+    Fonts come from the paragraph style, so runs carry no other direct formatting.
     """
-    # Split into bold/non-bold parts; non-greedy to support multiple bold segments
-    parts = re.split(r'(\*\*.*?\*\*)', text)
-    for part in parts:
-        if not part:
-            continue
-        if part.startswith('**') and part.endswith('**'):
-            run = paragraph.add_run(part[2:-2])  # strip ** **
+    for part, style in tokenize(text):
+        run = paragraph.add_run(part)
+        if style & CODE:
+            run.font.name = CODE_FONT
+        if style & BOLD:
             run.bold = True
-        else:
-            run = paragraph.add_run(part)
-        # Ensure consistent font on every run
-        run.font.name = 'Times New Roman'
-        run.font.size = Pt(font_size)
-
-def add_paragraph_with_spacing(doc, text, font_size=12, bold=False, align='left',
-                               space_before=12, space_after=6):
-    paragraph = doc.add_paragraph()
-    # Start with an optional bold run if the whole line should be bold (e.g., headings),
-    # but still respect inline **bold** segments.
-    if bold:
-        # We’ll build from formatted text; bold=True means default style is bold unless overridden by **...**
-        # Easiest: apply formatted runs, then set paragraph runs to bold if not already bolded.
-        add_formatted_text(paragraph, text, font_size)
-        for run in paragraph.runs:
-            if run.bold is None:  # only set if not already explicitly bold
-                run.bold = True
-    else:
-        add_formatted_text(paragraph, text, font_size)
-
-    if align == 'center':
-        paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
-    elif align == 'justify':
-        paragraph.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
-    else:
-        paragraph.alignment = WD_ALIGN_PARAGRAPH.LEFT
-
-    paragraph.paragraph_format.space_before = Pt(space_before)
-    paragraph.paragraph_format.space_after = Pt(space_after)
-    return paragraph
-
-def generate_word_file(content, file_name):
+        if style & ITALIC:
+            run.italic = True
+        if style & SUBSCRIPT:
+            run.font.subscript = True
+        if style & SUPERSCRIPT:
+            run.font.superscript = True
+
+def add_notes_styles(doc):
+    """Define the notes paragraph styles on a document"""
+    for name, base, font_size, bold, align, space_before, space_after, line_spacing in NOTES_STYLES.values():
+        style = doc.styles.add_style(name, WD_STYLE_TYPE.PARAGRAPH)
+        style.base_style = doc.styles[base]
+        style.quick_style = True
+
+        style.font.size = Pt(font_size)
+        if bold:
+            style.font.bold = True
+
+        pf = style.paragraph_format
+        pf.alignment = align
+        pf.space_before = Pt(space_before)
+        pf.space_after = Pt(space_after)
+        if line_spacing:
+            pf.line_spacing = Pt(line_spacing)  # forces a "big gap" look
+            pf.line_spacing_rule = WD_LINE_SPACING.EXACTLY
+
+def create_document():
+    """Empty notes document: Normal style set to Times New Roman 12pt plus the notes styles"""
     doc = Document()
 
     # Optional: safely set Normal style without deprecated lookup
@@ -64,47 +74,31 @@ def generate_word_file(content, file_name):
         normal_font.name = 'Times New Roman'
         normal_font.size = Pt(12)
 
-    for item in content:
-        try:
-            item_type = item.get('type')
-            text = item.get('text', '') or ''
-
-            if item_type == 'heading':
-                add_paragraph_with_spacing(
-                    doc, text, font_size=16, bold=True,
-                    align='center', space_before=48, space_after=36
-                )
-
-            elif item_type == 'subheading':
-                add_paragraph_with_spacing(
-                    doc, text, font_size=14, bold=True,
-                    align='left', space_before=36, space_after=24
-                )
-
-            elif item_type == 'paragraph':
-                add_paragraph_with_spacing(
-                    doc, text, font_size=12, bold=False,
-                    align='justify', space_before=24, space_after=24
-                )
-
+    add_notes_styles(doc)
 
+    return doc
 
-            elif item_type == 'bullet':
-
-                bullet_para = doc.add_paragraph()
-
-                add_formatted_text(bullet_para, f"• {text}", font_size=12)
-
-                pf = bullet_para.paragraph_format
-
-                pf.space_before = Pt(24)
+def generate_word_file(content, file_name, streaming=True):
+    """
+    Build the notes .docx and return its path.
+    By default the paragraphs are streamed straight into the zip (stream_word_file);
+    streaming=False builds the same document in memory with python-docx.
+    """
+    if streaming:
+        return stream_word_file(content, file_name)
 
-                pf.space_after = Pt(28)
+    doc = create_document()
 
-                pf.left_indent = Pt(18)
+    for item in content:
+        try:
+            item_type = item.get('type')
+            text = item.get('text', '') or ''
 
-                pf.line_spacing = Pt(16)  # forces a "big gap" look
+            if item_type not in NOTES_STYLES:
+                continue
 
+            paragraph = doc.add_paragraph(style=NOTES_STYLES[item_type][0])
+            add_formatted_text(paragraph, text)
 
         except Exception as e:
             print(f"Skipped invalid item: {item} due to error: {e}")
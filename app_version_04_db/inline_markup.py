@@ -0,0 +1,101 @@
+import re
+
+# Run style flags (combine with |)
+BOLD = 1
+ITALIC = 2
+CODE = 4
+SUBSCRIPT = 8
+SUPERSCRIPT = 16
+
+# Every inline construct the notes model produces, matched whole by a regex branch, so a single
+# re.split both finds and pairs them. Content of the first five is literal, emphasis content is
+# tokenized again. Emphasis markers follow CommonMark-style flanking: an opener is followed by
+# non-space and a closer follows non-space (2 ** 3 ** 4 stays literal). ** may open and close
+# inside a word (**Note:**text, the **key**s); * and _ only at word boundaries, so formulas
+# and names (price*quantity*2, snake_case) stay literal.
+BRANCHES = {
+    "`": r"`[^`\n]+`",
+    "<": r"<sub>[^<]*</sub>|<sup>[^<]*</sup>",
+    "~": r"~(?<!~~)(?!~)[^~\s]+~(?!~)",  # ~sub~, but not ~~
+    "^": r"\^[^^\s]+\^",
+    "*": r"\*\*(?<!\*\*\*)(?=[^\s*]).+?(?<=[^\s*])\*\*(?!\*)"
+         r"|\*(?<![\w*]\*)(?=[^\s*]).+?(?<=[^\s*])\*(?![\w*])",
+    "_": r"_(?<!\w_)(?=\S)[^_]+?(?<=\S)_(?!\w)",
+}
+
+# Style of the literal constructs by their first characters
+LITERAL_STYLES = {"`": CODE, "~": SUBSCRIPT, "^": SUPERSCRIPT, "<sub>": SUBSCRIPT, "<sup>": SUPERSCRIPT}
+
+# Alternation of the branches for each set of marker characters seen (compiled on first use).
+# A pattern holding only the branches a block needs mostly starts with one literal character,
+# which the regex engine scans for much faster than for a character class.
+_patterns = {}
+
+
+def _markup_pattern(markers):
+    pattern = _patterns.get(markers)
+    if pattern is None:
+        pattern = re.compile("(" + "|".join(BRANCHES[marker] for marker in markers) + ")", re.DOTALL)
+        _patterns[markers] = pattern
+    return pattern
+
+
+def tokenize(text, style=0):
+    """
+    Split one block of notes text into runs.
+    Returns a list of (text, style) where style is a combination of the flags above
+    (style: flags already applying to the whole text).
+    Unbalanced ** / * / _ markers are kept as literal text.
+    """
+    # Most blocks have little or no markup (str `in` beats a regex character class here)
+    markers = "".join([marker for marker in BRANCHES if marker in text])
+    if not markers:
+        return [(text, style)] if text else []
+    return _tokenize(text, style, markers)
+
+
+def _tokenize(text, style, markers):
+    """tokenize() for text containing these marker characters"""
+    runs = []
+    append = runs.append
+    # re.split alternates plain text and matched constructs: [text, construct, text, ..., text]
+    parts = _markup_pattern(markers).split(text)
+    pairs = iter(parts)
+    for plain, construct in zip(pairs, pairs):
+        if plain:
+            append((plain, style))
+
+        first = construct[0]
+        if first == "*" or first == "_":
+            if construct[1] == "*":
+                inner, inner_style = construct[2:-2], style | BOLD
+            else:
+                inner, inner_style = construct[1:-1], style | ITALIC
+            # Emphasis can contain other markup (only of the kinds around it)
+            inner_markers = "".join([marker for marker in markers if marker in inner])
+            if inner_markers:
+                nested = _tokenize(inner, inner_style, inner_markers)
+                if not plain and runs and runs[-1][1] == nested[0][1]:
+                    runs[-1] = (runs[-1][0] + nested[0][0], nested[0][1])
+                    del nested[0]
+                runs.extend(nested)
+                continue
+        elif first == "<":
+            inner, inner_style = construct[5:-6], style | LITERAL_STYLES[construct[:5]]
+            if not inner:
+                continue
+        else:
+            inner, inner_style = construct[1:-1], style | LITERAL_STYLES[first]
+
+        # Neighbouring runs of the same style become one (e.g. `a``b`)
+        if not plain and runs and runs[-1][1] == inner_style:
+            runs[-1] = (runs[-1][0] + inner, inner_style)
+        else:
+            append((inner, inner_style))
+
+    if parts[-1]:
+        if runs and runs[-1][1] == style:
+            runs[-1] = (runs[-1][0] + parts[-1], style)
+        else:
+            append((parts[-1], style))
+    return runs
@@ -0,0 +1,210 @@
+import asyncio
+import copy
+import os
+import socket
+import threading
+from datetime import datetime, timedelta, timezone
+
+from database import get_collection
+
+# "mongo" shares job and session state between all app instances; "memory" keeps it in
+# this process (single instance, local runs)
+JOB_STORE = os.getenv("JOB_STORE", "mongo")
+# Name of this instance in the job records; any unique name per replica works
+NODE_ID = os.getenv("NODE_ID") or f"{socket.gethostname()}:{os.getpid()}"
+
+# Finished jobs (and their download) are kept this long
+JOB_TTL_HOURS = int(os.getenv("JOB_TTL_HOURS", "24"))
+# Login and current job of a browser are kept this long after its last change
+SESSION_TTL_DAYS = 30
+# Every instance marks its running jobs alive this often ...
+JOB_HEARTBEAT_SECONDS = 15
+# ... and a running job not marked for this long has lost its instance
+JOB_STALE_SECONDS = 60
+
+ACTIVE_STATUSES = ("starting", "queued", "extracting", "generating", "creating_file")
+
+LOST_JOB_ERROR = {
+    "error_type": "PROCESSING_ERROR",
+    "user_message": "The server handling your file was restarted. Please try again.",
+    "technical_error": "Job lost its server (no heartbeat)",
+}
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _aware(moment):
+    # Mongo hands back naive UTC datetimes
+    return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+
+def _is_lost(job, now):
+    return job["status"] in ACTIVE_STATUSES and \
+        now - _aware(job["heartbeat_at"]) > timedelta(seconds=JOB_STALE_SECONDS)
+
+
+class MongoJobStore:
+    """
+    Job state and browser sessions in Mongo, so any app instance can serve any client.
+
+    jobs holds one document per processing job (_id = the processing_logs session_id):
+    status, queue position, error, the finished file and the instance running it. The
+    instance writes, every instance reads: a browser that reconnects to another replica
+    picks up progress and the download from here. Each instance marks its running jobs
+    alive every JOB_HEARTBEAT_SECONDS; a job whose instance went away turns into an
+    error instead of spinning forever.
+
+    web_sessions holds what a browser's app.storage.user needs on every node (login,
+    output format, current job), keyed by the browser id of the signed session cookie.
+    Both expire through TTL indexes on updated_at (see migrations).
+    """
+
+    def __init__(self):
+        self.jobs = get_collection('jobs')
+        self.sessions = get_collection('web_sessions')
+
+    # --- Jobs ---
+
+    def create_job(self, job_id, user_email, **fields):
+        now = _now()
+        self.jobs.replace_one({"_id": job_id}, {
+            "user_email": user_email,
+            "status": "starting",
+            "error": None,
+            "result": None,
+            "queue_position": None,
+            **fields,
+            "node": NODE_ID,
+            "created_at": now,
+            "updated_at": now,
+            "heartbeat_at": now,
+        }, upsert=True)
+
+    def update_job(self, job_id, **fields):
+        now = _now()
+        self.jobs.update_one({"_id": job_id}, {"$set": {**fields, "updated_at": now, "heartbeat_at": now}})
+
+    def get_job(self, job_id):
+        if not job_id:
+            return None
+        job = self.jobs.find_one({"_id": job_id})
+        if job is None or not _is_lost(job, _now()):
+            return job
+        from pymongo import ReturnDocument
+
+        # Only one reader records the loss; the others get the job as it then is
+        return self.jobs.find_one_and_update(
+            {"_id": job_id, "status": job["status"], "heartbeat_at": job["heartbeat_at"]},
+            {"$set": {"status": "error", "error": LOST_JOB_ERROR, "updated_at": _now()}},
+            return_document=ReturnDocument.AFTER
+        ) or self.jobs.find_one({"_id": job_id})
+
+    def touch_jobs(self, node=NODE_ID):
+        """Mark the running jobs of an instance alive"""
+        self.jobs.update_many({"node": node, "status": {"$in": list(ACTIVE_STATUSES)}},
+                              {"$set": {"heartbeat_at": _now()}})
+
+    # --- Browser sessions ---
+
+    def load_session(self, browser_id):
+        session = self.sessions.find_one({"_id": browser_id}, {"_id": 0, "updated_at": 0})
+        return session or {}
+
+    def save_session(self, browser_id, fields):
+        self.sessions.update_one({"_id": browser_id}, {"$set": {**fields, "updated_at": _now()}}, upsert=True)
+
+
+class MemoryJobStore:
+    """Same interface as MongoJobStore, kept in this process (one instance only)"""
+
+    def __init__(self):
+        self.jobs = {}
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def create_job(self, job_id, user_email, **fields):
+        now = _now()
+        with self.lock:
+            # No TTL index here: drop expired jobs whenever a new one comes in
+            cutoff = now - timedelta(hours=JOB_TTL_HOURS)
+            for old_id in [j for j, job in self.jobs.items() if job["updated_at"] < cutoff]:
+                del self.jobs[old_id]
+            self.jobs[job_id] = {
+                "_id": job_id,
+                "user_email": user_email,
+                "status": "starting",
+                "error": None,
+                "result": None,
+                "queue_position": None,
+                **copy.deepcopy(fields),
+                "node": NODE_ID,
+                "created_at": now,
+                "updated_at": now,
+                "heartbeat_at": now,
+            }
+
+    def update_job(self, job_id, **fields):
+        now = _now()
+        with self.lock:
+            if job_id in self.jobs:
+                self.jobs[job_id].update(copy.deepcopy(fields), updated_at=now, heartbeat_at=now)
+
+    def get_job(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            if _is_lost(job, _now()):
+                job.update(status="error", error=LOST_JOB_ERROR, updated_at=_now())
+            return copy.deepcopy(job)
+
+    def touch_jobs(self, node=NODE_ID):
+        now = _now()
+        with self.lock:
+            for job in self.jobs.values():
+                if job["node"] == node and job["status"] in ACTIVE_STATUSES:
+                    job["heartbeat_at"] = now
+
+    def load_session(self, browser_id):
+        with self.lock:
+            return dict(self.sessions.get(browser_id, {}))
+
+    def save_session(self, browser_id, fields):
+        with self.lock:
+            self.sessions.setdefault(browser_id, {}).update(fields)
+
+
+# Create global instance
+job_store = MemoryJobStore() if JOB_STORE == "memory" else MongoJobStore()
+
+
+def create_job(job_id, user_email, **fields):
+    job_store.create_job(job_id, user_email, **fields)
+
+
+def update_job(job_id, **fields):
+    job_store.update_job(job_id, **fields)
+
+
+def get_job(job_id):
+    return job_store.get_job(job_id)
+
+
+def load_shared_session(browser_id):
+    return job_store.load_session(browser_id)
+
+
+def save_shared_session(browser_id, fields):
+    job_store.save_session(browser_id, fields)
+
+
+async def keep_jobs_alive():
+    """Heartbeat for the jobs running on this instance (started by app.on_startup)"""
+    while True:
+        await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+        try:
+            await asyncio.to_thread(job_store.touch_jobs)
+        except Exception as e:
+            print(f"Job heartbeat failed: {e}")
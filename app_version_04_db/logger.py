@@ -8,6 +8,8 @@ class SimpleFileLogger:
     """
     Simple logging system - One log entry per file processing.
     Tracks the entire journey of each file from upload to completion/failure.
+    Sessions in progress live in this process only, so it suits a single instance;
+    the app logs through db_logger (and keeps job state in job_store) instead.
     """
 
     def __init__(self, logs_folder="logs"):
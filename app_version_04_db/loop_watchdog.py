@@ -0,0 +1,190 @@
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from datetime import datetime
+from pathlib import Path
+
+from metrics import event_loop_lag, event_loop_stalls_total
+
+# How often the event loop heartbeat ticks
+LOOP_PROBE_INTERVAL = float(os.getenv("LOOP_PROBE_INTERVAL", "0.1"))
+# A callback holding the loop longer than this is reported as a stall
+LOOP_STALL_THRESHOLD = float(os.getenv("LOOP_STALL_THRESHOLD", "0.25"))
+STALL_FOLDER = os.getenv("STALL_FOLDER", "logs")
+# Frames from this folder are "our" code; the innermost one is blamed for a stall
+APP_ROOT = str(Path(__file__).resolve().parent)
+
+
+def _is_app_frame(frame_summary):
+    filename = os.path.abspath(frame_summary.filename)
+    return (filename.startswith(APP_ROOT)
+            and "site-packages" not in filename
+            and filename != os.path.abspath(__file__))
+
+
+def _describe(frame_summary):
+    filename = os.path.relpath(frame_summary.filename, APP_ROOT) if _is_app_frame(frame_summary) \
+        else "/".join(Path(frame_summary.filename).parts[-2:])
+    return f"{filename}:{frame_summary.lineno} in {frame_summary.name}"
+
+
+class LoopWatchdog:
+    """
+    Finds callbacks that block the event loop.
+
+    A heartbeat task on the loop ticks every `interval` seconds and records how late it
+    woke up (the event-loop lag histogram). A daemon thread watches the heartbeat; once
+    it is `threshold` seconds overdue the loop is stuck in some callback, so the thread
+    samples the loop thread's stack until the heartbeat comes back. The stall is blamed
+    on the innermost app frame seen most often (e.g. app.py:177 in handle_login), and
+    reported with its stack to the console, logs/loop_stalls_<year>_<month>.jsonl and
+    the stalls counter of /metrics.
+    """
+
+    def __init__(self, interval=LOOP_PROBE_INTERVAL, threshold=LOOP_STALL_THRESHOLD, folder=STALL_FOLDER):
+        self.interval = interval
+        self.threshold = threshold
+        self.folder = Path(folder)
+
+        self.loop_thread_id = None
+        self.loop_frames = []  # (file, function) of the frames that drive the loop itself
+        self.last_beat = time.monotonic()
+        self.last_lag = 0.0
+        self.stall = None  # stall being sampled right now
+        self.recent_stalls = deque(maxlen=50)
+        self.sites = {}  # call site -> [stalls, seconds blocked, worst stall]
+        self.lock = threading.Lock()
+        self.worker = None
+
+    async def run(self):
+        """Heartbeat; runs on the event loop for the life of the app (started by app.on_startup)"""
+        self.loop_thread_id = threading.get_ident()
+        self.loop_frames = [(f.filename, f.name) for f in traceback.extract_stack()[:-1]]
+        self.last_beat = time.monotonic()
+        if self.worker is None:
+            self.worker = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+            self.worker.start()
+
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - started - self.interval)
+            event_loop_lag.observe(lag)
+            self.last_lag = lag
+            self.last_beat = time.monotonic()
+
+    def _watch(self):
+        check_every = min(self.interval, self.threshold) / 2
+        while True:
+            time.sleep(check_every)
+            try:
+                self._check()
+            except Exception as e:
+                print(f"Loop watchdog check failed: {e}")
+
+    def _check(self):
+        beat = self.last_beat
+        overdue = time.monotonic() - beat - self.interval
+
+        if self.stall is not None and self.stall["beat"] != beat:
+            # Heartbeat is back: the blocking callback has returned
+            stall, self.stall = self.stall, None
+            stall["duration"] = max(self.last_lag, stall["duration"])
+            self._report(stall)
+            return
+
+        if overdue < self.threshold:
+            return
+
+        frame = sys._current_frames().get(self.loop_thread_id)
+        if frame is None:
+            return
+        stack = traceback.extract_stack(frame)
+        del frame
+
+        # Skip the frames every callback runs under (uvicorn, the loop, app.py's ui.run)
+        skip = 0
+        for loop_frame, f in zip(self.loop_frames, stack):
+            if loop_frame != (f.filename, f.name):
+                break
+            skip += 1
+        stack = stack[skip:] or stack
+
+        app_frames = [f for f in stack if _is_app_frame(f)]
+        real_frames = [f for f in stack if not f.filename.startswith("<")]
+        site = _describe((app_frames or real_frames or stack)[-1])
+
+        if self.stall is None:
+            self.stall = {
+                "beat": beat,
+                "started_at": datetime.now().isoformat(),
+                "duration": overdue,
+                "sites": Counter(),
+                "stack": [_describe(f) for f in stack],
+                "innermost": _describe(stack[-1]),
+            }
+        self.stall["duration"] = overdue
+        self.stall["sites"][site] += 1
+
+    def _report(self, stall):
+        site = stall["sites"].most_common(1)[0][0]
+        duration = stall["duration"]
+        entry = {
+            "started_at": stall["started_at"],
+            "duration": round(duration, 3),
+            "site": site,
+            "innermost": stall["innermost"],
+            "samples": sum(stall["sites"].values()),
+            "other_sites": [s for s in stall["sites"] if s != site],
+            "stack": stall["stack"],
+        }
+
+        with self.lock:
+            self.recent_stalls.append(entry)
+            counts = self.sites.setdefault(site, [0, 0.0, 0.0])
+            counts[0] += 1
+            counts[1] += duration
+            counts[2] = max(counts[2], duration)
+
+        event_loop_stalls_total.inc(site=site)
+        print(f"Event loop blocked for {duration:.2f}s at {site} (innermost: {entry['innermost']})")
+
+        now = datetime.now()
+        stall_file = self.folder / f"loop_stalls_{now.year}_{now.month:02d}.jsonl"
+        try:
+            self.folder.mkdir(exist_ok=True)
+            with open(stall_file, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+        except Exception as e:
+            print(f"Failed to write loop stall: {e}")
+
+    def get_summary(self):
+        """Call sites that blocked the loop, worst total first"""
+        with self.lock:
+            sites = sorted(self.sites.items(), key=lambda item: item[1][1], reverse=True)
+            return {
+                "threshold": self.threshold,
+                "stalls": sum(counts[0] for _, counts in sites),
+                "sites": [
+                    {"site": site, "stalls": count, "seconds": round(total, 3), "worst": round(worst, 3)}
+                    for site, (count, total, worst) in sites
+                ],
+                "recent": list(self.recent_stalls)[-10:],
+            }
+
+
+# Create global instance
+loop_watchdog = LoopWatchdog()
+
+
+async def watch_event_loop():
+    await loop_watchdog.run()
+
+
+def get_loop_stalls():
+    return loop_watchdog.get_summary()
@@ -0,0 +1,260 @@
+import contextvars
+import math
+import os
+import threading
+from datetime import datetime, timezone
+
+from Ins_for_extraction import instructions as extraction_instructions
+from Ins_for_notes_generation import for_detail_notes
+from pdf_preflight import CHARS_PER_TOKEN
+from metrics import quota_rejections_total, token_cost_total
+from database import get_collection
+
+# Tokens one user may use per (UTC) day; a user document's "daily_token_quota" overrides it
+USER_DAILY_TOKEN_QUOTA = int(os.getenv("USER_DAILY_TOKEN_QUOTA", "3000000"))
+# Tokens all users together may use per day (0 = no limit) ...
+DAILY_TOKEN_BUDGET = int(os.getenv("DAILY_TOKEN_BUDGET", "0"))
+# ... and the largest share of it a single user can take
+MAX_USER_BUDGET_SHARE = float(os.getenv("MAX_USER_BUDGET_SHARE", "0.2"))
+
+# USD per million (input, output) tokens; unknown models are billed as gemini-2.5-flash
+PRICES_PER_MILLION = {
+    "gemini-2.5-flash": (0.30, 2.50),
+    "gemini-2.5-flash-lite": (0.10, 0.40),
+    "gemini-2.5-pro": (1.25, 10.00),
+}
+DEFAULT_PRICE = PRICES_PER_MILLION["gemini-2.5-flash"]
+
+# --- Job cost estimate from pre-flight stats ---
+# Text Gemini writes out per scanned page, which has no text layer to count
+SCANNED_PAGE_TEXT_TOKENS = 500
+# Pages per extracted topic; every topic is one generation call with the notes prompt
+PAGES_PER_TOPIC = 2
+# Notes tokens written per token of extracted text
+NOTES_OUTPUT_RATIO = 1.5
+EXTRACTION_PROMPT_TOKENS = len(extraction_instructions) // CHARS_PER_TOKEN
+NOTES_PROMPT_TOKENS = len(for_detail_notes) // CHARS_PER_TOKEN
+# Weight of the newest job when the estimate is recalibrated against real usage
+CALIBRATION_WEIGHT = 0.1
+
+_current_account = contextvars.ContextVar("token_account", default=None)
+
+
+def _today():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+
+def token_cost(model, input_tokens, output_tokens):
+    input_price, output_price = PRICES_PER_MILLION.get(model, DEFAULT_PRICE)
+    return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+
+def raw_job_estimate(preflight):
+    """Tokens a job will use (input + output, both phases) before calibration"""
+    pages = preflight.get("pages") or []
+    page_count = preflight.get("page_count", len(pages))
+    text_tokens = sum(p["chars"] for p in pages) // CHARS_PER_TOKEN
+
+    # Extraction: the PDF plus the prompt in, its text (transcribed for scans) out
+    extraction_in = preflight.get("estimated_tokens", 0) + EXTRACTION_PROMPT_TOKENS
+    extraction_out = text_tokens + preflight.get("scanned_pages", 0) * SCANNED_PAGE_TEXT_TOKENS
+
+    # Generation: the extracted text plus one notes prompt per topic in, the notes out
+    topics = max(1, math.ceil(page_count / PAGES_PER_TOPIC))
+    generation_in = extraction_out + topics * NOTES_PROMPT_TOKENS
+    generation_out = int(extraction_out * NOTES_OUTPUT_RATIO)
+
+    return extraction_in + extraction_out + generation_in + generation_out
+
+
+class TokenMeter:
+    """
+    Token and cost accounting per user and per day, with quotas checked before a job starts.
+
+    token_usage holds one document per user and day ("<email>:<day>") plus one for all
+    users ("*:<day>"), updated with $inc only, so concurrent jobs and server processes
+    never lose counts. Each keeps `committed` = tokens used + tokens reserved by running
+    jobs. A job reserves its estimated cost up front with a conditional update that only
+    matches while the reservation still fits the quota, so two jobs can't both squeeze
+    into the last free tokens. Every Gemini call is charged to the job's user as it
+    happens, and the reservation is released when the job ends.
+    """
+
+    def __init__(self):
+        self.usage = get_collection('token_usage')
+        self.users = get_collection('users')
+
+        # Recent real usage / raw estimate, so estimates track how Gemini actually bills
+        self.calibration = 1.0
+        self.lock = threading.Lock()
+
+    # --- Estimates and quotas ---
+
+    def estimate_job(self, preflight):
+        return int(raw_job_estimate(preflight) * self.calibration)
+
+    def user_quota(self, user_email):
+        """Daily token limit of a user, capped at their share of the global budget"""
+        user = self.users.find_one({"email": user_email}, {"daily_token_quota": 1}) or {}
+        quota = user.get("daily_token_quota") or USER_DAILY_TOKEN_QUOTA
+        if DAILY_TOKEN_BUDGET:
+            quota = min(quota, int(DAILY_TOKEN_BUDGET * MAX_USER_BUDGET_SHARE))
+        return quota
+
+    def set_user_quota(self, user_email, tokens):
+        """Per-user daily quota (None goes back to USER_DAILY_TOKEN_QUOTA)"""
+        result = self.users.update_one({"email": user_email}, {"$set": {"daily_token_quota": tokens}})
+        return result.matched_count > 0
+
+    def _reserve(self, key, limit, tokens, fields):
+        """Add tokens to key's committed count if it stays within limit; False otherwise"""
+        from pymongo.errors import DuplicateKeyError
+
+        if tokens > limit:
+            return False
+        # A DuplicateKeyError means the document exists but the filter didn't match (over the
+        # limit) - or that another job created it a moment ago, so check once more
+        for _ in range(2):
+            try:
+                self.usage.update_one(
+                    {"_id": key, "committed": {"$lte": limit - tokens}},
+                    {"$inc": {"committed": tokens, "reserved": tokens}, "$setOnInsert": fields},
+                    upsert=True
+                )
+                return True
+            except DuplicateKeyError:
+                continue
+        return False
+
+    def reserve(self, user_email, tokens):
+        """
+        Reserve a job's estimated tokens for today.
+        Returns (reservation, None), or (None, message) telling the user why the job can't start.
+        """
+        day = _today()
+        quota = self.user_quota(user_email)
+
+        if not self._reserve(f"{user_email}:{day}", quota, tokens, {"user_email": user_email, "day": day}):
+            quota_rejections_total.inc(scope="user")
+            used = (self.usage.find_one({"_id": f"{user_email}:{day}"}) or {}).get("committed", 0)
+            if tokens > quota:
+                return None, (f"This document needs about {tokens:,} tokens, more than your daily "
+                              f"limit of {quota:,}. Try splitting it into smaller parts.")
+            return None, (f"You've used {used:,} of your {quota:,} daily tokens - this document needs "
+                          f"about {tokens:,} more. Your quota resets at midnight UTC.")
+
+        if DAILY_TOKEN_BUDGET and not self._reserve(f"*:{day}", DAILY_TOKEN_BUDGET, tokens,
+                                                    {"user_email": "*", "day": day}):
+            self.usage.update_one({"_id": f"{user_email}:{day}"},
+                                  {"$inc": {"committed": -tokens, "reserved": -tokens}})
+            quota_rejections_total.inc(scope="global")
+            return None, "We've reached today's processing capacity. Please try again tomorrow."
+
+        return {"user_email": user_email, "tokens": tokens, "day": day}, None
+
+    def release(self, reservation):
+        """Give back a job's reservation once it has finished (its real usage is already charged)"""
+        if not reservation:
+            return
+        tokens, day = reservation["tokens"], reservation["day"]
+        update = {"$inc": {"committed": -tokens, "reserved": -tokens, "jobs": 1}}
+        self.usage.update_one({"_id": f"{reservation['user_email']}:{day}"}, update)
+        if DAILY_TOKEN_BUDGET:
+            self.usage.update_one({"_id": f"*:{day}"}, update)
+
+    # --- Charging real usage ---
+
+    def attach(self, user_email):
+        """Charge Gemini calls of this task / thread (and work it hands to carry_context) to user_email"""
+        return _current_account.set({"user_email": user_email, "tokens": 0, "cost": 0.0})
+
+    def charge(self, phase, model, input_tokens, output_tokens):
+        """Add one Gemini call's tokens and cost to the current user's and the global counters"""
+        input_tokens, output_tokens = input_tokens or 0, output_tokens or 0
+        total = input_tokens + output_tokens
+        cost = token_cost(model, input_tokens, output_tokens)
+        token_cost_total.inc(cost, phase=phase)
+
+        account = _current_account.get()
+        if account is not None:
+            with self.lock:
+                account["tokens"] += total
+                account["cost"] += cost
+        user_email = account["user_email"] if account else "unknown"
+
+        day = _today()
+        counts = {
+            "committed": total,
+            "total_tokens": total,
+            "cost_usd": cost,
+            f"{phase}.input_tokens": input_tokens,
+            f"{phase}.output_tokens": output_tokens,
+        }
+        try:
+            for key, owner in ((f"{user_email}:{day}", user_email), (f"*:{day}", "*")):
+                self.usage.update_one({"_id": key},
+                                      {"$inc": counts, "$setOnInsert": {"user_email": owner, "day": day}},
+                                      upsert=True)
+        except Exception as e:
+            # Accounting must never fail the job
+            print(f"Token metering failed: {e}")
+
+    def calibrate(self, preflight, actual_tokens):
+        """Move the estimate towards what a finished job really used"""
+        raw = raw_job_estimate(preflight)
+        if not raw or not actual_tokens:
+            return
+        with self.lock:
+            self.calibration += CALIBRATION_WEIGHT * (actual_tokens / raw - self.calibration)
+
+    def current_job_usage(self):
+        account = _current_account.get()
+        return dict(account) if account else None
+
+    # --- Reports ---
+
+    def get_user_usage(self, user_email, day=None):
+        day = day or _today()
+        usage = self.usage.find_one({"_id": f"{user_email}:{day}"}) or {}
+        return {
+            "day": day,
+            "quota": self.user_quota(user_email),
+            "committed": usage.get("committed", 0),
+            "total_tokens": usage.get("total_tokens", 0),
+            "cost_usd": round(usage.get("cost_usd", 0.0), 4),
+            "jobs": usage.get("jobs", 0),
+        }
+
+    def get_top_users(self, day=None, limit=10):
+        """Heaviest users of a day"""
+        day = day or _today()
+        cursor = self.usage.find({"day": day, "user_email": {"$ne": "*"}}).sort("total_tokens", -1).limit(limit)
+        return [
+            {"user_email": doc["user_email"], "total_tokens": doc.get("total_tokens", 0),
+             "cost_usd": round(doc.get("cost_usd", 0.0), 4), "jobs": doc.get("jobs", 0)}
+            for doc in cursor
+        ]
+
+
+# Create global instance
+token_meter = TokenMeter()
+
+
+def estimate_job_tokens(preflight):
+    return token_meter.estimate_job(preflight)
+
+
+def reserve_tokens(user_email, tokens):
+    return token_meter.reserve(user_email, tokens)
+
+
+def release_tokens(reservation):
+    token_meter.release(reservation)
+
+
+def charge_tokens(phase, model, input_tokens, output_tokens):
+    token_meter.charge(phase, model, input_tokens, output_tokens)
+
+
+def get_user_usage(user_email):
+    return token_meter.get_user_usage(user_email)
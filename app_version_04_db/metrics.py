@@ -0,0 +1,248 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Bucket bounds in seconds. Jobs and stages run for minutes, Gemini calls for seconds,
+# and event-loop lag should stay in the milliseconds.
+STAGE_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 900)
+REQUEST_BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300)
+LAG_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values)) + (extra or [])
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """One metric family; each combination of label values is its own series"""
+
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.series = {}  # label values -> value
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """[(suffix, label values, extra labels, value)] for the exposition"""
+        with self.lock:
+            return [("", key, None, value) for key, value in sorted(self.series.items())]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, key, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError("Counters only go up")
+        key = self._key(labels)
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    Value that goes up and down. With a callback the value is read at scrape time instead:
+    the callback returns a number, or {label values tuple: number} for labelled gauges.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.series[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        if self.callback is None:
+            return super().samples()
+        try:
+            value = self.callback()
+        except Exception as e:
+            print(f"Metric callback for {self.name} failed: {e}")
+            return []
+        if isinstance(value, dict):
+            return [("", tuple(str(part) for part in key), None, count) for key, count in sorted(value.items())]
+        return [("", (), None, value)]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=STAGE_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts, total = self.series.get(key) or ([0] * len(self.buckets), 0.0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self.series[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe how long the block took"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self.lock:
+            series = sorted((key, (list(counts), total)) for key, (counts, total) in self.series.items())
+        samples = []
+        for key, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append(("_bucket", key, [("le", _format_value(bound))], cumulative))
+            samples.append(("_sum", key, None, total))
+            samples.append(("_count", key, None, cumulative))
+        return samples
+
+
+class MetricsRegistry:
+    """All metrics of the process, rendered in the Prometheus text format (version 0.0.4)"""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _register(self, metric):
+        with self.lock:
+            if metric.name in self.metrics:
+                raise ValueError(f"Metric {metric.name} already registered")
+            self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), callback=None):
+        return self._register(Gauge(name, documentation, labelnames, callback))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=STAGE_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+# Create global instance
+registry = MetricsRegistry()
+
+# --- Metrics instrumented in app.py, extract_content, generate_notes, retry, loop_watchdog, metering, fair_scheduler and credential_pool ---
+
+jobs_total = registry.counter(
+    "notescraft_jobs_total", "Jobs by final status (completed, failed, rejected, cancelled)", ["status"])
+job_errors_total = registry.counter(
+    "notescraft_job_errors_total", "Failed jobs by error type and stage", ["error_type", "stage"])
+stage_duration = registry.histogram(
+    "notescraft_stage_duration_seconds", "Time spent per job stage", ["stage"], STAGE_BUCKETS)
+gemini_request_duration = registry.histogram(
+    "notescraft_gemini_request_duration_seconds", "Gemini calls including retries, by phase and outcome",
+    ["phase", "outcome"], REQUEST_BUCKETS)
+tokens_total = registry.counter(
+    "notescraft_tokens_total", "Gemini tokens by phase (extraction, generation) and kind (input, output)",
+    ["phase", "kind"])
+rate_limit_wait = registry.histogram(
+    "notescraft_rate_limit_wait_seconds", "Time spent waiting before a Gemini call, by reason (pacing, retry)",
+    ["reason"], REQUEST_BUCKETS)
+jobs_queued = registry.gauge(
+    "notescraft_jobs_queued", "Jobs waiting for an admission slot")
+event_loop_lag = registry.histogram(
+    "notescraft_event_loop_lag_seconds", "How late the event loop woke up from a timed sleep", buckets=LAG_BUCKETS)
+event_loop_stalls_total = registry.counter(
+    "notescraft_event_loop_stalls_total", "Callbacks that blocked the event loop past the threshold, by call site",
+    ["site"])
+notes_cache_lookups = registry.counter(
+    "notescraft_notes_cache_lookups_total", "Upload lookups in the document notes cache", ["result"])
+topic_cache_lookups = registry.counter(
+    "notescraft_topic_cache_lookups_total", "Per-topic lookups in the generated notes cache", ["result"])
+token_cost_total = registry.counter(
+    "notescraft_token_cost_usd_total", "Estimated Gemini spend in USD by phase", ["phase"])
+fair_queue_wait = registry.histogram(
+    "notescraft_fair_queue_wait_seconds", "Time a topic waited for a generation slot", buckets=REQUEST_BUCKETS)
+api_key_requests_total = registry.counter(
+    "notescraft_api_key_requests_total", "Gemini requests per pooled API key by outcome (ok or error type)",
+    ["key", "outcome"])
+api_key_tokens_total = registry.counter(
+    "notescraft_api_key_tokens_total", "Gemini tokens billed to each pooled API key", ["key"])
+quota_rejections_total = registry.counter(
+    "notescraft_quota_rejections_total", "Jobs refused by a token quota (user or global)", ["scope"])
+
+
+def _hit_ratio(counter):
+    with counter.lock:
+        hits = counter.series.get(("hit",), 0)
+        total = hits + counter.series.get(("miss",), 0)
+    return hits / total if total else 0.0
+
+
+cache_hit_ratio = registry.gauge(
+    "notescraft_cache_hit_ratio", "Share of cache lookups that hit since start", ["cache"],
+    callback=lambda: {("notes",): _hit_ratio(notes_cache_lookups), ("topic",): _hit_ratio(topic_cache_lookups)})
+
+
+@contextmanager
+def time_gemini_request(phase):
+    """Observe one Gemini call (retries included) as ok, or error if the block raises"""
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        gemini_request_duration.observe(time.perf_counter() - started, phase=phase, outcome=outcome)
+
+
+def record_tokens(phase, input_tokens, output_tokens):
+    tokens_total.inc(input_tokens or 0, phase=phase, kind="input")
+    tokens_total.inc(output_tokens or 0, phase=phase, kind="output")
+
+
+def render_metrics():
+    return registry.render()
@@ -0,0 +1,422 @@
+"""
+Schema of the notescraft database: its collections, their indexes and validators, and the
+data migrations that bring old documents up to date.
+
+Deploy with `python migrations.py apply` (or let app.on_startup do it); `plan` lists what
+apply would change, `stats` how often each index has been used.
+"""
+import argparse
+import asyncio
+import functools
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from database import get_db
+from db_logger import LOG_RETENTION_DAYS
+from document_index import NOTES_CACHE_TTL_DAYS
+from job_store import ACTIVE_STATUSES, JOB_TTL_HOURS, SESSION_TTL_DAYS, NODE_ID
+from topic_cache import TTL_SECONDS as TOPIC_CACHE_TTL_SECONDS
+
+# Apply the schema when the app starts; "false" when deploys run `python migrations.py apply`
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "true").lower() == "true"
+# What Mongo does with a write that breaks a validator: "error" rejects it, "warn" only logs
+# it; "off" leaves validators alone (e.g. a database user without collMod rights)
+SCHEMA_VALIDATION = os.getenv("SCHEMA_VALIDATION", "error")
+
+DAY_SECONDS = 24 * 60 * 60
+NUMBER = ["int", "long", "double", "decimal"]
+# create_index options compared with what the database has
+INDEX_OPTIONS = ("unique", "sparse", "expireAfterSeconds", "partialFilterExpression")
+# Documents updated per bulk write in data migrations
+BATCH_SIZE = 1000
+
+
+def index(keys, **options):
+    """A field name or [(field, direction)] list plus create_index options, named like Mongo's default"""
+    keys = [(keys, 1)] if isinstance(keys, str) else list(keys)
+    return {"name": "_".join(f"{field}_{direction}" for field, direction in keys), "key": keys, **options}
+
+
+def ttl(field, seconds):
+    return index(field, expireAfterSeconds=seconds)
+
+
+def schema(required, **properties):
+    """$jsonSchema validator. Only requires fields every writer already writes, so instances
+    still running the previous release keep working during a rolling deploy."""
+    return {"$jsonSchema": {"bsonType": "object", "required": list(required), "properties": properties}}
+
+
+STRING = {"bsonType": "string"}
+DATE = {"bsonType": "date"}
+
+COLLECTIONS = {
+    "users": {
+        "validator": schema(["email", "password_hash"],
+                            email=STRING, password_hash=STRING,
+                            active={"bsonType": "bool"},
+                            priority=STRING,
+                            daily_token_quota={"bsonType": NUMBER}),
+        "indexes": [index("email", unique=True)],
+    },
+    "processing_logs": {
+        "validator": schema(["session_id", "filename", "start_time", "status"],
+                            session_id=STRING, filename=STRING, start_time=STRING,
+                            user_email={"bsonType": ["string", "null"]},
+                            status={"enum": ["processing", "success", "failed"]},
+                            downloaded={"bsonType": "bool"},
+                            created_at=DATE),
+        "indexes": [
+            index("session_id", unique=True),
+            # Admin dashboard: newest first, overall, per user and per status
+            index([("start_time", -1)]),
+            index([("user_email", 1), ("start_time", -1)]),
+            index([("status", 1), ("start_time", -1)]),
+            ttl("created_at", LOG_RETENTION_DAYS * DAY_SECONDS),
+        ],
+    },
+    "error_stats": {
+        "validator": schema(["fingerprint", "count"], fingerprint=STRING, count={"bsonType": NUMBER}),
+        "indexes": [index("fingerprint", unique=True), index([("count", -1)])],
+    },
+    "token_usage": {
+        "validator": schema(["user_email", "day"], user_email=STRING, day=STRING),
+        # Today's top users (metering.get_top_users)
+        "indexes": [index([("day", 1), ("total_tokens", -1)])],
+    },
+    "jobs": {
+        "validator": schema(["user_email", "status", "node", "updated_at", "heartbeat_at"],
+                            status={"enum": [*ACTIVE_STATUSES, "completed", "error"]},
+                            node=STRING, updated_at=DATE, heartbeat_at=DATE),
+        "indexes": [ttl("updated_at", JOB_TTL_HOURS * 60 * 60), index([("node", 1), ("status", 1)])],
+    },
+    "web_sessions": {
+        "validator": schema(["updated_at"], updated_at=DATE),
+        "indexes": [ttl("updated_at", SESSION_TTL_DAYS * DAY_SECONDS)],
+    },
+    "topic_cache": {
+        "validator": schema(["text", "last_used"], text=STRING, last_used=DATE),
+        "indexes": [ttl("last_used", TOPIC_CACHE_TTL_SECONDS)],
+    },
+    "notes_cache": {
+        "validator": schema(["notes"], created_at=DATE),
+        "indexes": [ttl("created_at", NOTES_CACHE_TTL_DAYS * DAY_SECONDS)],
+    },
+    "document_signatures": {
+        "validator": schema(["signature"], signature={"bsonType": "array"}, created_at=DATE),
+        "indexes": [ttl("created_at", NOTES_CACHE_TTL_DAYS * DAY_SECONDS)],
+    },
+    "lsh_buckets": {
+        "validator": schema(["docs"], docs={"bsonType": "array"}, updated_at=DATE),
+        "indexes": [ttl("updated_at", NOTES_CACHE_TTL_DAYS * DAY_SECONDS)],
+    },
+}
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _backfill_dates(collection, source, target, drop_source=False):
+    """Set target (a date) from the ISO string in source, on documents that don't have it yet"""
+    from pymongo import UpdateOne
+
+    batch = []
+    for doc in collection.find({target: {"$exists": False}}, {source: 1}):
+        try:
+            # Written with datetime.now().isoformat(), i.e. local time
+            moment = datetime.fromisoformat(doc[source]).astimezone(timezone.utc)
+        except (KeyError, TypeError, ValueError):
+            moment = _now()
+        update = {"$set": {target: moment}}
+        if drop_source:
+            update["$unset"] = {source: ""}
+        batch.append(UpdateOne({"_id": doc["_id"]}, update))
+        if len(batch) == BATCH_SIZE:
+            collection.bulk_write(batch, ordered=False)
+            batch = []
+    if batch:
+        collection.bulk_write(batch, ordered=False)
+
+
+def backfill_log_dates(db):
+    """created_at of processing logs from before the retention TTL, from their start_time"""
+    _backfill_dates(db["processing_logs"], "start_time", "created_at")
+
+
+def backfill_cache_dates(db):
+    """created_at of cached notes and signatures (was an ISO string in created), updated_at of buckets"""
+    for name in ("notes_cache", "document_signatures"):
+        _backfill_dates(db[name], "created", "created_at", drop_source=True)
+    db["lsh_buckets"].update_many({"updated_at": {"$exists": False}}, {"$set": {"updated_at": _now()}})
+
+
+def merge_duplicate_fingerprints(db):
+    """Two first failures at once could each insert their fingerprint; merge them for the unique index"""
+    error_stats = db["error_stats"]
+    duplicates = error_stats.aggregate([
+        {"$group": {"_id": "$fingerprint", "ids": {"$push": "$_id"}, "count": {"$sum": "$count"}}},
+        {"$match": {"ids.1": {"$exists": True}}},
+    ])
+    for duplicate in duplicates:
+        keep, *extra = duplicate["ids"]
+        error_stats.update_one({"_id": keep}, {"$set": {"count": duplicate["count"]}})
+        error_stats.delete_many({"_id": {"$in": extra}})
+
+
+# Run once per database, in this order, before the indexes are built; never rename or reorder
+DATA_MIGRATIONS = [
+    ("0001_processing_logs_created_at", backfill_log_dates),
+    ("0002_cache_created_at", backfill_cache_dates),
+    ("0003_unique_error_fingerprints", merge_duplicate_fingerprints),
+]
+
+
+def _index_key(info):
+    return [(field, int(direction) if isinstance(direction, float) else direction)
+            for field, direction in info["key"]]
+
+
+class Migrations:
+    """
+    Brings the database to the schema declared in COLLECTIONS and DATA_MIGRATIONS.
+
+    apply() compares what is declared with what the database has and only changes the
+    difference: creates missing collections and indexes, updates validators and TTLs in
+    place (collMod), rebuilds an index whose other options changed, and runs each data
+    migration once - claimed in the migrations collection first, so of several instances
+    starting together only one runs it. Indexes the database has but COLLECTIONS doesn't
+    are left alone and reported by index_usage().
+
+    The applied schema's version (a hash of the declarations) is recorded in migrations,
+    so an instance starting on an up-to-date database only reads that one document.
+    """
+
+    def __init__(self, collections=COLLECTIONS, data_migrations=DATA_MIGRATIONS):
+        self.collections = collections
+        self.data_migrations = data_migrations
+
+    def version(self):
+        declared = [self.collections, [name for name, _ in self.data_migrations], SCHEMA_VALIDATION]
+        return hashlib.sha256(json.dumps(declared, sort_keys=True).encode()).hexdigest()[:16]
+
+    def is_current(self, db):
+        applied = db["migrations"].find_one({"_id": "schema"}) or {}
+        return applied.get("version") == self.version()
+
+    # --- Planning ---
+
+    def plan(self, db):
+        """Steps (description, action) that bring db to the declared schema, in order"""
+        existing = set(db.list_collection_names())
+
+        steps = []
+        for name, spec in self.collections.items():
+            steps += self._collection_steps(db, name, spec.get("validator"), name in existing)
+
+        done = {record["_id"] for record in db["migrations"].find({"_id": {"$regex": "^data:"}}, {"_id": 1})}
+        for name, migrate in self.data_migrations:
+            if f"data:{name}" not in done:
+                steps.append((f"data migration {name}", functools.partial(self._run_data_migration, db, name, migrate)))
+
+        for name, spec in self.collections.items():
+            current = db[name].index_information() if name in existing else {}
+            for wanted in spec.get("indexes", []):
+                steps += self._index_steps(db, name, wanted, current)
+        return steps
+
+    def _validator_options(self, validator):
+        if not validator or SCHEMA_VALIDATION == "off":
+            return {}
+        # moderate: documents that were already invalid can still be updated
+        return {"validator": validator, "validationLevel": "moderate", "validationAction": SCHEMA_VALIDATION}
+
+    def _collection_steps(self, db, name, validator, exists):
+        options = self._validator_options(validator)
+        if not exists:
+            return [(f"create collection {name}", functools.partial(self._create_collection, db, name, options))]
+        if options and self._current_options(db, name) != options:
+            return [(f"set validator of {name}", functools.partial(db.command, "collMod", name, **options))]
+        return []
+
+    def _current_options(self, db, name):
+        try:
+            info = next(db.list_collections(filter={"name": name}), {})
+        except Exception as e:
+            print(f"Could not read options of {name}: {e}")
+            return None
+        return {key: value for key, value in info.get("options", {}).items()
+                if key in ("validator", "validationLevel", "validationAction")}
+
+    def _create_collection(self, db, name, options):
+        from pymongo.errors import CollectionInvalid
+
+        try:
+            db.create_collection(name, **options)
+        except CollectionInvalid:
+            # Created by a write in the meantime
+            if options:
+                db.command("collMod", name, **options)
+
+    def _index_steps(self, db, collection, wanted, current):
+        name, key = wanted["name"], wanted["key"]
+        options = {option: wanted[option] for option in INDEX_OPTIONS if option in wanted}
+        create = (f"create index {collection}.{name}",
+                  functools.partial(db[collection].create_index, key, name=name, **options))
+
+        # The same keys under another name (created by hand) count as this index
+        existing = name if name in current else next(
+            (other for other, info in current.items() if _index_key(info) == key), None)
+        if existing is None:
+            return [create]
+
+        info = current[existing]
+        have = {option: info[option] for option in INDEX_OPTIONS if option in info}
+        if existing == name and _index_key(info) == key:
+            if have == options:
+                return []
+            if {**have, "expireAfterSeconds": None} == {**options, "expireAfterSeconds": None} \
+                    and "expireAfterSeconds" in have and "expireAfterSeconds" in options:
+                return [(f"change TTL of {collection}.{name} to {options['expireAfterSeconds']}s",
+                         functools.partial(db.command, "collMod", collection,
+                                           index={"name": name, "expireAfterSeconds": options["expireAfterSeconds"]}))]
+
+        return [(f"drop index {collection}.{existing} (keys or options changed)",
+                 functools.partial(db[collection].drop_index, existing)), create]
+
+    def _run_data_migration(self, db, name, migrate):
+        from pymongo.errors import DuplicateKeyError
+
+        record = {"_id": f"data:{name}"}
+        try:
+            db["migrations"].insert_one({**record, "node": NODE_ID, "started_at": _now()})
+        except DuplicateKeyError:
+            return  # another instance has it
+        try:
+            migrate(db)
+        except Exception:
+            db["migrations"].delete_one(record)
+            raise
+        db["migrations"].update_one(record, {"$set": {"finished_at": _now()}})
+
+    # --- Applying ---
+
+    def apply(self, force=False):
+        """Bring the database to the declared schema unless this version is applied already; True if it ran"""
+        db = get_db()
+        version = self.version()
+        if not force and self.is_current(db):
+            return False
+
+        failed = 0
+        for description, action in self.plan(db):
+            try:
+                action()
+                print(f"Migration: {description}")
+            except Exception as e:
+                # e.g. duplicates blocking a unique index; retried at the next start
+                print(f"Migration step failed ({description}): {e}")
+                failed += 1
+
+        if failed:
+            print(f"Schema applied except {failed} steps, version {version} not recorded")
+            return True
+
+        db["migrations"].update_one(
+            {"_id": "schema"},
+            {"$set": {"version": version, "applied_at": _now(), "node": NODE_ID}},
+            upsert=True
+        )
+        print(f"Schema version {version} applied")
+        return True
+
+    # --- Reporting ---
+
+    def index_usage(self):
+        """
+        Every index of the declared collections with its accesses ($indexStats: counted by the
+        server answering, since it started) and a state: "used", "unused", "ttl" (TTL deletes
+        aren't counted), "built" (no stats from the server), "missing" (declared, not built)
+        or "undeclared" (built, not declared).
+        """
+        db = get_db()
+        usage = []
+        for collection, spec in self.collections.items():
+            declared = {wanted["name"]: wanted for wanted in spec.get("indexes", [])}
+            try:
+                stats = {entry["name"]: entry for entry in db[collection].aggregate([{"$indexStats": {}}])}
+            except Exception as e:
+                print(f"No index stats for {collection}: {e}")
+                stats = {name: {} for name in db[collection].index_information()}
+
+            for name in sorted(declared.keys() | stats.keys() - {"_id_"}):
+                accesses = stats.get(name, {}).get("accesses", {})
+                ops = accesses.get("ops")
+                if name not in stats:
+                    state = "missing"
+                elif name not in declared:
+                    state = "undeclared"
+                elif "expireAfterSeconds" in declared[name]:
+                    state = "ttl"
+                elif ops is None:
+                    state = "built"
+                else:
+                    state = "unused" if ops == 0 else "used"
+                usage.append({"collection": collection, "index": name, "ops": ops,
+                              "since": accesses.get("since"), "state": state})
+        return usage
+
+
+# Create global instance
+migrations = Migrations()
+
+
+def apply_migrations(force=False):
+    return migrations.apply(force)
+
+
+def plan_migrations():
+    return [description for description, _ in migrations.plan(get_db())]
+
+
+def index_usage():
+    return migrations.index_usage()
+
+
+async def migrate_on_startup():
+    """apply_migrations off the event loop (started by app.on_startup)"""
+    if not MIGRATE_ON_STARTUP:
+        return
+    try:
+        await asyncio.to_thread(migrations.apply)
+    except Exception as e:
+        print(f"Schema migration failed: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Schema migrations of the notescraft database")
+    parser.add_argument("command", nargs="?", default="apply", choices=("apply", "plan", "stats"))
+    parser.add_argument("--force", action="store_true",
+                        help="compare every collection even if this schema version is recorded as applied")
+    args = parser.parse_args()
+
+    if args.command == "plan":
+        steps = plan_migrations()
+        print("\n".join(steps) if steps else "Nothing to change")
+    elif args.command == "stats":
+        print(f"{'collection':<20} {'index':<28} {'ops':>10}  state")
+        for entry in index_usage():
+            ops = "-" if entry["ops"] is None else entry["ops"]
+            print(f"{entry['collection']:<20} {entry['index']:<28} {ops:>10}  {entry['state']}")
+    elif not apply_migrations(args.force):
+        print(f"Schema version {migrations.version()} is already applied")
+
+
+if __name__ == "__main__":
+    main()
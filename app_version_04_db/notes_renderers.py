@@ -0,0 +1,214 @@
+import html
+
+# python-docx (generate_word_file) and fitz (PyMuPDF) are imported by the renderers that
+# need them, so importing this module (the app does at startup) loads neither
+from inline_markup import tokenize, BOLD, ITALIC, CODE, SUBSCRIPT, SUPERSCRIPT
+
+# Blocks are written out in chunks of this size so memory stays flat for long notes
+CHUNK_SIZE = 200
+
+# name -> {"render": func(content, file_name) -> path, "extension": ..., "mime_type": ..., "label": ...}
+RENDERERS = {}
+
+
+def register_renderer(name, extension, mime_type, label):
+    """Decorator that adds a renderer for the list of {type, text} notes blocks"""
+    def decorator(func):
+        RENDERERS[name] = {
+            "render": func,
+            "extension": extension,
+            "mime_type": mime_type,
+            "label": label
+        }
+        return func
+    return decorator
+
+
+def get_renderer(name):
+    """Look up a renderer, falling back to Word"""
+    return RENDERERS.get(name) or RENDERERS["docx"]
+
+
+def render_notes(content, file_name, output_format="docx"):
+    """Write notes in the requested format and return the file path"""
+    return get_renderer(output_format)["render"](content, file_name)
+
+
+def iter_blocks(content):
+    """Yield (type, text) for every usable notes block, skipping junk like generate_word_file does"""
+    for item in content:
+        try:
+            item_type = item.get('type')
+            text = item.get('text', '') or ''
+        except Exception as e:
+            print(f"Skipped invalid item: {item} due to error: {e}")
+            continue
+        yield item_type, text
+
+
+# HTML tags per inline_markup style flag, outermost first
+HTML_TAGS = [(CODE, "code"), (BOLD, "b"), (ITALIC, "i"), (SUBSCRIPT, "sub"), (SUPERSCRIPT, "sup")]
+
+
+def inline_html(text):
+    """Escape text for HTML and apply its inline markup"""
+    out = []
+    for part, style in tokenize(text):
+        part = html.escape(part)
+        for flag, tag in reversed(HTML_TAGS):
+            if style & flag:
+                part = f"<{tag}>{part}</{tag}>"
+        out.append(part)
+    return ''.join(out).replace('\n', '<br>')
+
+
+def html_blocks(blocks):
+    """
+    Yield HTML fragments for (type, text) blocks.
+    Consecutive bullet items are wrapped in one <ul>.
+    """
+    in_list = False
+
+    for item_type, text in blocks:
+        if in_list and item_type != 'bullet':
+            yield "</ul>"
+            in_list = False
+        if item_type == 'bullet' and not in_list:
+            yield "<ul>"
+            in_list = True
+
+        if item_type == 'heading':
+            yield f"<h1>{inline_html(text)}</h1>"
+        elif item_type == 'subheading':
+            yield f"<h2>{inline_html(text)}</h2>"
+        elif item_type == 'paragraph':
+            yield f"<p>{inline_html(text)}</p>"
+        elif item_type == 'bullet':
+            yield f"<li>{inline_html(text)}</li>"
+
+    if in_list:
+        yield "</ul>"
+
+
+def chunked_blocks(blocks, size=CHUNK_SIZE):
+    """
+    Group (type, text) blocks into chunks of about `size`.
+    A chunk never ends in the middle of a list, so each chunk renders on its own.
+    """
+    chunk = []
+    for block in blocks:
+        if len(chunk) >= size and not (block[0] == 'bullet' and chunk[-1][0] == 'bullet'):
+            yield chunk
+            chunk = []
+        chunk.append(block)
+    if chunk:
+        yield chunk
+
+
+NOTES_CSS = """
+body { font-family: 'Times New Roman', Times, serif; font-size: 12pt; line-height: 1.5; }
+h1 { font-size: 16pt; text-align: center; margin: 24pt 0 18pt 0; }
+h2 { font-size: 14pt; margin: 18pt 0 12pt 0; }
+p { text-align: justify; margin: 12pt 0; }
+li { margin: 8pt 0; }
+"""
+
+
+@register_renderer("docx", "docx", "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+                   "Word (.docx)")
+def render_docx(content, file_name):
+    from generate_word_file import generate_word_file
+
+    return generate_word_file(content, file_name)
+
+
+@register_renderer("markdown", "md", "text/markdown", "Markdown (.md)")
+def render_markdown(content, file_name):
+    """Notes as Markdown; the AI's inline markup is already Markdown"""
+    file_path = f"{file_name}.md"
+    previous_type = None
+
+    with open(file_path, "w", encoding="utf-8") as f:
+        for chunk in chunked_blocks(iter_blocks(content)):
+            lines = []
+            for item_type, text in chunk:
+                # A blank line ends a list, otherwise the next text continues the last item
+                if previous_type == 'bullet' and item_type != previous_type:
+                    lines.append("")
+                previous_type = item_type
+
+                if item_type == 'heading':
+                    lines.append(f"# {text}\n")
+                elif item_type == 'subheading':
+                    lines.append(f"## {text}\n")
+                elif item_type == 'paragraph':
+                    lines.append(f"{text}\n")
+                elif item_type == 'bullet':
+                    lines.append(f"- {text}")
+                else:
+                    continue
+            f.write("\n".join(lines) + "\n")
+
+    return file_path
+
+
+@register_renderer("html", "html", "text/html", "Web page (.html)")
+def render_html(content, file_name):
+    """Standalone HTML page (inline CSS, no external assets)"""
+    file_path = f"{file_name}.html"
+
+    with open(file_path, "w", encoding="utf-8") as f:
+        f.write('<!DOCTYPE html>\n<html><head><meta charset="utf-8">'
+                '<meta name="viewport" content="width=device-width, initial-scale=1">'
+                f'<title>{html.escape(file_name)}</title><style>{NOTES_CSS}'
+                'body { max-width: 48rem; margin: 2rem auto; padding: 0 1rem; }</style></head><body>\n')
+
+        for chunk in chunked_blocks(iter_blocks(content)):
+            f.write("\n".join(html_blocks(chunk)) + "\n")
+
+        f.write("</body></html>\n")
+
+    return file_path
+
+
+@register_renderer("pdf", "pdf", "application/pdf", "PDF (.pdf)")
+def render_pdf(content, file_name):
+    """
+    PDF through PyMuPDF's Story engine.
+    Each chunk of blocks is its own Story, placed right after the previous one,
+    so only one chunk of layout is in memory at a time.
+    """
+    import fitz  # PyMuPDF
+
+    file_path = f"{file_name}.pdf"
+    mediabox = fitz.paper_rect("a4")
+    page_area = mediabox + (54, 54, -54, -54)  # 0.75 inch margins
+
+    writer = fitz.DocumentWriter(file_path, "compress")
+    device = None
+    where = page_area
+
+    for chunk in chunked_blocks(iter_blocks(content)):
+        story = fitz.Story(html="".join(html_blocks(chunk)), user_css=NOTES_CSS)
+
+        more = True
+        while more:
+            if device is None:
+                device = writer.begin_page(mediabox)
+                where = page_area
+
+            more, filled = story.place(where)
+            story.draw(device)
+
+            if more:
+                writer.end_page()
+                device = None
+            else:
+                where = fitz.Rect(page_area.x0, fitz.Rect(filled).y1, page_area.x1, page_area.y1)
+
+    if device is None:
+        writer.begin_page(mediabox)
+    writer.end_page()
+    writer.close()
+
+    return file_path
@@ -0,0 +1,105 @@
+from pathlib import Path
+
+from minhash import minhash_signature
+from upload_stream import map_file
+
+# Gemini bills every PDF page as an image of about this many tokens, on top of its text
+TOKENS_PER_PAGE = 258
+# Rough characters per token for English text
+CHARS_PER_TOKEN = 4
+
+# A page with less text than this that carries images is treated as a scan
+SCANNED_TEXT_CHARS = 50
+
+# Share of scanned pages above which the whole document counts as scanned
+SCANNED_DOCUMENT_RATIO = 0.8
+
+
+def analyze_page(page, text):
+    """Text density, image count and scanned / born-digital guess for one page"""
+    chars = len(text.strip())
+    images = len(page.get_images(full=False))
+    area_sq_in = max(page.rect.width * page.rect.height / (72 * 72), 1)
+
+    return {
+        "page": page.number + 1,
+        "chars": chars,
+        "text_density": round(chars / area_sq_in, 1),  # characters per square inch
+        "images": images,
+        "scanned": chars < SCANNED_TEXT_CHARS and images > 0,
+    }
+
+
+def document_kind(pages):
+    """'digital', 'scanned', 'mixed' or 'empty' from the per-page results"""
+    if not pages:
+        return "empty"
+
+    scanned = sum(1 for p in pages if p["scanned"])
+    if scanned / len(pages) >= SCANNED_DOCUMENT_RATIO:
+        return "scanned"
+    if scanned:
+        return "mixed"
+    if not any(p["chars"] for p in pages):
+        return "empty"
+    return "digital"
+
+
+def analyze_pdf(file_path, max_pages=None):
+    """
+    One pass over a PDF for everything the later stages need to plan the job:
+    page count, per-page text density, scanned vs born-digital pages, image count,
+    an input token estimate, the bookmark outline (TOC) and a MinHash signature of the
+    text layer for near-duplicate lookup (None for scans).
+    A PDF over `max_pages` pages is rejected anyway, so only its page count is read.
+    Returns (preflight, error). Runs in a worker process (see run.cpu_bound), so it only
+    takes and returns plain data.
+    """
+    # Imported here: the app (and metering) import this module at startup, PyMuPDF is only
+    # needed in the worker process that analyzes the upload
+    import fitz  # PyMuPDF
+
+    try:
+        if Path(file_path).suffix.lower() != '.pdf':
+            return None, "Only PDF files are supported"
+
+        with map_file(file_path) as data:
+            doc = fitz.open(stream=data, filetype="pdf")
+            try:
+                if doc.needs_pass:
+                    return None, "Password protected PDFs are not supported"
+                if max_pages is not None and doc.page_count > max_pages:
+                    return {"page_count": doc.page_count}, None
+
+                texts = [page.get_text("text") for page in doc]
+                pages = [analyze_page(page, text) for page, text in zip(doc, texts)]
+                outline = [
+                    {"level": level, "title": title.strip(), "page": page}
+                    for level, title, page in doc.get_toc(simple=True)
+                    if title.strip() and page > 0
+                ]
+            finally:
+                doc.close()
+
+        total_chars = sum(p["chars"] for p in pages)
+
+        return {
+            "page_count": len(pages),
+            "kind": document_kind(pages),
+            "scanned_pages": sum(1 for p in pages if p["scanned"]),
+            "image_count": sum(p["images"] for p in pages),
+            "estimated_tokens": len(pages) * TOKENS_PER_PAGE + total_chars // CHARS_PER_TOKEN,
+            "outline": outline,
+            "pages": pages,
+            "signature": minhash_signature("\n".join(texts)),
+        }, None
+
+    except Exception as e:
+        return None, f"Error reading PDF: {str(e)}"
+
+
+def preflight_summary(preflight):
+    """The per-document part of a preflight result (no per-page list or signature), for logging"""
+    return {key: value for key, value in preflight.items() if key not in ("pages", "outline", "signature")} | {
+        "outline_entries": len(preflight.get("outline", [])),
+    }
@@ -0,0 +1,72 @@
+import os
+from pathlib import Path
+
+# "auto": slim PDFs the pre-flight found images in, "off": always send the upload as is
+PDF_SLIMMING = os.getenv("PDF_SLIMMING", "auto")
+
+# Resolution scanned pages are re-rendered at, and embedded images are brought down to.
+# 150 DPI keeps body text comfortably legible for OCR.
+TARGET_DPI = int(os.getenv("PDF_SLIMMING_DPI", "150"))
+JPEG_QUALITY = 75
+
+
+def needs_slimming(preflight):
+    """Only image-heavy documents are worth the extra pass"""
+    return PDF_SLIMMING != "off" and bool(preflight) and preflight.get("image_count", 0) > 0
+
+
+def rasterize_page(target, page, dpi=TARGET_DPI):
+    """Add `page` to `target` as one JPEG at `dpi` (for scans, which have no text layer to lose)"""
+    pix = page.get_pixmap(dpi=dpi)
+    new_page = target.new_page(width=page.rect.width, height=page.rect.height)
+    new_page.insert_image(new_page.rect, stream=pix.tobytes("jpeg", jpg_quality=JPEG_QUALITY))
+
+
+def slim_pdf(file_path, preflight, dpi=TARGET_DPI):
+    """
+    Write a smaller copy of the PDF for the AI request.
+    Scanned pages are re-rendered at `dpi`; on born-digital pages only oversized embedded
+    images are recompressed, so their text stays text. Unused objects are dropped on save.
+    Returns (path of the slimmed copy, size before, size after); the path is None when
+    slimming does not make the file smaller, and the original should be sent as is.
+    The caller deletes the copy. Runs in a worker process (run.cpu_bound).
+    """
+    import fitz  # PyMuPDF (loaded in the worker process only)
+
+    size_before = os.path.getsize(file_path)
+    scanned = {p["page"] for p in preflight.get("pages", []) if p["scanned"]}
+
+    src = fitz.open(file_path)
+    out = fitz.open()
+    try:
+        # Page numbers stay the same, so the pre-flight outline still applies to the copy
+        digital_from = None
+        for page in src:
+            if page.number + 1 not in scanned:
+                if digital_from is None:
+                    digital_from = page.number
+                continue
+            # copy runs of born-digital pages in one go so their shared resources are copied once
+            if digital_from is not None:
+                out.insert_pdf(src, from_page=digital_from, to_page=page.number - 1)
+                digital_from = None
+            rasterize_page(out, page, dpi)
+        if digital_from is not None:
+            out.insert_pdf(src, from_page=digital_from, to_page=src.page_count - 1)
+
+        # Recompress embedded images above the target resolution (PyMuPDF 1.26+)
+        if hasattr(out, "rewrite_images"):
+            out.rewrite_images(dpi_threshold=dpi + 50, dpi_target=dpi, quality=JPEG_QUALITY)
+
+        slim_path = Path(file_path).with_name(f"{Path(file_path).stem}_slim.pdf")
+        out.save(slim_path, garbage=4, deflate=True, clean=True)
+    finally:
+        out.close()
+        src.close()
+
+    size_after = os.path.getsize(slim_path)
+    if size_after >= size_before:
+        os.unlink(slim_path)
+        return None, size_before, size_before
+
+    return slim_path, size_before, size_after
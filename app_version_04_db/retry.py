@@ -0,0 +1,150 @@
+import random
+import re
+import time
+
+from error_handler import error_handler
+from backend_health import backend_health
+from tracing import span
+from metrics import rate_limit_wait
+
+
+# Whole-job budget shared by extraction and generation (matches the 15 minute ETA cap in app.py)
+JOB_DEADLINE_SECONDS = 15 * 60
+# How often a call waiting for the half-open probe call checks again
+PROBE_WAIT_SECONDS = 1.0
+
+
+class RetryPolicy:
+    """
+    Backoff settings for one error class.
+    Delays use exponential backoff with full jitter: uniform(0, min(max_delay, base_delay * multiplier^n)).
+    """
+
+    def __init__(self, max_attempts, base_delay, max_delay, multiplier=2.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+
+    def backoff(self, attempt):
+        """Delay in seconds before retry number `attempt` (1-based)"""
+        ceiling = min(self.max_delay, self.base_delay * (self.multiplier ** (attempt - 1)))
+        return random.uniform(0, ceiling)
+
+
+# Policies per ErrorHandler error type. Types without a policy are never retried.
+RETRY_POLICIES = {
+    "API_RATE_LIMIT": RetryPolicy(max_attempts=6, base_delay=5, max_delay=60),
+    "API_TIMEOUT": RetryPolicy(max_attempts=3, base_delay=2, max_delay=20),
+    "API_CONNECTION_ERROR": RetryPolicy(max_attempts=4, base_delay=1, max_delay=15),
+    "NOTES_GENERATION_ERROR": RetryPolicy(max_attempts=2, base_delay=2, max_delay=10),
+    "PROCESSING_ERROR": RetryPolicy(max_attempts=2, base_delay=2, max_delay=10),
+}
+
+# Server retry hints as they show up in Gemini error messages:
+#   google.genai:            'retryDelay': '37s'
+#   google.generativeai:     retry_delay { seconds: 37 }
+#   plain text:              "Please retry in 37.5s" / "Retry-After: 37"
+RETRY_HINT_PATTERNS = [
+    re.compile(r"retryDelay['\"]?\s*:\s*['\"]?(\d+(?:\.\d+)?)s", re.IGNORECASE),
+    re.compile(r"retry_delay\s*\{\s*seconds:\s*(\d+)", re.IGNORECASE),
+    re.compile(r"retry in (\d+(?:\.\d+)?)\s*s", re.IGNORECASE),
+    re.compile(r"retry-after['\"]?\s*[:=]\s*['\"]?(\d+(?:\.\d+)?)", re.IGNORECASE),
+]
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the AI service while backend_health has it marked down"""
+
+
+class Deadline:
+    """Time budget for one job. Retries never sleep past it."""
+
+    def __init__(self, seconds=JOB_DEADLINE_SECONDS):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+
+def get_retry_after(error):
+    """
+    Read a server-provided retry delay (seconds) from an exception, if there is one.
+    Checks an HTTP Retry-After header first, then the hint patterns in the message.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers:
+        try:
+            value = headers.get("retry-after") or headers.get("Retry-After")
+            if value:
+                return float(value)
+        except (TypeError, ValueError):
+            pass
+
+    message = str(error)
+    for pattern in RETRY_HINT_PATTERNS:
+        match = pattern.search(message)
+        if match:
+            return float(match.group(1))
+
+    return None
+
+
+def call_with_retry(func, *args, deadline=None, breaker=backend_health, context="", **kwargs):
+    """
+    Call `func(*args, **kwargs)` with per-error-class retries.
+
+    The exception is classified with ErrorHandler.classify_error; only types that have
+    a RetryPolicy are retried. Server retry hints override the computed backoff, and
+    no retry is attempted if it would overrun the job deadline. Every outcome is fed to
+    `breaker` (backend_health), which refuses calls while the backend is marked down and
+    lets one probe call out at a time while half open; other calls wait for its outcome.
+    Raises the last exception (or CircuitOpenError) when giving up.
+    """
+    attempt = 0
+
+    while True:
+        if breaker and not breaker.allow_request():
+            # Half open with the probe call still out: wait for its outcome instead of failing
+            if not breaker.is_down() and not (deadline and deadline.remaining() <= PROBE_WAIT_SECONDS):
+                time.sleep(PROBE_WAIT_SECONDS)
+                continue
+            raise CircuitOpenError(
+                f"AI service connection circuit open - retry in {breaker.seconds_until_probe()}s"
+            )
+
+        attempt += 1
+
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            error_type = error_handler.classify_error(str(e))
+            if breaker:
+                # Errors that are not about the backend (bad JSON, bad file) count for nothing
+                breaker.record_outcome(error_type)
+
+            policy = RETRY_POLICIES.get(error_type)
+            if not policy or attempt >= policy.max_attempts:
+                raise
+
+            delay = get_retry_after(e)
+            if delay is None:
+                delay = policy.backoff(attempt)
+
+            if deadline and delay >= deadline.remaining():
+                print(f"{context}: giving up on {error_type}, retry would exceed job deadline")
+                raise
+
+            print(f"{context}: {error_type} on attempt {attempt}, retrying in {delay:.1f}s")
+            with span("retry_wait", error_type=error_type, attempt=attempt, delay=round(delay, 2)):
+                time.sleep(delay)
+            rate_limit_wait.observe(delay, reason="retry")
+            continue
+
+        if breaker:
+            breaker.record_outcome(None)
+        return result
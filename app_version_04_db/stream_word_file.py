@@ -0,0 +1,152 @@
+import io
+import re
+import zipfile
+from xml.sax.saxutils import escape
+
+from inline_markup import tokenize, BOLD, ITALIC, CODE, SUBSCRIPT, SUPERSCRIPT
+
+# Characters python-docx refuses to put in XML (the item is skipped, same as generate_word_file)
+INVALID_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+# Run text is split into <w:t>, <w:tab/> and <w:br/> the same way python-docx does it
+RUN_TEXT_PATTERN = re.compile(r'[^\t\r\n]+|\t|[\r\n]')
+
+# Plain runs take everything from the paragraph style; only inline markup carries properties
+CODE_FONT = 'Courier New'
+
+_run_properties = {}
+
+
+def run_properties(style):
+    """<w:rPr> for an inline_markup style, in schema order (built once per style)"""
+    properties = _run_properties.get(style)
+    if properties is None:
+        parts = []
+        if style & CODE:
+            parts.append(f'<w:rFonts w:ascii="{CODE_FONT}" w:hAnsi="{CODE_FONT}"/>')
+        if style & BOLD:
+            parts.append('<w:b/>')
+        if style & ITALIC:
+            parts.append('<w:i/>')
+        if style & SUBSCRIPT:
+            parts.append('<w:vertAlign w:val="subscript"/>')
+        elif style & SUPERSCRIPT:
+            parts.append('<w:vertAlign w:val="superscript"/>')
+        properties = f'<w:rPr>{"".join(parts)}</w:rPr>' if parts else ''
+        _run_properties[style] = properties
+    return properties
+
+
+_template = None
+
+
+def get_template():
+    """
+    Parts of an empty notes document, built once per process with python-docx.
+    Returns a dict with every zip entry except word/document.xml (`parts`), the XML
+    around the body paragraphs and the notes style ids.
+    """
+    global _template
+    if _template is None:
+        from generate_word_file import create_document, NOTES_STYLES
+
+        doc = create_document()
+
+        buffer = io.BytesIO()
+        doc.save(buffer)
+
+        with zipfile.ZipFile(buffer) as package:
+            parts = [(info, package.read(info.filename)) for info in package.infolist()
+                     if info.filename != 'word/document.xml']
+            document_xml = package.read('word/document.xml').decode('utf-8')
+
+        body_start = document_xml.index('<w:body>') + len('<w:body>')
+        body_end = document_xml.index('<w:sectPr')
+
+        _template = {
+            "parts": parts,
+            "document_head": document_xml[:body_start],
+            "document_tail": document_xml[body_end:],
+            "style_ids": {item_type: doc.styles[style[0]].style_id for item_type, style in NOTES_STYLES.items()},
+        }
+
+    return _template
+
+
+def runs_xml(text):
+    """WordprocessingML runs for one block of notes text"""
+    out = []
+    for part, style in tokenize(text):
+        out.append('<w:r>')
+        out.append(run_properties(style))
+
+        for piece in RUN_TEXT_PATTERN.findall(part):
+            if piece == '\t':
+                out.append('<w:tab/>')
+            elif piece in '\r\n':
+                out.append('<w:br/>')
+            elif len(piece.strip()) < len(piece):
+                out.append(f'<w:t xml:space="preserve">{escape(piece)}</w:t>')
+            else:
+                out.append(f'<w:t>{escape(piece)}</w:t>')
+        out.append('</w:r>')
+
+    return ''.join(out)
+
+
+def paragraph_xml(item, style_id):
+    """One <w:p> for a {type, text} block pointing at its notes style"""
+    text = item.get('text', '') or ''
+    if INVALID_XML_CHARS.search(text):
+        raise ValueError("All strings must be XML compatible")
+
+    return f'<w:p><w:pPr><w:pStyle w:val="{style_id}"/></w:pPr>{runs_xml(text)}</w:p>'
+
+
+def stream_word_file(content, file_name, flush_every=200):
+    """
+    Write notes straight into a .docx zip without building a python-docx Document.
+    Paragraph XML is streamed into word/document.xml in batches of `flush_every`,
+    so memory stays flat no matter how many blocks there are.
+    Produces the same document as generate_word_file.
+    """
+    template = get_template()
+    style_ids = template["style_ids"]
+
+    file_path = f"{file_name}.docx"
+    with zipfile.ZipFile(file_path, 'w', compression=zipfile.ZIP_DEFLATED) as package:
+        for info, data in template["parts"]:
+            if info.filename == '[Content_Types].xml':
+                package.writestr(info.filename, data)
+                break
+
+        with package.open('word/document.xml', 'w') as document:
+            document.write(template["document_head"].encode('utf-8'))
+
+            pending = []
+
+            for item in content:
+                try:
+                    item_type = item.get('type')
+                    if item_type not in style_ids:
+                        continue
+
+                    pending.append(paragraph_xml(item, style_ids[item_type]))
+                except Exception as e:
+                    print(f"Skipped invalid item: {item} due to error: {e}")
+                    continue
+
+                if len(pending) >= flush_every:
+                    document.write(''.join(pending).encode('utf-8'))
+                    pending.clear()
+
+            document.write(''.join(pending).encode('utf-8'))
+            document.write(template["document_tail"].encode('utf-8'))
+
+        # Remaining parts go in after the body
+        for info, data in template["parts"]:
+            if info.filename == '[Content_Types].xml':
+                continue
+            package.writestr(info.filename, data)
+
+    return file_path
@@ -0,0 +1,125 @@
+import hashlib
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime
+
+from database import get_collection
+
+# Entries kept in this process (least recently used dropped first)
+MAX_MEMORY_ENTRIES = 2000
+# Entries not used for this long expire, in memory and in Mongo (TTL index, see migrations)
+TTL_SECONDS = int(os.getenv("TOPIC_CACHE_TTL_DAYS", "30")) * 24 * 60 * 60
+
+
+def topic_key(topic, content, model_name, instructions):
+    """
+    Cache key for one (topic, content) generation request.
+    Case, Unicode form and whitespace / line breaks from the PDF layout don't change the key;
+    the model and system prompt do, so prompt changes never serve stale notes.
+    """
+    normalized = unicodedata.normalize("NFKC", f"{topic}\n{content}").lower()
+    normalized = re.sub(r"\s+", " ", normalized).strip()
+    prompt_hash = hashlib.sha256(instructions.encode()).hexdigest()[:16]
+    return hashlib.sha256(f"{model_name}|{prompt_hash}|{normalized}".encode()).hexdigest()
+
+
+class TopicCache:
+    """
+    Generated notes per topic, shared across documents and users.
+
+    A small in-process LRU sits in front of the Mongo 'topic_cache' collection,
+    whose TTL index on last_used drops entries nobody has used for TTL_SECONDS.
+    Also keeps hit / token counters so the savings can be reported.
+    """
+
+    def __init__(self, max_entries=MAX_MEMORY_ENTRIES, ttl_seconds=TTL_SECONDS):
+        self.entries = get_collection('topic_cache')
+
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.memory = OrderedDict()  # key -> (entry, stored_at)
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.tokens_saved = 0
+        self.tokens_spent = 0
+
+    def _remember(self, key, entry):
+        with self.lock:
+            self.memory[key] = (entry, time.monotonic())
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_entries:
+                self.memory.popitem(last=False)
+
+    def get(self, key):
+        """Cached {"text", "tokens"} for a topic key, or None"""
+        with self.lock:
+            cached = self.memory.get(key)
+            if cached and time.monotonic() - cached[1] < self.ttl_seconds:
+                self.memory.move_to_end(key)
+                entry = cached[0]
+            else:
+                self.memory.pop(key, None)
+                entry = None
+
+        if entry is None:
+            try:
+                stored = self.entries.find_one_and_update(
+                    {"_id": key},
+                    {"$set": {"last_used": datetime.now()}, "$inc": {"hits": 1}}
+                )
+            except Exception as e:
+                # The cache is an optimisation, never a reason to fail generation
+                print(f"Topic cache lookup failed: {e}")
+                stored = None
+            if stored:
+                entry = {"text": stored["text"], "tokens": stored.get("tokens", 0)}
+                self._remember(key, entry)
+
+        with self.lock:
+            if entry:
+                self.hits += 1
+                self.tokens_saved += entry["tokens"]
+            else:
+                self.misses += 1
+        return entry
+
+    def put(self, key, text, tokens):
+        """Store the generated notes for a topic and the tokens they cost"""
+        entry = {"text": text, "tokens": tokens}
+        self._remember(key, entry)
+        with self.lock:
+            self.tokens_spent += tokens
+
+        try:
+            self.entries.update_one(
+                {"_id": key},
+                {"$set": {"text": text, "tokens": tokens, "last_used": datetime.now()},
+                 "$setOnInsert": {"created": datetime.now(), "hits": 0}},
+                upsert=True
+            )
+        except Exception as e:
+            print(f"Topic cache store failed: {e}")
+
+    def get_summary(self):
+        """Hit rate and share of generation tokens saved since start"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            tokens = self.tokens_saved + self.tokens_spent
+            return {
+                "entries_in_memory": len(self.memory),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "tokens_saved": self.tokens_saved,
+                "tokens_saved_share": round(self.tokens_saved / tokens, 3) if tokens else 0.0,
+            }
+
+
+# Create global instance
+topic_cache = TopicCache()
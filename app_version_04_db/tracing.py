@@ -0,0 +1,272 @@
+import contextvars
+import functools
+import importlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+# Where finished traces go, comma separated: "console", "file", "none",
+# or "package.module:ExporterClass" for anything with an export(spans) method
+TRACE_EXPORTERS = os.getenv("TRACE_EXPORTERS", "console,file")
+TRACE_FOLDER = os.getenv("TRACE_FOLDER", "logs")
+# Unfinished traces older than this are dropped (uploads nobody confirmed)
+MAX_TRACE_AGE_SECONDS = 2 * 60 * 60
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """One timed step of a job. Spans outside a trace are timed but never exported."""
+
+    def __init__(self, name, trace_id=None, parent_id=None, attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.start_time = datetime.now()
+        self.thread = threading.current_thread().name
+        self.status = "ok"
+        self.error = None
+        self._start = time.perf_counter()
+        self._end = None
+
+    @property
+    def recording(self):
+        return self.trace_id is not None
+
+    @property
+    def duration(self):
+        """Seconds, up to now while the span is still open"""
+        return (self._end or time.perf_counter()) - self._start
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def record_error(self, error):
+        self.status = "error"
+        self.error = str(error)[:500]
+
+    def record_result(self, result):
+        """Mark the span failed when a step returns one of error_handler's error dicts"""
+        if isinstance(result, dict) and "error_type" in result:
+            self.record_error(result["error_type"])
+
+    def end(self):
+        if self._end is None:
+            self._end = time.perf_counter()
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_time": self.start_time.isoformat(),
+            "duration": round(self.duration, 4),
+            "status": self.status,
+            "error": self.error,
+            "thread": self.thread,
+            "attributes": self.attributes,
+        }
+
+
+class ConsoleExporter:
+    """Prints a finished trace as time per step: count, total seconds and share of the whole job"""
+
+    def export(self, spans):
+        by_id = {span.span_id: span for span in spans}
+        root = next(span for span in spans if span.parent_id is None)
+
+        def path(span):
+            names = []
+            while span.parent_id in by_id:
+                names.append(span.name)
+                span = by_id[span.parent_id]
+            return "/".join(reversed(names))
+
+        steps = defaultdict(lambda: [0, 0.0, 0])  # path -> [count, seconds, errors]
+        order = []
+        for span in sorted(spans, key=lambda s: s._start):
+            if span is root:
+                continue
+            key = path(span)
+            if key not in steps:
+                order.append(key)
+            steps[key][0] += 1
+            steps[key][1] += span.duration
+            steps[key][2] += span.status == "error"
+
+        first_seen = {key: i for i, key in enumerate(order)}
+        details = " ".join(f"{key}={value}" for key, value in root.attributes.items())
+        print(f"[trace {root.trace_id[:8]}] {root.name} {root.duration:.2f}s {root.status} {details}")
+        for key in sorted(order, key=lambda k: (first_seen.get(k.split("/")[0], len(order)), k)):
+            count, seconds, errors = steps[key]
+            indent = "  " * key.count("/")
+            share = seconds / root.duration if root.duration else 0
+            print(f"  {indent}{key.rsplit('/', 1)[-1]:<{28 - len(indent)}}{count:>4}x{seconds:>9.2f}s{share:>6.0%}"
+                  + (f"  {errors} failed" if errors else ""))
+
+
+class FileExporter:
+    """Appends every span of a finished trace as one JSON line to logs/traces_<year>_<month>.jsonl"""
+
+    def __init__(self, folder=TRACE_FOLDER):
+        self.folder = Path(folder)
+        self.lock = threading.Lock()
+
+    def export(self, spans):
+        now = datetime.now()
+        trace_file = self.folder / f"traces_{now.year}_{now.month:02d}.jsonl"
+        lines = "".join(json.dumps(span.to_dict(), default=str) + "\n" for span in spans)
+        with self.lock:
+            # Created on the first trace written, not when the module is imported
+            self.folder.mkdir(exist_ok=True)
+            with open(trace_file, "a", encoding="utf-8") as f:
+                f.write(lines)
+
+
+def load_exporters(spec=TRACE_EXPORTERS):
+    """Exporter instances for a TRACE_EXPORTERS value"""
+    exporters = []
+    for name in filter(None, (part.strip() for part in spec.split(","))):
+        if name == "console":
+            exporters.append(ConsoleExporter())
+        elif name == "file":
+            exporters.append(FileExporter())
+        elif ":" in name:
+            module_name, class_name = name.split(":", 1)
+            exporters.append(getattr(importlib.import_module(module_name), class_name)())
+        elif name != "none":
+            print(f"Unknown trace exporter '{name}' ignored")
+    return exporters
+
+
+class Tracer:
+    """
+    Per-job tracing: one trace per upload, with a span for each step of the job.
+
+    The current span lives in a context variable, so spans nest by themselves within a
+    task or thread. run.io_bound / thread pools don't copy contexts, so work handed to
+    them is wrapped with carry_context() to stay in the job's trace. Finished traces go
+    to every exporter once their root span ends; exporter errors never reach the job.
+    """
+
+    def __init__(self, exporters=None):
+        self.exporters = load_exporters() if exporters is None else list(exporters)
+        self.traces = {}  # trace_id -> (root span, finished spans)
+        self.lock = threading.Lock()
+
+    def add_exporter(self, exporter):
+        self.exporters.append(exporter)
+
+    def start_trace(self, name, **attributes):
+        """Open a trace and return its root span (end it with end_trace)"""
+        root = Span(name, uuid.uuid4().hex, attributes=attributes)
+        with self.lock:
+            # Roots that were never ended (abandoned uploads) don't pile up
+            for trace_id, (old_root, _) in list(self.traces.items()):
+                if old_root.duration > MAX_TRACE_AGE_SECONDS:
+                    del self.traces[trace_id]
+            self.traces[root.trace_id] = (root, [])
+        return root
+
+    def end_trace(self, root, status=None):
+        """End the root span and export the whole trace (no-op if already ended)"""
+        if root is None:
+            return
+        with self.lock:
+            trace = self.traces.pop(root.trace_id, None)
+        if trace is None:
+            return
+
+        root.end()
+        if status:
+            root.status = status
+        spans = [root] + trace[1]
+        for exporter in self.exporters:
+            try:
+                exporter.export(spans)
+            except Exception as e:
+                print(f"Trace export failed ({type(exporter).__name__}): {e}")
+
+    def attach(self, span):
+        """Make span the current span of this task / thread"""
+        return _current_span.set(span)
+
+    @contextmanager
+    def activate(self, span):
+        """Make span the current span inside the block"""
+        token = _current_span.set(span)
+        try:
+            yield span
+        finally:
+            _current_span.reset(token)
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """Time the block as a child of the current span; exceptions mark it failed"""
+        parent = _current_span.get()
+        if parent is not None and parent.recording:
+            span = Span(name, parent.trace_id, parent.span_id, attributes)
+        else:
+            span = Span(name, attributes=attributes)
+
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_error(f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end()
+            if span.recording:
+                with self.lock:
+                    trace = self.traces.get(span.trace_id)
+                    if trace:
+                        trace[1].append(span)
+
+    @contextmanager
+    def trace(self, name, **attributes):
+        """A whole trace in one block"""
+        root = self.start_trace(name, **attributes)
+        try:
+            with self.activate(root):
+                yield root
+        except BaseException as e:
+            root.record_error(f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            self.end_trace(root)
+
+
+# Create global instance
+tracer = Tracer()
+
+
+def span(name, **attributes):
+    return tracer.span(name, **attributes)
+
+
+def traced(name):
+    """Decorator: run every call of the function inside a span (the function name goes in 'call')"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with tracer.span(name, call=func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def carry_context(func):
+    """func bound to a copy of the current context, for run.io_bound and thread pools.
+    Take one per submitted call - a context can't be entered by two threads at once."""
+    return functools.partial(contextvars.copy_context().run, func)
@@ -0,0 +1,143 @@
+import hashlib
+import mmap
+import os
+from contextlib import contextmanager
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+
+# Uploads are copied in chunks this size, so memory per upload stays flat whatever the file size
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Extra bytes allowed on top of the file limit for the multipart envelope (boundaries, headers)
+MULTIPART_OVERHEAD = 64 * 1024
+
+PDF_MAGIC = b"%PDF-"
+
+
+class UploadRejected(Exception):
+    """Upload was stopped part way (too large, wrong type)"""
+
+
+class StoredUpload:
+    """An upload that has been written to disk, with its size and content hash"""
+
+    def __init__(self, path, size, sha256):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+
+    @property
+    def size_mb(self):
+        return self.size / (1024 * 1024)
+
+    def discard(self):
+        """Delete the file (cancelled or invalid upload)"""
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def store_upload(source, suffix=".pdf", max_bytes=None, chunk_size=UPLOAD_CHUNK_SIZE):
+    """
+    Copy a file-like upload to a temp file chunk by chunk, hashing as it goes.
+    Raises UploadRejected as soon as the data is not a PDF or passes max_bytes;
+    the partial file is removed.
+    """
+    sha256 = hashlib.sha256()
+    size = 0
+
+    with NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
+        path = Path(temp_file.name)
+        try:
+            while True:
+                chunk = source.read(chunk_size)
+                if not chunk:
+                    break
+
+                if size == 0 and not chunk.startswith(PDF_MAGIC):
+                    raise UploadRejected("Only PDF files are supported")
+
+                size += len(chunk)
+                if max_bytes and size > max_bytes:
+                    raise UploadRejected(f"File too large. Maximum size is {max_bytes / (1024 * 1024):.0f}MB.")
+
+                sha256.update(chunk)
+                temp_file.write(chunk)
+
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        except Exception:
+            temp_file.close()
+            os.unlink(path)
+            raise
+
+    return StoredUpload(path, size, sha256.hexdigest())
+
+
+@contextmanager
+def map_file(path):
+    """
+    Read-only memory map of a stored upload, as a memoryview.
+    Pages are loaded by the OS on demand and shared between readers,
+    so later stages can read the whole file without copying it onto the heap.
+    Anything built on the view (e.g. a fitz document) must be closed before the block ends.
+    """
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapped)
+        try:
+            yield view
+        finally:
+            view.release()
+            mapped.close()
+
+
+class UploadLimitMiddleware:
+    """
+    ASGI middleware that stops oversized upload requests while they are still arriving,
+    instead of after the multipart body has been spooled to disk.
+    Requests announcing a too-large Content-Length get 413 straight away;
+    chunked bodies are counted and cut off at the limit.
+    """
+
+    def __init__(self, app, max_bytes, path_marker="/upload/"):
+        self.app = app
+        self.max_bytes = max_bytes + MULTIPART_OVERHEAD
+        self.path_marker = path_marker
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or self.path_marker not in scope["path"]:
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > self.max_bytes:
+            await self._reject(send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise UploadRejected("Upload exceeded size limit")
+            return message
+
+        try:
+            await self.app(scope, limited_receive, send)
+        except UploadRejected:
+            print(f"Upload aborted after {received / (1024 * 1024):.1f}MB: over the size limit")
+            await self._reject(send)
+
+    @staticmethod
+    async def _reject(send):
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"text/plain"), (b"connection", b"close")],
+        })
+        await send({"type": "http.response.body", "body": b"File too large"})